@@ -39,7 +39,7 @@ async function processPendingPatients() {
     expectedDiagnosis: { $exists: true, $ne: "" },
   })
     .sort({ createdAt: 1 }) // FIFO: Process OLDER patients first (Fair Queue)
-    .limit(20); // Fetch 20 to check. We will only process 1.
+    .limit(20); // Fetch 20 to check. All pending ones go out in one batch.
 
   if (candidates.length === 0) {
     console.log("✅ No pending patients found in queue.");
@@ -50,57 +50,55 @@ async function processPendingPatients() {
     `📋 Found ${candidates.length} candidates. Checking for missing assessments...`,
   );
 
-  // 2. Find the first candidate that DOES NOT have an AI Assessment yet
+  // 2. Keep only candidates that DO NOT have an AI Assessment yet
+  const pending: typeof candidates = [];
   for (const patient of candidates) {
     const existingAssessment = await AiAssessment.findOne({
       patientId: patient._id,
     });
-
-    // If assessment exists, this patient is done. Skip to next.
-    if (existingAssessment) {
-      continue;
+    if (!existingAssessment) {
+      pending.push(patient);
     }
+  }
 
-    // --- FOUND A PATIENT TO PROCESS ---
-    console.log(`🔍 Processing Patient: ${patient.fullName} (${patient._id})`);
-
-    try {
-      const aiPayload = AiTriageService.transformData(patient.toObject());
+  if (pending.length === 0) {
+    console.log("ℹ️ All candidates in this batch were already processed.");
+    return;
+  }
 
-      console.log(`🚀 Sending to AI Service...`);
-      const aiResponse = await AiTriageService.getTriagePrediction(aiPayload);
+  // 3. Send the whole batch in one call. The AI server bounds its own
+  // concurrency and reports failures per patient.
+  console.log(`🔍 Processing ${pending.length} patients in one batch...`);
+  const payloads = pending.map((patient) =>
+    AiTriageService.transformData(patient.toObject()),
+  );
+  const results = await AiTriageService.getTriageBatchPredictions(payloads);
 
-      if (aiResponse) {
-        await AiAssessment.create({
-          patientId: patient._id,
-          doctorId: patient.assignedDoctorId,
-          aiResponse: {
-            ...aiResponse,
-            analyzedAt: new Date(),
-          },
-          doctorFeedback: null,
-        });
-        console.log(`✅ AI Success for ${patient.fullName}`);
+  if (!results) {
+    console.warn("⚠️ Batch call failed. Will retry next cycle.");
+    return;
+  }
 
-        // STOP HERE: We processed 1 patient successfully.
-        // Break the loop to respect the Rate Limit.
-        return;
-      }
-    } catch (error: any) {
-      if (error.message && error.message.includes("429")) {
-        console.warn(
-          "⚠️ Rate Limit Hit. Pausing. Will retry this patient next cycle.",
-        );
-        return; // Stop trying for now
-      } else {
-        console.error(`❌ AI Failed for ${patient.fullName}:`, error.message);
-        // Note: We do NOT break here. We could try the next patient,
-        // OR we can stop to be safe.
-        // Let's stop to prevent error loops consuming quota.
-        return;
-      }
+  for (const item of results) {
+    const patient = pending[item.index];
+    if (item.status === "ok" && item.result) {
+      await AiAssessment.create({
+        patientId: patient._id,
+        doctorId: patient.assignedDoctorId,
+        aiResponse: {
+          ...item.result,
+          analyzedAt: new Date(),
+        },
+        doctorFeedback: null,
+      });
+      console.log(`✅ AI Success for ${patient.fullName}`);
+    } else if (item.retryable) {
+      // 429/503: leave the patient pending for the next cycle
+      console.warn(
+        `⚠️ Rate Limit Hit for ${patient.fullName}. Will retry next cycle.`,
+      );
+    } else {
+      console.error(`❌ AI Failed for ${patient.fullName}:`, item.error);
     }
   }
-
-  console.log("ℹ️ All candidates in this batch were already processed.");
 }
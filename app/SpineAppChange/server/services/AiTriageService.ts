@@ -85,6 +85,33 @@ export const AiTriageService = {
     }
   },
 
+  // 2b. Batched Call (one request for many patients, per-patient results)
+  getTriageBatchPredictions: async (formattedJsonList: any[]) => {
+    try {
+      console.log(
+        `🚀 AI SERVICE: Sending batch of ${formattedJsonList.length} to /triage_batch`,
+      );
+      const response = await axios.post(
+        "http://127.0.0.1:8000/triage_batch",
+        formattedJsonList,
+        { timeout: 120000 },
+      );
+      console.log(
+        `✅ AI SERVICE: Batch done (${response.data.succeeded} ok, ${response.data.failed} failed)`,
+      );
+      return response.data.results as {
+        index: number;
+        status: "ok" | "error";
+        result: any;
+        error: string | null;
+        retryable: boolean;
+      }[];
+    } catch (error: any) {
+      console.error("❌ AI SERVICE BATCH ERROR:", error.message);
+      return null;
+    }
+  },
+
   // 3. Send Feedback
   sendReinforcementFeedback: async (payload: any) => {
     try {
@@ -0,0 +1,151 @@
+"""
+Compressed gold-case index: recall and footprint vs the exact float32 index.
+
+Builds an archive of 768-dim unit vectors with low intrinsic dimension (real
+embeddings of clinical narratives are far from isotropic; --intrinsic-dim
+controls how far) and compares each tier on the same queries (midpoints of
+two archived cases, the way a new patient sits between precedents):
+
+    exact         VectorIndex, float32 brute force (the reference)
+    int8          per-dimension int8 codes, exact re-rank of the top candidates
+    pcaN-int8     PCA projection to N dims fit on the archive, then int8
+
+Reports recall@k against exact search, query p50 and the resident bytes the
+index needs per million cases. A second pass grows a fresh archive one
+upsert at a time (the way /doctor_agree fills a new partition) and reports
+each tier's recall at checkpoints along the way, so a codec fit on too few
+rows shows up. Exits non-zero if any compressed tier's recall (bulk-loaded
+or while growing) is below --min-recall or its p50 exceeds
+--max-latency-ratio x the exact p50 (a compressed tier must not trade memory
+for slower queries).
+
+    python benchmarks/bench_compressed_index.py --rows 100000 --k 10
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from harness import SERVER_DIR  # noqa: F401  (puts the server on sys.path)
+from memory_index import VectorIndex
+from compressed_index import CompressedVectorIndex
+
+
+def build_archive(rows: int, dim: int, intrinsic_dim: int, noise: float, rng) -> np.ndarray:
+    basis = rng.standard_normal((intrinsic_dim, dim)).astype(np.float32)
+    vectors = np.empty((rows, dim), dtype=np.float32)
+    for b in range(0, rows, 16384):
+        n = min(16384, rows - b)
+        block = rng.standard_normal((n, intrinsic_dim)).astype(np.float32) @ basis
+        block += noise * np.sqrt(intrinsic_dim) * rng.standard_normal((n, dim)).astype(np.float32)
+        vectors[b:b + n] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
+
+
+def bench_tier(name: str, index, ids, vectors, queries, truth, k: int) -> dict:
+    start = time.perf_counter()
+    index.load(ids, vectors)
+    build_s = time.perf_counter() - start
+    times, hits = [], 0
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = index.query([q], k)["ids"][0]
+        times.append(time.perf_counter() - start)
+        hits += len(set(found) & expected)
+    stats = index.stats()
+    return {
+        "tier": name,
+        "recall": hits / (k * len(queries)),
+        "p50_ms": float(np.percentile(times, 50)) * 1000,
+        "build_s": build_s,
+        "bytes_per_vector": stats["bytes_per_vector"],
+        "mb_per_million": stats["bytes_per_vector"] * 1_000_000 / 2 ** 20,
+        "explained_variance": stats.get("explained_variance"),
+    }
+
+
+def bench_growth(name: str, index, vectors, k: int, checkpoints, n_queries: int, rng) -> dict:
+    """ Upserts rows one at a time; recall@k vs exact search on the same rows at each checkpoint """
+    ids = [f"gold_vision_{i}" for i in range(len(vectors))]
+    recalls = {}
+    for i, vector in enumerate(vectors):
+        index.upsert([ids[i]], [vector])
+        if i + 1 not in checkpoints:
+            continue
+        rows = i + 1
+        exact = VectorIndex()
+        exact.load(ids[:rows], vectors[:rows])
+        pairs = rng.integers(0, rows, size=(n_queries, 2))
+        queries = (vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2.0
+        truth = exact.query(queries, k)["ids"]
+        found = index.query(queries, k)["ids"]
+        recalls[rows] = sum(len(set(f) & set(t)) for f, t in zip(found, truth)) / (k * n_queries)
+    return {"tier": name, "recalls": recalls, "recall": min(recalls.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--intrinsic-dim", type=int, default=96)
+    parser.add_argument("--noise", type=float, default=0.3, help="isotropic noise relative to the signal")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--pca-dims", type=int, nargs="+", default=[256, 128])
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    parser.add_argument("--max-latency-ratio", type=float, default=1.1)
+    parser.add_argument("--growth-rows", type=int, default=500, help="rows upserted one at a time (0 = skip)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(18)
+    vectors = build_archive(args.rows, args.dim, args.intrinsic_dim, args.noise, rng)
+    ids = [f"gold_vision_{i}" for i in range(args.rows)]
+    pairs = rng.integers(0, args.rows, size=(args.queries, 2))
+    queries = (vectors[pairs[:, 0]] + vectors[pairs[:, 1]]) / 2.0
+
+    exact = VectorIndex()
+    exact.load(ids, vectors)
+    truth = [set(ids) for ids in exact.query(queries, args.k)["ids"]]
+
+    tiers = [("exact", VectorIndex()), ("int8", CompressedVectorIndex())]
+    tiers += [(f"pca{d}-int8", CompressedVectorIndex(pca_dim=d)) for d in args.pca_dims]
+    print(f"{args.rows} cases x {args.dim} dims (intrinsic {args.intrinsic_dim}), recall@{args.k} "
+          f"over {args.queries} queries\n")
+    print(f"{'tier':>12} | {'recall':>7} | {'p50 ms':>7} | {'build s':>7} | {'B/vector':>8} | "
+          f"{'MB / 1M cases':>13} | {'saved / 1M':>10} | variance kept")
+    results = []
+    for name, index in tiers:
+        r = bench_tier(name, index, ids, vectors, queries, truth, args.k)
+        results.append(r)
+        saved = results[0]["mb_per_million"] - r["mb_per_million"]
+        variance = "-" if r["explained_variance"] is None else f"{r['explained_variance']:.1%}"
+        print(f"{name:>12} | {r['recall']:>7.3f} | {r['p50_ms']:>7.2f} | {r['build_s']:>7.1f} | "
+              f"{r['bytes_per_vector']:>8} | {r['mb_per_million']:>13.0f} | {saved:>10.0f} | {variance}")
+
+    compressed = results[1:]
+    if args.growth_rows:
+        growth_vectors = build_archive(args.growth_rows, args.dim, args.intrinsic_dim, args.noise, rng)
+        checkpoints = sorted({c for c in (65, 128, 256, 400, args.growth_rows) if args.k < c <= args.growth_rows})
+        print(f"\ngrowing a fresh archive to {args.growth_rows} cases one upsert at a time, recall@{args.k}:")
+        print(f"{'tier':>12} | " + " | ".join(f"{c:>6}" for c in checkpoints))
+        growth_tiers = [("int8", CompressedVectorIndex())]
+        growth_tiers += [(f"pca{d}-int8", CompressedVectorIndex(pca_dim=d)) for d in args.pca_dims]
+        for name, index in growth_tiers:
+            r = bench_growth(name, index, growth_vectors, args.k, checkpoints, min(args.queries, 100), rng)
+            compressed.append(r)
+            print(f"{name:>12} | " + " | ".join(f"{r['recalls'][c]:>6.3f}" for c in checkpoints))
+
+    worst = min(compressed, key=lambda r: r["recall"])
+    slowest = max(results[1:], key=lambda r: r["p50_ms"])
+    ratio = slowest["p50_ms"] / results[0]["p50_ms"]
+    ok = worst["recall"] >= args.min_recall and ratio <= args.max_latency_ratio
+    print(f"\n{'✅' if ok else '❌'} lowest compressed recall@{args.k}: {worst['recall']:.3f} ({worst['tier']}, "
+          f"limit {args.min_recall}); slowest p50 {ratio:.2f}x exact ({slowest['tier']}, "
+          f"limit {args.max_latency_ratio}x)")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Concurrency check for the non-blocking inference path.
+
+Fires N parallel /triage calls against a fake model with a fixed generation
+latency. If nothing blocks the event loop, N calls finish in roughly the
+time of one. Exits non-zero when they don't.
+
+    python benchmarks/bench_concurrency.py --parallel 20 --latency 0.5
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import httpx
+
+from harness import load_app, sample_patient
+from fake_gemini import FakeGenAIClient
+
+
+async def timed_batch(app, n: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            http.post("/triage", json=sample_patient(i)) for i in range(n)
+        ])
+        elapsed = time.perf_counter() - start
+    failed = [r.status_code for r in responses if r.status_code != 200]
+    if failed:
+        raise SystemExit(f"❌ {len(failed)} requests failed: {failed[:5]}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--parallel", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake generate latency (s)")
+    parser.add_argument("--max-ratio", type=float, default=2.0, help="allowed N-parallel / single ratio")
+    args = parser.parse_args()
+
+    fake = FakeGenAIClient(generate_latency=args.latency, embed_latency=0.01)
+    server, _ = load_app(fake)
+
+    single = asyncio.run(timed_batch(server.app, 1))
+    parallel = asyncio.run(timed_batch(server.app, args.parallel))
+    ratio = parallel / single
+
+    print(f"1 request:   {single * 1000:.0f} ms")
+    print(f"{args.parallel} parallel: {parallel * 1000:.0f} ms  (ratio {ratio:.2f}x)")
+
+    if ratio > args.max_ratio:
+        print(f"❌ Parallel requests are serialising (ratio > {args.max_ratio}).")
+        sys.exit(1)
+    print("✅ Event loop stays free under concurrent /triage load.")
+
+
+if __name__ == "__main__":
+    main()
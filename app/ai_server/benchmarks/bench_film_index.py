@@ -0,0 +1,248 @@
+"""
+Near-duplicate film reuse: hash robustness, Hamming lookups and model calls saved.
+
+Synthetic films (grey anatomy-like blobs and a vertebral column, JPEG) are
+"re-photographed" the way doctors re-shoot films: a few degrees of
+rotation, a small crop, exposure / contrast changes, sensor noise and a
+different JPEG quality.
+
+  1. hashes     pHash / dHash distances for re-shot pairs vs unrelated films
+                at the configured thresholds (true / false match rates)
+  2. lookup     multi-index hash search vs a BK-tree and a linear Hamming
+                scan over --index-size hashes
+  3. end to end --studies film sets go through /analyze_images and are
+                archived as verified (FILM_REUSE=short_circuit); then
+                uploaded again: re-shot for the same visit (short-circuit),
+                the very same files for a later visit (short-circuit, only
+                the triage comparison is regenerated), re-shot for a later
+                visit (precedent, full read), and never-seen studies.
+                Counts short-circuits, model calls and false matches.
+
+Exits non-zero if the same-visit re-shot short-circuit rate is below
+--min-match-rate, a re-shot study was short-circuited for another visit,
+or any never-seen study matched.
+
+    python benchmarks/bench_film_index.py --studies 40 --index-size 100000
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+import numpy as np
+from PIL import Image, ImageEnhance
+
+os.environ.setdefault("FILM_REUSE", "short_circuit")
+
+from harness import load_app
+from fake_gemini import FakeGenAIClient, CANNED_TRIAGE
+from film_index import FILM_DHASH_DISTANCE, FILM_PHASH_DISTANCE, MultiIndexHash, hamming, perceptual_hashes
+
+
+def synthetic_film(rng: np.random.Generator, width: int = 1024, height: int = 768) -> Image.Image:
+    """ Dark film with soft tissue blobs and a column of vertebral bodies at a random pose """
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    img = np.full((height, width), 20.0, dtype=np.float32)
+    for _ in range(rng.integers(6, 12)):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        sx, sy = rng.uniform(40, 220), rng.uniform(40, 220)
+        img += rng.uniform(30, 120) * np.exp(-(((xx - cx) / sx) ** 2 + ((yy - cy) / sy) ** 2))
+    column_x, tilt = rng.uniform(0.3, 0.7) * width, rng.uniform(-0.3, 0.3)
+    for level in range(5):
+        cy = (level + 0.7) * height / 5.5
+        cx = column_x + tilt * (cy - height / 2)
+        img += rng.uniform(60, 110) * (((xx - cx) / 70) ** 2 + ((yy - cy) / 42) ** 2 < 1)
+    return Image.fromarray(np.clip(img, 0, 255).astype(np.uint8), "L").convert("RGB")
+
+
+def reshoot(film: Image.Image, rng: random.Random) -> Image.Image:
+    """ The same film photographed again """
+    w, h = film.size
+    img = film.rotate(rng.uniform(-3, 3), resample=Image.BICUBIC, fillcolor=(15, 15, 15))
+    dx, dy = int(w * rng.uniform(0, 0.04)), int(h * rng.uniform(0, 0.04))
+    img = img.crop((dx, dy, w - int(w * rng.uniform(0, 0.04)), h - int(h * rng.uniform(0, 0.04))))
+    scale, aspect = rng.uniform(0.6, 1.2), rng.uniform(0.97, 1.03)
+    img = img.resize((int(img.width * scale * aspect), int(img.height * scale)))
+    img = ImageEnhance.Brightness(img).enhance(rng.uniform(0.8, 1.2))
+    img = ImageEnhance.Contrast(img).enhance(rng.uniform(0.85, 1.15))
+    noise = np.random.default_rng(rng.randrange(1 << 30)).normal(0, 4, (img.height, img.width, 3))
+    noisy = np.asarray(img, dtype=np.float32) + noise
+    return Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+
+
+def jpeg(img: Image.Image, quality: int = 85) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def hash_robustness(films, rng: random.Random) -> dict:
+    def matches(a, b):
+        return hamming(a[0], b[0]) <= FILM_PHASH_DISTANCE and hamming(a[1], b[1]) <= FILM_DHASH_DISTANCE
+
+    originals = [perceptual_hashes(jpeg(f)) for f in films]
+    reshots = [perceptual_hashes(jpeg(reshoot(f, rng), rng.randint(60, 90))) for f in films]
+    same = [hamming(a[0], b[0]) for a, b in zip(originals, reshots)]
+    true_rate = sum(matches(a, b) for a, b in zip(originals, reshots)) / len(films)
+    pairs = [(i, j) for i in range(len(films)) for j in range(i + 1, len(films))]
+    false_rate = sum(matches(originals[i], originals[j]) for i, j in pairs) / len(pairs)
+    other = [hamming(originals[i][0], originals[j][0]) for i, j in pairs]
+    return {"true_rate": true_rate, "false_rate": false_rate,
+            "same_p50": float(np.median(same)), "same_max": max(same), "other_min": min(other),
+            "other_p50": float(np.median(other))}
+
+
+class BKTree:
+    """ Reference structure: metric tree, children within radius of the query are visited """
+
+    def __init__(self):
+        self.root = None  # [hash, payloads, {distance: child}]
+
+    def add(self, key: int, payload):
+        if self.root is None:
+            self.root = [key, [payload], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(key, node[0])
+            if d == 0:
+                node[1].append(payload)
+                return
+            if d not in node[2]:
+                node[2][d] = [key, [payload], {}]
+                return
+            node = node[2][d]
+
+    def search(self, key: int, radius: int) -> list:
+        found, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(key, node[0])
+            if d <= radius:
+                found.extend((d, payload) for payload in node[1])
+            stack.extend(child for edge, child in node[2].items() if d - radius <= edge <= d + radius)
+        return found
+
+
+def lookup_speed(size: int, queries: int, seed: int = 23) -> dict:
+    """ Random stored hashes; probes are stored hashes with a few bits flipped """
+    rng = random.Random(seed)
+    keys = [rng.getrandbits(64) for _ in range(size)]
+    probes = []
+    for _ in range(queries):
+        probe = keys[rng.randrange(size)]
+        for bit in rng.sample(range(64), rng.randint(0, FILM_PHASH_DISTANCE)):
+            probe ^= 1 << bit
+        probes.append(probe)
+
+    timings, hits = {}, {}
+    for name, index in (("multi-index", MultiIndexHash()), ("bk-tree", BKTree())):
+        for i, key in enumerate(keys):
+            index.add(key, i)
+        started = time.perf_counter()
+        hits[name] = [sorted(p for _, p in index.search(probe, FILM_PHASH_DISTANCE)) for probe in probes]
+        timings[name] = (time.perf_counter() - started) / queries * 1000
+    started = time.perf_counter()
+    hits["scan"] = [[i for i, k in enumerate(keys) if hamming(probe, k) <= FILM_PHASH_DISTANCE] for probe in probes]
+    timings["scan"] = (time.perf_counter() - started) / queries * 1000
+    assert hits["multi-index"] == hits["scan"] == hits["bk-tree"], "search structures disagree"
+    return timings
+
+
+async def end_to_end(main, fake, studies, rng: random.Random) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+
+    def context(visit):
+        return {"age": 52, "gender": "male", "chiefComplaint": f"Low back pain, visit {visit}",
+                "aiTriageResponse": CANNED_TRIAGE}
+
+    async def analyze(http, film_set, visit):
+        """ -> (result, model calls it took) """
+        calls_before = fake.calls["generate"]
+        response = await http.post("/analyze_images", data={"patient_context": json.dumps(context(visit))},
+                                   files=[("files", (f"film_{i}.jpg", data, "image/jpeg"))
+                                          for i, data in enumerate(film_set)])
+        response.raise_for_status()
+        return response.json(), fake.calls["generate"] - calls_before
+
+    def phase(runs):
+        return {"uploads": len(runs), "calls": sum(calls for _, calls in runs),
+                "verified": sum(1 for r, _ in runs if r.get("film_match", {}).get("source") == "verified"),
+                "matched": sum(1 for r, _ in runs if "film_match" in r)}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+        known, novel = studies[:len(studies) // 2], studies[len(studies) // 2:]
+        originals = [[jpeg(f) for f in films] for films in known]
+        for n, film_set in enumerate(originals):
+            result, _ = await analyze(http, film_set, n)
+            (await http.post("/archive_vision_case", data={
+                "patient_context": json.dumps(context(n)), "vision_result": json.dumps(result), "doctor_id": "doc_0",
+            })).raise_for_status()
+
+        def reshot(films):
+            return [jpeg(reshoot(f, rng), rng.randint(60, 90)) for f in films]
+
+        same_visit = [await analyze(http, reshot(films), n) for n, films in enumerate(known)]
+        same_files = [await analyze(http, film_set, 1000 + n) for n, film_set in enumerate(originals)]
+        other_visit = [await analyze(http, reshot(films), 2000 + n) for n, films in enumerate(known)]
+        unseen = [await analyze(http, [jpeg(f) for f in films], 3000 + n) for n, films in enumerate(novel)]
+        stats = (await http.get("/film_index/stats")).json()
+    return {"same_visit": phase(same_visit), "same_files": phase(same_files), "other_visit": phase(other_visit),
+            "unseen": phase(unseen), "stats": stats}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--studies", type=int, default=40)
+    parser.add_argument("--max-films", type=int, default=3)
+    parser.add_argument("--index-size", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--min-match-rate", type=float, default=0.9)
+    args = parser.parse_args()
+
+    np_rng, rng = np.random.default_rng(23), random.Random(23)
+    studies = [[synthetic_film(np_rng) for _ in range(rng.randint(1, args.max_films))] for _ in range(args.studies)]
+    films = [f for study in studies for f in study]
+
+    robustness = hash_robustness(films, rng)
+    print(f"\nthresholds: pHash <= {FILM_PHASH_DISTANCE}, dHash <= {FILM_DHASH_DISTANCE} bits  ({len(films)} films)")
+    print(f"re-shot pairs: pHash p50 {robustness['same_p50']:.0f} / max {robustness['same_max']} bits, "
+          f"matched {robustness['true_rate']:.1%}")
+    print(f"unrelated pairs: pHash p50 {robustness['other_p50']:.0f} / min {robustness['other_min']} bits, "
+          f"matched {robustness['false_rate']:.2%}")
+
+    speed = lookup_speed(args.index_size, args.queries)
+    print(f"\nlookup over {args.index_size} hashes (radius {FILM_PHASH_DISTANCE}): " + ", ".join(
+        f"{name} {ms:.2f} ms" for name, ms in speed.items()))
+
+    fake = FakeGenAIClient(embed_latency=0.0)
+    main_module, _ = load_app(fake)
+    e2e = asyncio.run(end_to_end(main_module, fake, studies, rng))
+    same_visit, same_files, other_visit, unseen = (e2e[k] for k in ("same_visit", "same_files", "other_visit", "unseen"))
+    # A short-circuited upload makes no vision call; a full read makes at least one
+    match_rate = (same_visit["uploads"] - same_visit["calls"]) / same_visit["uploads"]
+    leaked = other_visit["uploads"] - min(other_visit["calls"], other_visit["uploads"])
+    print(f"\nre-shot, same visit:   {same_visit['verified']}/{same_visit['uploads']} matched verified, "
+          f"{same_visit['calls']} model calls ({match_rate:.1%} short-circuited)")
+    print(f"same files, new visit: {same_files['verified']}/{same_files['uploads']} matched verified, "
+          f"{same_files['calls']} model calls (triage comparison only)")
+    print(f"re-shot, new visit:    {other_visit['verified']}/{other_visit['uploads']} matched verified, "
+          f"{other_visit['calls']} model calls (precedent, full read)")
+    print(f"never-seen studies:    {unseen['matched']}/{unseen['uploads']} matched, {unseen['calls']} model calls")
+    print("film index:", json.dumps({k: e2e["stats"][k] for k in ("reuse", "lookups", "match_rate", "short_circuits",
+                                                                  "lookup_ms_mean")}))
+
+    ok = match_rate >= args.min_match_rate and leaked == 0 and unseen["matched"] == 0
+    print(f"\n{'✅' if ok else '❌'} re-shot match rate {match_rate:.1%} (limit {args.min_match_rate:.0%}), "
+          f"{leaked} reused across visits, {unseen['matched']} false matches")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
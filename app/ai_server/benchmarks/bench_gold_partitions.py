@@ -0,0 +1,129 @@
+"""
+Gold-case retrieval latency as the archive grows.
+
+Builds gold_standard_cases-shaped archives (768-dim unit vectors, text and
+vision precedents with scan_quality / validated_by metadata), holds the text
+partition at a fixed size and grows the vision archive past 100k cases.
+Times the text-triage lookup (top-1 text precedent) three ways:
+
+    partitioned   PartitionedIndex, scans only the text partition (what main.py uses)
+    masked        one flat VectorIndex + where mask (filters, but scans everything)
+    unfiltered    one flat VectorIndex, no filter (the old behaviour; may return imaging cases)
+
+plus a narrowed vision lookup (type + scan_quality + doctor) on the partitioned
+index. Exits non-zero if the partitioned text p50 at the largest archive is
+more than --max-growth x its p50 at the smallest.
+
+    python benchmarks/bench_gold_partitions.py --sizes 10000 50000 100000 150000
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+
+from harness import SERVER_DIR  # noqa: F401  (puts the server on sys.path)
+from memory_index import PartitionedIndex, VectorIndex
+from gold_cases import TEXT_PRECEDENT, VISION_PRECEDENT, gold_case_filter, infer_case_type
+
+QUALITIES = ("Good", "Fair", "Poor")
+
+
+def percentile_ms(samples, pct):
+    return float(np.percentile(samples, pct)) * 1000
+
+
+def build_archive(size: int, text_cases: int, dim: int, rng):
+    vectors = rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids, docs, metas = [], [], []
+    for i in range(size):
+        doctor = f"doc_{i % 25}"
+        if i < text_cases:
+            ids.append(f"gold_case_{i}")
+            docs.append(f"Case: Patient {i}. Dx: ['finding {i}']")
+            metas.append({"type": TEXT_PRECEDENT, "validated_by": doctor})
+        else:
+            ids.append(f"gold_vision_{i}")
+            docs.append(f"VERIFIED VISUAL DIAGNOSIS: finding {i}")
+            metas.append({"type": VISION_PRECEDENT, "validated_by": doctor, "scan_quality": QUALITIES[i % 3]})
+    return ids, vectors, docs, metas
+
+
+def time_queries(query_fn, queries) -> list:
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        query_fn(q)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench(size: int, text_cases: int, n_queries: int, dim: int, rng) -> dict:
+    ids, vectors, docs, metas = build_archive(size, text_cases, dim, rng)
+    partitioned = PartitionedIndex("type", infer_case_type)
+    partitioned.load(ids, vectors, docs, metas)
+    flat = VectorIndex()
+    flat.load(ids, vectors, docs, metas)
+    del vectors
+
+    queries = rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    text_where = gold_case_filter(TEXT_PRECEDENT)
+    vision_where = gold_case_filter(VISION_PRECEDENT, scan_quality="Good", validated_by="doc_3")
+
+    timings = {
+        "partitioned": time_queries(lambda q: partitioned.query([q], 1, where=text_where), queries),
+        "masked": time_queries(lambda q: flat.query([q], 1, where=text_where), queries),
+        "unfiltered": time_queries(lambda q: flat.query([q], 1), queries),
+        "vision": time_queries(lambda q: partitioned.query([q], 1, where=vision_where), queries),
+    }
+    # Same answers from both filtered paths; the unfiltered path mostly lands on imaging cases
+    mismatches = sum(
+        partitioned.query([q], 1, where=text_where)["ids"] != flat.query([q], 1, where=text_where)["ids"]
+        for q in queries[:50]
+    )
+    wrong_type = sum(not flat.query([q], 1)["ids"][0][0].startswith("gold_case_") for q in queries[:50]) / 50
+    return {
+        "size": size,
+        "partitions": partitioned.sizes(),
+        **{f"{name}_p50": percentile_ms(t, 50) for name, t in timings.items()},
+        **{f"{name}_p95": percentile_ms(t, 95) for name, t in timings.items()},
+        "mismatches": mismatches,
+        "wrong_type": wrong_type,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 25000, 50000, 100000, 150000])
+    parser.add_argument("--text-cases", type=int, default=5000, help="text precedents (held constant)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--max-growth", type=float, default=1.5,
+                        help="allowed partitioned text p50 ratio, largest vs smallest archive")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(11)
+    print(f"{'archive':>8} {'text':>6} {'vision':>7} | {'partitioned':>16} | {'masked':>16} | "
+          f"{'unfiltered':>16} | {'vision+filters':>16} | mismatches  unfiltered->imaging")
+    print(f"{'':>24} | {'p50 / p95 ms':>16} | {'p50 / p95 ms':>16} | {'p50 / p95 ms':>16} | {'p50 / p95 ms':>16} |")
+    results = []
+    for size in args.sizes:
+        r = bench(size, min(args.text_cases, size), args.queries, args.dim, rng)
+        results.append(r)
+        cells = " | ".join(f"{r[f'{n}_p50']:>7.3f} / {r[f'{n}_p95']:>6.3f}"
+                           for n in ("partitioned", "masked", "unfiltered", "vision"))
+        print(f"{size:>8} {r['partitions'].get(TEXT_PRECEDENT, 0):>6} {r['partitions'].get(VISION_PRECEDENT, 0):>7} | "
+              f"{cells} | {r['mismatches']:>10}  {r['wrong_type']:>6.0%}")
+
+    growth = results[-1]["partitioned_p50"] / results[0]["partitioned_p50"]
+    verdict = "✅ flat" if growth <= args.max_growth else "❌ grew"
+    print(f"\n{verdict}: text-partition p50 x{growth:.2f} from {results[0]['size']} to {results[-1]['size']} cases "
+          f"(limit x{args.max_growth})")
+    if growth > args.max_growth or any(r["mismatches"] for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Retrieval latency: Chroma/HNSW query vs the in-process NumPy index.
+
+Builds a throwaway PersistentClient collection of the same shape as
+triage_pearls (768-dim, unit vectors), mirrors it into a VectorIndex and
+times top-5 lookups through both paths. Also checks both return the same ids.
+
+    python benchmarks/bench_memory_index.py --sizes 37 49 500 --queries 2000
+"""
+import argparse
+import tempfile
+import time
+
+import chromadb
+import numpy as np
+
+from harness import SERVER_DIR  # noqa: F401  (puts the server on sys.path)
+from memory_index import VectorIndex
+
+
+def percentile_ms(samples, pct):
+    return float(np.percentile(samples, pct)) * 1000
+
+
+def bench(size: int, n_queries: int, dim: int, rng) -> dict:
+    vectors = rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"rule_{i:05d}" for i in range(size)]
+    docs = [f"Rule {i}" for i in range(size)]
+    metas = [{"confidence": 1.0, "priority": "standard"} for _ in range(size)]
+
+    store = chromadb.PersistentClient(path=tempfile.mkdtemp(prefix="bench_index_"))
+    collection = store.get_or_create_collection(name=f"bench_{size}")
+    for start in range(0, size, 1000):
+        collection.add(ids=ids[start:start + 1000], embeddings=vectors[start:start + 1000].tolist(),
+                       documents=docs[start:start + 1000], metadatas=metas[start:start + 1000])
+
+    index = VectorIndex()
+    index.load(ids, vectors, docs, metas)
+
+    queries = rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    query_lists = queries.tolist()
+
+    chroma_times, index_times, mismatches = [], [], 0
+    for q, q_list in zip(queries, query_lists):
+        t0 = time.perf_counter()
+        chroma_result = collection.query(query_embeddings=[q_list], n_results=5)
+        t1 = time.perf_counter()
+        index_result = index.query([q], n_results=5)
+        t2 = time.perf_counter()
+        chroma_times.append(t1 - t0)
+        index_times.append(t2 - t1)
+        if set(chroma_result["ids"][0]) != set(index_result["ids"][0]):
+            mismatches += 1
+
+    return {
+        "size": size,
+        "chroma_p50": percentile_ms(chroma_times, 50),
+        "chroma_p99": percentile_ms(chroma_times, 99),
+        "index_p50": percentile_ms(index_times, 50),
+        "index_p99": percentile_ms(index_times, 99),
+        "mismatches": mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[37, 49, 500])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=768)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    print(f"{'rows':>7} | {'chroma p50':>10} {'chroma p99':>10} | {'index p50':>9} {'index p99':>9} | "
+          f"{'speedup':>7} | top-5 mismatches")
+    for size in args.sizes:
+        r = bench(size, args.queries, args.dim, rng)
+        print(f"{r['size']:>7} | {r['chroma_p50']:>8.3f}ms {r['chroma_p99']:>8.3f}ms | "
+              f"{r['index_p50']:>7.3f}ms {r['index_p99']:>7.3f}ms | "
+              f"{r['chroma_p50'] / r['index_p50']:>6.1f}x | {r['mismatches']}")
+
+
+if __name__ == "__main__":
+    main()
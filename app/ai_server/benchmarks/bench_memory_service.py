@@ -0,0 +1,145 @@
+"""
+Multi-process check for the memory service.
+
+Starts a memory-service owner on a throwaway store, seeds it with the
+production rule lists, then runs N worker processes that each keep an
+in-memory snapshot of triage_pearls and hammer it with nearest-neighbour
+queries while one worker keeps reinforcing rules. Reports aggregate query
+throughput per worker count and checks that every worker converged on the
+owner's final counters (no lost increments, no stale snapshots), and how
+stale snapshots were refreshed (rows changed since, or a full reload).
+
+    python benchmarks/bench_memory_service.py --workers 1,2,4 --seconds 3
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+
+from harness import SERVER_DIR, fake_embed_many, seed_source
+
+COLLECTION = "triage_pearls"
+
+
+def wait_for_socket(path: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        if time.monotonic() > deadline:
+            raise SystemExit("❌ Memory service did not start")
+        time.sleep(0.05)
+
+
+def seed(address: str) -> list:
+    from memory_service import MemoryServiceClient
+    from seeding import seed_collection
+    collection = MemoryServiceClient(address).get_or_create_collection(COLLECTION)
+    asyncio.run(seed_collection(collection, *seed_source(COLLECTION), fake_embed_many))
+    return collection.get(include=[])["ids"]
+
+
+def worker(address: str, seconds: float, writer: bool, rule_ids: list, seed_value: int, results):
+    """ One 'uvicorn worker': snapshot + watcher + local reads (+ writes for worker 0) """
+    sys.path.insert(0, SERVER_DIR)
+    from memory_index import IndexedCollection
+    from memory_service import MemoryServiceClient, VersionWatcher
+
+    async def run():
+        collection = IndexedCollection(MemoryServiceClient(address).get_or_create_collection(COLLECTION))
+
+        def on_change(name, version, epoch):
+            if name == COLLECTION and collection.collection.observe_published(version, epoch):
+                collection.version += 1
+
+        watcher = VersionWatcher(address, on_change)
+        watcher.start()
+        await collection.load()
+        rng = random.Random(seed_value)
+        dim = collection.index.dim
+        queries = increments = reloads = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            if collection.is_stale():
+                reloads += 1
+            vector = [rng.uniform(-1, 1) for _ in range(dim)]
+            await collection.query(query_embeddings=[vector], n_results=5)
+            queries += 1
+            if writer and queries % 50 == 0:
+                await collection.increment([rng.choice(rule_ids)], [{"usage_count": 1, "confidence": 0.1}])
+                increments += 1
+            if queries % 200 == 0:
+                await asyncio.sleep(0)  # let the watcher run
+        await asyncio.sleep(0.5)  # drain the last broadcasts
+        await collection.ensure_loaded()
+        final = {rid: collection.index.metadatas[collection.index._positions[rid]].get("usage_count", 0)
+                 for rid in rule_ids}
+        await watcher.stop()
+        results.put({"queries": queries, "increments": increments, "reloads": reloads, "final": final,
+                     "refreshes": collection.refreshes})
+
+    asyncio.run(run())
+
+
+def run_round(address: str, n_workers: int, seconds: float, rule_ids: list) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(address, seconds, i == 0, rule_ids, i, results))
+             for i in range(n_workers)]
+    for p in procs:
+        p.start()
+    reports = [results.get(timeout=seconds + 120) for _ in procs]
+    for p in procs:
+        p.join()
+    return {
+        "workers": n_workers,
+        "qps": sum(r["queries"] for r in reports) / seconds,
+        "increments": sum(r["increments"] for r in reports),
+        "reloads": sum(r["reloads"] for r in reports),
+        "delta": sum(r["refreshes"]["delta"] for r in reports),
+        "full": sum(r["refreshes"]["full"] for r in reports),
+        "finals": [r["final"] for r in reports],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ai_memsvc_")
+    sock = os.path.join(workdir, "memory.sock")
+    address = f"unix:{sock}"
+    env = dict(os.environ, MEMORY_PATH=os.path.join(workdir, "ai_memory"), MEMORY_SERVICE_ADDRESS=address)
+    owner = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, "memory_service.py")], env=env, cwd=workdir)
+    try:
+        wait_for_socket(sock)
+        rule_ids = seed(address)
+        print(f"🧠 Seeded {len(rule_ids)} rules into the owner at {address}")
+
+        from memory_service import MemoryServiceClient
+        truth_client = MemoryServiceClient(address)
+        failed = False
+        for n in [int(x) for x in args.workers.split(",")]:
+            report = run_round(address, n, args.seconds, rule_ids)
+            truth = truth_client.call("get", COLLECTION, ids=rule_ids, include=["metadatas"])["result"]
+            owner_counts = {i: m.get("usage_count", 0) for i, m in zip(truth["ids"], truth["metadatas"])}
+            converged = all(final == owner_counts for final in report["finals"])
+            failed |= not converged
+            print(f"{n} worker(s): {report['qps']:>9.0f} queries/s  "
+                  f"{report['increments']} increments, {report['reloads']} stale reads "
+                  f"({report['delta']} delta / {report['full']} full refreshes), "
+                  f"{'✅ converged' if converged else '❌ diverged from owner'}")
+        if failed:
+            sys.exit(1)
+    finally:
+        owner.terminate()
+        owner.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Blended latency / cost of fast/deep model routing.
+
+Drives /triage (one patient in 7 has limbWeakness, a red flag) and
+/submit_correction through the app against a fake client whose two models
+differ the way Flash and Pro do: the deep model is --deep-latency seconds per
+call, the fast one --fast-latency, and a seeded share of fast answers comes
+back low-confidence (--unsure-rate) or malformed (--malformed-rate) so the
+escalation path is exercised. Prints the router's per-tier counters and the
+blended speedup vs sending every call to the deep model, and exits non-zero
+if that speedup is below --min-speedup.
+
+    python benchmarks/bench_model_routing.py --requests 200 --unsure-rate 0.1
+"""
+import sys
+import json
+import random
+import asyncio
+import argparse
+
+import httpx
+
+from harness import load_app, sample_patient, seed_memory
+from fake_gemini import FakeAsyncModels, FakeGenAIClient, FakeResponse, canned_text
+
+
+class TieredModels(FakeAsyncModels):
+    """ Fake async surface with per-model latency and an unreliable fast model """
+
+    async def generate_content(self, *, model, contents, config=None):
+        owner = self.owner
+        deep = model == owner.deep_model
+        owner.record("generate", model)
+        owner.per_model[model] = owner.per_model.get(model, 0) + 1
+        await asyncio.sleep(owner.deep_latency if deep else owner.fast_latency)
+        text = canned_text(contents)
+        if deep:
+            return FakeResponse(text)
+        roll = owner.rng.random()
+        if roll < owner.malformed_rate:
+            return FakeResponse(text[len(text) // 2:])  # broken JSON / a rule without its prefix
+        if roll < owner.malformed_rate + owner.unsure_rate and text.startswith("{"):
+            return FakeResponse(json.dumps({**json.loads(text), "confidence": 0.3}))
+        return FakeResponse(text)
+
+
+class TieredFakeClient(FakeGenAIClient):
+    def __init__(self, deep_model: str, fast_latency: float, deep_latency: float,
+                 unsure_rate: float, malformed_rate: float, seed: int = 19):
+        super().__init__(embed_latency=0.0)
+        self.deep_model = deep_model
+        self.fast_latency, self.deep_latency = fast_latency, deep_latency
+        self.unsure_rate, self.malformed_rate = unsure_rate, malformed_rate
+        self.rng = random.Random(seed)
+        self.per_model = {}
+        self.aio.models = TieredModels(self)
+
+
+async def drive(main, args) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    pool = asyncio.Semaphore(args.concurrency)
+    statuses = {}
+
+    async def send(http, method, path, **kwargs):
+        async with pool:
+            response = await http.request(method, path, **kwargs)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+        jobs = [send(http, "POST", "/triage", json=sample_patient(i)) for i in range(args.requests)]
+        jobs += [send(http, "POST", "/submit_correction", json={
+            "correct_diagnosis": f"Cauda equina {i}", "doctor_reasoning": "Saddle anaesthesia was missed",
+        }) for i in range(args.requests // 10)]
+        await asyncio.gather(*jobs)
+        stats = (await http.get("/model_router/stats")).json()
+    stats["statuses"] = statuses
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--fast-latency", type=float, default=0.4)
+    parser.add_argument("--deep-latency", type=float, default=2.0)
+    parser.add_argument("--unsure-rate", type=float, default=0.1, help="fast answers with confidence 0.3")
+    parser.add_argument("--malformed-rate", type=float, default=0.02, help="fast answers that fail validation")
+    parser.add_argument("--min-speedup", type=float, default=1.5)
+    args = parser.parse_args()
+
+    from model_router import DEEP_MODEL_ID
+    client = TieredFakeClient(DEEP_MODEL_ID, args.fast_latency, args.deep_latency,
+                              args.unsure_rate, args.malformed_rate)
+    main_module, _ = load_app(client)
+
+    async def run():
+        await seed_memory(main_module)
+        return await drive(main_module, args)
+
+    stats = asyncio.run(run())
+    print(f"\n{args.requests} triage + {args.requests // 10} corrections, fast {args.fast_latency}s / "
+          f"deep {args.deep_latency}s, fast unsure {args.unsure_rate:.0%}, malformed {args.malformed_rate:.0%}")
+    print(f"HTTP statuses: {stats['statuses']}  upstream calls per model: {client.per_model}\n")
+    print(f"{'tier':>5} | {'model':>24} | {'calls':>6} | {'p50 ms':>7} | {'p95 ms':>7} | {'cost $':>9}")
+    for tier, t in stats["tiers"].items():
+        print(f"{tier:>5} | {t['model']:>24} | {t['calls']:>6} | {t['p50_ms'] or 0:>7.0f} | "
+              f"{t['p95_ms'] or 0:>7.0f} | {t['cost_usd']:>9.5f}")
+    print("\nroutes:", json.dumps(stats["routes"], indent=None))
+    print(f"escalations: {stats['escalations']} ({stats['escalation_rate']:.1%} of {stats['requests']} routed calls)")
+    print(f"blended request: {stats['blended_request_ms']} ms   cost ${stats['cost_usd']:.5f} "
+          f"vs deep-only ${stats['deep_only_cost_usd']:.5f} (x{stats['cost_ratio_vs_deep_only']})")
+
+    speedup = stats["speedup_vs_deep_only"] or 0.0
+    verdict = "✅" if speedup >= args.min_speedup else "❌"
+    print(f"\n{verdict} blended speedup vs deep-only: x{speedup:.2f} (limit x{args.min_speedup})")
+    if speedup < args.min_speedup or set(stats["statuses"]) != {200}:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
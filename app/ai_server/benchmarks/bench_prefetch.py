@@ -0,0 +1,116 @@
+"""
+What intake-time /prefetch_context saves /triage.
+
+Two cohorts of --patients distinct patients go through /triage against a fake
+model (--embed-latency per embed call, --generate-latency per generation):
+
+    prefetched   /prefetch_context ran for each at "intake"; halfway through
+                 their triage a doctor agreement lands in gold_standard_cases,
+                 so the second half finds its block stale and only re-queries
+    cold         no prefetch: embed + retrieval inline, as before
+
+Prints per-cohort triage latency, the prefetcher's hit / refresh / miss
+counts and the time it reports saved. Exits non-zero if fewer than
+--min-reuse of the prefetched cohort reused their entry, or if that cohort's
+p50 is not below the cold one.
+
+    python benchmarks/bench_prefetch.py --patients 100 --embed-latency 0.15
+"""
+import sys
+import time
+import asyncio
+import argparse
+
+import httpx
+
+from harness import load_app, sample_patient, seed_memory
+from fake_gemini import FakeGenAIClient
+from load_test import CANNED_TRIAGE
+
+
+def patient(i: int) -> dict:
+    p = sample_patient(i)
+    p["medicalHistory"]["chiefComplaint"] += f" (intake {i})"  # distinct memory query per patient
+    return p
+
+
+def percentile_ms(samples, pct) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000
+
+
+async def drive(main, args) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    pool = asyncio.Semaphore(args.concurrency)
+    prefetched = [patient(i) for i in range(args.patients)]
+    cold = [patient(args.patients + i) for i in range(args.patients)]
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+        async def triage(p) -> float:
+            async with pool:
+                started = time.perf_counter()
+                response = await http.post("/triage", json=p)
+                response.raise_for_status()
+                return time.perf_counter() - started
+
+        async def prefetch(p):
+            async with pool:
+                body = {"details": p["details"], "medicalHistory": p["medicalHistory"]}
+                (await http.post("/prefetch_context", json=body)).raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*[prefetch(p) for p in prefetched])
+        prefetch_seconds = time.perf_counter() - started
+
+        half = len(prefetched) // 2
+        latencies = {"prefetched": await asyncio.gather(*[triage(p) for p in prefetched[:half]])}
+        (await http.post("/doctor_agree", json={
+            "patient_data": {"fullName": "Bench Patient agree"}, "ai_response": CANNED_TRIAGE, "doctor_id": "doc_0",
+        })).raise_for_status()
+        latencies["prefetched"] += await asyncio.gather(*[triage(p) for p in prefetched[half:]])
+        latencies["cold"] = await asyncio.gather(*[triage(p) for p in cold])
+        stats = (await http.get("/prefetch_context/stats")).json()
+    return {"latencies": latencies, "stats": stats, "prefetch_seconds": prefetch_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--embed-latency", type=float, default=0.15)
+    parser.add_argument("--generate-latency", type=float, default=0.5)
+    parser.add_argument("--min-reuse", type=float, default=0.95, help="share of prefetched patients reusing their entry")
+    args = parser.parse_args()
+
+    fake = FakeGenAIClient(generate_latency=args.generate_latency, embed_latency=args.embed_latency)
+    main_module, _ = load_app(fake)
+
+    async def run():
+        await seed_memory(main_module)
+        return await drive(main_module, args)
+
+    result = asyncio.run(run())
+    stats, latencies = result["stats"], result["latencies"]
+    print(f"\n{args.patients} prefetched + {args.patients} cold patients, embed {args.embed_latency}s, "
+          f"generate {args.generate_latency}s, concurrency {args.concurrency}")
+    print(f"prefetch phase: {result['prefetch_seconds']:.2f}s  outcomes {stats['prefetches']}\n")
+    print(f"{'cohort':>10} | {'p50 ms':>7} | {'p95 ms':>7} | {'mean ms':>7}")
+    for cohort, samples in latencies.items():
+        print(f"{cohort:>10} | {percentile_ms(samples, 0.5):>7.0f} | {percentile_ms(samples, 0.95):>7.0f} | "
+              f"{sum(samples) / len(samples) * 1000:>7.0f}")
+    print(f"\ntriage lookups: {stats['lookups']}  hit rate {stats['hit_rate']:.1%}  reuse {stats['reuse_rate']:.1%}")
+    print(f"saved: {stats['saved_ms']:.0f} ms total, {stats['saved_ms_per_lookup']} ms per lookup "
+          f"(mean lookup now {stats['lookup_ms_mean']} ms)")
+
+    reused = stats["lookups"]["fresh"] + stats["lookups"]["refreshed"]
+    reuse = reused / args.patients
+    gain = percentile_ms(latencies["cold"], 0.5) - percentile_ms(latencies["prefetched"], 0.5)
+    ok = reuse >= args.min_reuse and gain > 0
+    print(f"\n{'✅' if ok else '❌'} prefetched cohort: {reuse:.1%} reused (limit {args.min_reuse:.0%}), "
+          f"p50 {gain:.0f} ms faster than cold")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
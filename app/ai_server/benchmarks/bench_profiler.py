@@ -0,0 +1,138 @@
+"""
+Cost and coverage of the on-demand profiler and the slow-request log.
+
+Runs --requests /triage calls (fake model: --embed-latency per embed,
+--generate-latency per generation, some patients given a slow generation)
+three times against the same app:
+
+    off         no profiling session
+    profiled    /admin/profile on /triage at 100%, --interval-ms sampling
+    sampled     same, --sample-rate of requests
+
+For each pass prints p50 / p95 latency and throughput, then the profile's
+sample count, sampler busy time and its top wall-clock stacks, and which
+requests landed in /admin/slow_requests.
+
+Exits non-zero if profiling at 100% slows p50 by more than --max-overhead,
+if the profile has no samples inside the model call, or if the slow log
+missed (or invented) a request over SLOW_REQUEST_SECONDS.
+
+    python benchmarks/bench_profiler.py --requests 200 --interval-ms 10
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+os.environ.setdefault("SLOW_REQUEST_SECONDS", "1.0")
+os.environ.setdefault("ADMIN_TOKEN", "bench-admin-token")
+
+import httpx
+
+from harness import load_app, sample_patient, seed_memory
+from fake_gemini import FakeGenAIClient
+
+
+def percentile_ms(samples, pct) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] * 1000
+
+
+async def drive(main, fake, args) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    pool = asyncio.Semaphore(args.concurrency)
+    results = {}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120,
+                                 headers={"X-Admin-Token": os.environ["ADMIN_TOKEN"]}) as http:
+        async def triage(i: int, slow: bool) -> float:
+            async with pool:
+                patient = sample_patient(i)
+                patient["medicalHistory"]["chiefComplaint"] += f" (run {i})"  # no result-cache hits
+                fake.generate_latency = args.slow_latency if slow else args.generate_latency
+                started = time.perf_counter()
+                (await http.post("/triage", json=patient)).raise_for_status()
+                return time.perf_counter() - started
+
+        async def run_pass(name: str, offset: int, profile: dict = None):
+            if profile is not None:
+                (await http.post("/admin/profile", json=profile)).raise_for_status()
+            started = time.perf_counter()
+            # Slow patients run one at a time after the batch, so they cannot skew its latencies
+            latencies = await asyncio.gather(*[triage(offset + i, False) for i in range(args.requests)])
+            wall = time.perf_counter() - started
+            slow = [await triage(offset + args.requests + i, True) for i in range(args.slow)]
+            report = (await http.delete("/admin/profile")).json() if profile is not None else None
+            results[name] = {"latencies": latencies, "wall": wall, "slow": slow, "profile": report}
+
+        await run_pass("off", 0)
+        await run_pass("profiled", 10000, {"seconds": 600, "routes": ["/triage"], "interval_ms": args.interval_ms})
+        collapsed = (await http.get("/admin/profile/download", params={"format": "collapsed"})).text
+        await run_pass("sampled", 20000, {"seconds": 600, "routes": ["/triage"], "interval_ms": args.interval_ms,
+                                          "sample_rate": args.sample_rate})
+        slow_log = (await http.get("/admin/slow_requests", params={"limit": 1000})).json()
+    return {"passes": results, "collapsed": collapsed, "slow_log": slow_log}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--generate-latency", type=float, default=0.2)
+    parser.add_argument("--slow", type=int, default=3, help="requests given --slow-latency generations")
+    parser.add_argument("--slow-latency", type=float, default=1.5)
+    parser.add_argument("--interval-ms", type=float, default=10)
+    parser.add_argument("--sample-rate", type=float, default=0.1)
+    parser.add_argument("--max-overhead", type=float, default=0.05, help="allowed p50 slowdown when profiling all requests")
+    args = parser.parse_args()
+
+    fake = FakeGenAIClient(generate_latency=args.generate_latency, embed_latency=args.embed_latency)
+    main_module, _ = load_app(fake)
+
+    async def run():
+        await seed_memory(main_module)
+        return await drive(main_module, fake, args)
+
+    result = asyncio.run(run())
+    passes = result["passes"]
+    print(f"\n{args.requests} triage requests per pass, concurrency {args.concurrency}, "
+          f"generate {args.generate_latency}s, sampling every {args.interval_ms} ms\n")
+    print(f"{'pass':>9} | {'p50 ms':>7} | {'p95 ms':>7} | {'req/s':>6} | {'profiled':>8} | {'samples':>7} | sampler busy")
+    for name, p in passes.items():
+        profile = p["profile"] or {}
+        print(f"{name:>9} | {percentile_ms(p['latencies'], 0.5):>7.0f} | {percentile_ms(p['latencies'], 0.95):>7.0f} | "
+              f"{args.requests / p['wall']:>6.1f} | {profile.get('requests_profiled', '-'):>8} | "
+              f"{profile.get('samples', '-'):>7} | {profile.get('sampler_busy_ms', '-')} ms")
+
+    stacks = []
+    for line in result["collapsed"].splitlines():
+        stack, count = line.rsplit(" ", 1)
+        stacks.append((int(count), stack.split(";")))
+    stacks.sort(key=lambda s: -s[0])
+    total = sum(c for c, _ in stacks) or 1
+    print("\ntop wall-clock stacks (leaf frames) for /triage:")
+    for count, frames in stacks[:5]:
+        print(f"  {count / total:>6.1%}  " + " <- ".join(reversed(frames[-3:])))
+    in_model = sum(c for c, frames in stacks if any(f.startswith("generate_content") for f in frames)) / total
+
+    threshold = result["slow_log"]["threshold_s"]
+    expected = sum(1 for p in passes.values() for s in p["latencies"] + p["slow"] if s >= threshold)
+    captured = len(result["slow_log"]["requests"])
+    print(f"\nslow-request log (>= {threshold}s): {captured} captured, {expected} requests measured over it")
+    if result["slow_log"]["requests"]:
+        entry = result["slow_log"]["requests"][0]
+        print(f"  newest: {entry['total_ms']} ms, stages {entry['stages']}, sizes {entry['sizes']}")
+
+    overhead = percentile_ms(passes["profiled"]["latencies"], 0.5) / percentile_ms(passes["off"]["latencies"], 0.5) - 1
+    ok = overhead <= args.max_overhead and in_model > 0 and captured == expected
+    print(f"\n{'✅' if ok else '❌'} p50 overhead with every request profiled {overhead:+.1%} "
+          f"(limit {args.max_overhead:.0%}), {in_model:.0%} of samples in the model call, "
+          f"slow log {captured}/{expected}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
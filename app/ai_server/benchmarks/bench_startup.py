@@ -0,0 +1,149 @@
+"""
+Time to first request: a real uvicorn process from spawn to serving.
+
+Seeds one throwaway store (the production rule lists plus --gold-cases
+archived precedents), then starts the server on it in fresh processes, once
+per warm-up mode:
+
+    background    lifespan returns at once; memory / model warm up behind it
+    blocking      lifespan waits for the warm-up (how startup used to behave)
+
+For each it records spawn -> /healthz (accepting connections), spawn ->
+/readyz 200 (memory loaded, model probe passed) and the latency of a /triage
+sent the moment /healthz answers. Exits non-zero if background mode's
+spawn -> first triage response exceeds --max-first-request seconds.
+
+    python benchmarks/bench_startup.py --gold-cases 20000 --runs 3
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+import numpy as np
+
+from harness import load_app, sample_patient, seed_memory
+from fake_gemini import EMBEDDING_DIM, FakeGenAIClient
+
+MODES = ("background", "blocking")
+SEED_BATCH = 2000
+
+
+def seed_store(workdir: str, gold_cases: int):
+    """ Child: production seed rules plus synthetic gold cases, written straight to the store """
+    main, _ = load_app(FakeGenAIClient(embed_latency=0.0), workdir)
+    asyncio.run(seed_memory(main))
+    rng = np.random.default_rng(21)
+    store = main.gold_case_collection.collection
+    for start in range(0, gold_cases, SEED_BATCH):
+        n = min(SEED_BATCH, gold_cases - start)
+        vectors = rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = [f"gold_case_{start + i}" for i in range(n)]
+        store.upsert(ids=ids, embeddings=vectors.tolist(),
+                     documents=[f"Case: Patient {start + i}. Dx: ['finding {start + i}']" for i in range(n)],
+                     metadatas=[{"type": "text", "validated_by": f"doc_{i % 25}"} for i in range(n)])
+
+
+def serve(workdir: str, port: int):
+    """ Child: the app on the seeded store, fake model, real uvicorn """
+    import uvicorn
+    main, _ = load_app(FakeGenAIClient(embed_latency=0.0), workdir)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_child(args: list, env: dict = None, **kwargs) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), *args],
+                            env={**os.environ, **(env or {})}, **kwargs)
+
+
+def measure(workdir: str, mode: str, timeout: float) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    spawned = time.perf_counter()
+    child = run_child(["--serve", workdir, "--port", str(port)], env={"STARTUP_WARMUP": mode},
+                      stdout=subprocess.DEVNULL)
+    result = {}
+    try:
+        with httpx.Client(base_url=base, timeout=timeout) as http:
+            while "healthz_s" not in result:
+                if time.perf_counter() - spawned > timeout or child.poll() is not None:
+                    raise RuntimeError(f"{mode}: server did not come up")
+                try:
+                    http.get("/healthz")
+                    result["healthz_s"] = time.perf_counter() - spawned
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            sent = time.perf_counter()
+            response = http.post("/triage", json=sample_patient(1))
+            result["first_triage_ms"] = (time.perf_counter() - sent) * 1000
+            result["first_response_s"] = time.perf_counter() - spawned
+            result["first_status"] = response.status_code
+            while http.get("/readyz").status_code != 200:
+                if time.perf_counter() - spawned > timeout:
+                    raise RuntimeError(f"{mode}: never became ready")
+                time.sleep(0.01)
+            result["readyz_s"] = time.perf_counter() - spawned
+            result["steps_ms"] = http.get("/readyz").json()["steps_ms"]
+    finally:
+        child.terminate()
+        child.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gold-cases", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--max-first-request", type=float, default=6.0,
+                        help="seconds from spawn to the first triage response (background mode)")
+    parser.add_argument("--seed", metavar="DIR", help=argparse.SUPPRESS)
+    parser.add_argument("--serve", metavar="DIR", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.seed:
+        return seed_store(args.seed, args.gold_cases)
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    workdir = tempfile.mkdtemp(prefix="ai_bench_startup_")
+    started = time.perf_counter()
+    if run_child(["--seed", workdir, "--gold-cases", str(args.gold_cases)], stdout=subprocess.DEVNULL).wait():
+        sys.exit("seeding failed")
+    print(f"Seeded {args.gold_cases} gold cases + seed rules in {time.perf_counter() - started:.1f}s ({workdir})\n")
+
+    print(f"{'mode':>10} | {'run':>3} | {'healthz s':>9} | {'1st resp s':>10} | {'1st triage ms':>13} | "
+          f"{'readyz s':>8} | warm-up steps ms")
+    best = {}
+    for mode in MODES:
+        for run in range(args.runs):
+            r = measure(workdir, mode, args.timeout)
+            if r["first_status"] != 200:
+                sys.exit(f"{mode}: first triage answered {r['first_status']}")
+            best[mode] = min(best.get(mode, float("inf")), r["first_response_s"])
+            print(f"{mode:>10} | {run:>3} | {r['healthz_s']:>9.2f} | {r['first_response_s']:>10.2f} | "
+                  f"{r['first_triage_ms']:>13.0f} | {r['readyz_s']:>8.2f} | {r['steps_ms']}")
+
+    limit = args.max_first_request
+    verdict = "✅" if best["background"] <= limit else "❌"
+    print(f"\n{verdict} spawn -> first triage response: background {best['background']:.2f}s, "
+          f"blocking {best['blocking']:.2f}s (limit {limit:.1f}s)")
+    if best["background"] > limit:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
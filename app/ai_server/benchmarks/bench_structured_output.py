@@ -0,0 +1,161 @@
+"""
+Local repair and partial re-asks vs regenerating malformed model answers.
+
+The fake model returns the canned triage answer with a defect in
+--defect-rate of its generations (re-asks excepted), spread evenly over:
+
+    fenced          the JSON wrapped in a ```json fence and a sentence
+    trailing        a chatty sentence after the closing brace
+    no_brace        the final closing brace missing
+    truncated       cut off in the last third (an output-token limit)
+    bad_confidence  "confidence": "high"
+
+--requests /triage calls run twice, with distinct patients:
+
+    strict      json.loads + TriageOutput, as before: any defect escalates to
+                the deep model, and a defective deep answer is a fallback
+    structured  structured_output.py: repair, re-ask for missing fields, then
+                escalate
+
+Prints model calls per request (and how many were full regenerations),
+fallback answers, latency, and the repair / re-ask counters. Exits non-zero
+if structured mode does not make fewer regenerations than strict mode, or
+returns more fallbacks.
+
+    python benchmarks/bench_structured_output.py --requests 300 --defect-rate 0.3
+"""
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import httpx
+
+from harness import load_app, sample_patient, seed_memory
+from fake_gemini import CANNED_TRIAGE, FakeGenAIClient, FakeResponse
+from model_router import SchemaError
+
+DEFECTS = ("fenced", "trailing", "no_brace", "truncated", "bad_confidence")
+
+
+def with_defect(text: str, defect: str, rng: random.Random) -> str:
+    if defect == "fenced":
+        return "Here is the assessment:\n```json\n" + text + "\n```"
+    if defect == "trailing":
+        return text + "\nLet me know if you need a second opinion."
+    if defect == "no_brace":
+        return text.rstrip()[:-1]
+    if defect == "truncated":
+        return text[:int(len(text) * rng.uniform(0.67, 0.98))]
+    return text.replace('"confidence": 0.85', '"confidence": "high"')
+
+
+def install_defects(fake: FakeGenAIClient, rate: float, seed: int = 25) -> dict:
+    """ Wraps the fake's async generate_content; returns the per-defect injection counts """
+    rng, injected = random.Random(seed), {d: 0 for d in DEFECTS}
+    answer = json.dumps({**CANNED_TRIAGE, "confidence": 0.85}, indent=2)
+    models, plain = fake.aio.models, fake.aio.models.generate_content
+
+    async def generate_content(*, model, contents, config=None):
+        await plain(model=model, contents=contents, config=config)  # latency + call count
+        prompt = " ".join(c for c in contents if isinstance(c, str)) if isinstance(contents, list) else contents
+        if "[YOUR PREVIOUS ANSWER WAS INCOMPLETE]" in prompt or rng.random() >= rate:
+            return FakeResponse(answer)
+        defect = DEFECTS[sum(injected.values()) % len(DEFECTS)]
+        injected[defect] += 1
+        return FakeResponse(with_defect(answer, defect, rng))
+
+    models.generate_content = generate_content
+    return injected
+
+
+def strict_parse(model):
+    """ The old parse_triage: strict JSON, then the Pydantic model """
+    def parse(text: str) -> dict:
+        result = json.loads(text)
+        if not isinstance(result, dict):
+            raise SchemaError(f"expected a JSON object, got {type(result).__name__}")
+        model(**result)
+        return result
+    return parse
+
+
+async def run_pass(main, fake, args, offset: int) -> dict:
+    transport = httpx.ASGITransport(app=main.app)
+    pool = asyncio.Semaphore(args.concurrency)
+    calls_before = fake.calls["generate"]
+    router_before = main.model_router.stats()
+    latencies, fallbacks = [], 0
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+        async def triage(i: int):
+            nonlocal fallbacks
+            async with pool:
+                patient = sample_patient(offset + i)
+                patient["medicalHistory"]["chiefComplaint"] += f" (case {offset + i})"
+                started = time.perf_counter()
+                response = await http.post("/triage", json=patient)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+                fallbacks += response.json()["medical_diagnosis"] == ["System Unavailable"]
+
+        await asyncio.gather(*[triage(i) for i in range(args.requests)])
+    router = main.model_router.stats()
+    return {
+        "calls": fake.calls["generate"] - calls_before,
+        "escalations": router["escalations"] - router_before["escalations"],
+        "reasks": sum(n for key, n in router["routes"].items() if key.endswith(":reask"))
+                  - sum(n for key, n in router_before["routes"].items() if key.endswith(":reask")),
+        "fallbacks": fallbacks,
+        "p50_ms": sorted(latencies)[len(latencies) // 2] * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--defect-rate", type=float, default=0.3)
+    parser.add_argument("--generate-latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    fake = FakeGenAIClient(generate_latency=args.generate_latency, embed_latency=0.0)
+    main_module, _ = load_app(fake)
+    injected = install_defects(fake, args.defect_rate)
+
+    async def run():
+        await seed_memory(main_module)
+        structured_parse = main_module.triage_output.parse
+        main_module.triage_output.parse = strict_parse(main_module.TriageOutput)
+        strict = await run_pass(main_module, fake, args, 0)
+        main_module.triage_output.parse = structured_parse
+        structured = await run_pass(main_module, fake, args, 100000)
+        return {"strict": strict, "structured": structured}
+
+    results = asyncio.run(run())
+    print(f"\n{args.requests} triage requests per mode, {args.defect_rate:.0%} of generations defective, "
+          f"generate {args.generate_latency}s")
+    print(f"defects injected (both modes): {injected}\n")
+    print(f"{'mode':>10} | {'calls/req':>9} | {'regenerations':>13} | {'re-asks':>7} | {'fallbacks':>9} | "
+          f"{'p50 ms':>6} | {'mean ms':>7}")
+    for mode, r in results.items():
+        print(f"{mode:>10} | {r['calls'] / args.requests:>9.3f} | {r['escalations']:>13} | {r['reasks']:>7} | "
+              f"{r['fallbacks']:>9} | {r['p50_ms']:>6.0f} | {r['mean_ms']:>7.0f}")
+    stats = main_module.triage_output.stats()
+    print(f"\nstructured output: {json.dumps(stats['answers'])}")
+    print(f"repairs: {json.dumps(stats['repairs'])}")
+
+    strict, structured = results["strict"], results["structured"]
+    ok = structured["escalations"] < strict["escalations"] and structured["fallbacks"] <= strict["fallbacks"]
+    print(f"\n{'✅' if ok else '❌'} {stats['generations_saved']} generations saved; regenerations "
+          f"{strict['escalations']} -> {structured['escalations']}, fallbacks {strict['fallbacks']} -> "
+          f"{structured['fallbacks']}")
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import json
+import time
+import random
+import asyncio
+import hashlib
+import math
+import re
+from types import SimpleNamespace
+
+# ==========================================
+# LOCAL STAND-IN FOR genai.Client
+# ==========================================
+# Mirrors the parts of the SDK that main.py touches:
+#   client.models.generate_content / embed_content      (sync)
+#   client.aio.models.generate_content / generate_content_stream / embed_content  (async)
+# No network, deterministic output, configurable latency and 429/503
+# error injection (seeded, so runs are repeatable).
+
+EMBEDDING_DIM = 768
+STREAM_CHUNKS = 8
+
+CANNED_TRIAGE = {
+    "scans": ["MRI Lumbar Spine"],
+    "reasoning": "Radicular pain pattern consistent with L5 root compression.",
+    "urgency": "Routine",
+    "medical_diagnosis": ["L5 Radiculopathy"],
+    "safety_override": None,
+    "Additional_comments": "Benchmark response.",
+    "cited_rules": ["Diagnosis: Weakness in Big Toe Extension (EHL) -> Specific for L5 Nerve Root."]
+}
+
+CANNED_VISION = {
+    "scan_quality": "Readable",
+    "agreement_with_triage": "Yes",
+    "reasoning_vs_triage": "The MRI confirms L4-L5 compression.",
+    "visual_findings": [
+        {"structure": "L4-L5 Disc", "observation": "Herniation", "severity": "Moderate"}
+    ],
+    "critic_notes": "Benchmark response.",
+    "final_radiological_diagnosis": ["L4-L5 Herniation"],
+    "confidence": 0.9
+}
+
+CANNED_RULE = "CRITICAL OVERRIDE: IF benchmark correction THEN follow doctor reasoning."
+
+
+class FakeAPIError(Exception):
+    """ Shaped like google.genai.errors.APIError (has .code) """
+
+    def __init__(self, code: int, retry_delay: float = 0.0):
+        status = "RESOURCE_EXHAUSTED" if code == 429 else "UNAVAILABLE"
+        super().__init__(f"{code} {status}. {{'retryDelay': '{retry_delay}s'}}")
+        self.code = code
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeEmbedding:
+    def __init__(self, values):
+        self.values = values
+
+
+class FakeEmbedResponse:
+    def __init__(self, vectors):
+        self.embeddings = [FakeEmbedding(v) for v in vectors]
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM):
+    """ Deterministic bag-of-words hash embedding (unit norm) """
+    vector = [0.0] * dim
+    for token in re.findall(r"[a-z0-9]+", str(text).lower()):
+        digest = hashlib.md5(token.encode()).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _flatten_text(contents) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, (list, tuple)):
+        return " ".join(c for c in contents if isinstance(c, str))
+    return str(contents)
+
+
+def canned_text(contents) -> str:
+    """ Picks a canned answer from the prompt shape """
+    text = _flatten_text(contents)
+    if "Neuro-Vision" in text:
+        return json.dumps(CANNED_VISION)
+    if "CRITICAL OVERRIDE:" in text and "CASE ERROR" in text:
+        return CANNED_RULE
+    return json.dumps(CANNED_TRIAGE)
+
+
+class _FakeModelsBase:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def _embed(self, contents):
+        items = contents if isinstance(contents, list) else [contents]
+        return FakeEmbedResponse([fake_embedding(_flatten_text(c)) for c in items])
+
+
+class FakeModels(_FakeModelsBase):
+    """ Sync surface (client.models) """
+
+    def generate_content(self, *, model, contents, config=None):
+        self.owner.record("generate", model)
+        time.sleep(self.owner.latency(self.owner.generate_latency))
+        self.owner.maybe_fail()
+        return FakeResponse(canned_text(contents))
+
+    def embed_content(self, *, model, contents, config=None):
+        self.owner.record("embed", model)
+        time.sleep(self.owner.latency(self.owner.embed_latency))
+        self.owner.maybe_fail()
+        return self._embed(contents)
+
+
+class FakeAsyncModels(_FakeModelsBase):
+    """ Async surface (client.aio.models) """
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.owner.record("generate", model)
+        await asyncio.sleep(self.owner.latency(self.owner.generate_latency))
+        self.owner.maybe_fail()
+        return FakeResponse(canned_text(contents))
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        """ Like the SDK: awaiting returns an async iterator of chunks (latency spread across them) """
+        self.owner.record("generate", model)
+        self.owner.maybe_fail()
+        text = canned_text(contents)
+        size = max(1, len(text) // STREAM_CHUNKS)
+        delay = self.owner.latency(self.owner.generate_latency) / STREAM_CHUNKS
+
+        async def chunks():
+            for i in range(0, len(text), size):
+                await asyncio.sleep(delay)
+                yield FakeResponse(text[i:i + size])
+
+        return chunks()
+
+    async def get(self, *, model):
+        """ Model metadata lookup (the /readyz probe) """
+        self.owner.record("get", model)
+        return SimpleNamespace(name=f"models/{model}")
+
+    async def embed_content(self, *, model, contents, config=None):
+        self.owner.record("embed", model)
+        await asyncio.sleep(self.owner.latency(self.owner.embed_latency))
+        self.owner.maybe_fail()
+        return self._embed(contents)
+
+
+class _FakeAio:
+    def __init__(self, owner):
+        self.models = FakeAsyncModels(owner)
+
+
+class FakeGenAIClient:
+    """ Drop-in replacement for genai.Client in benchmarks """
+
+    def __init__(self, generate_latency: float = 0.5, embed_latency: float = 0.05,
+                 jitter: float = 0.0, error_rate: float = 0.0, error_codes=(429, 503), seed: int = 0):
+        self.generate_latency = generate_latency
+        self.embed_latency = embed_latency
+        self.jitter = jitter            # +/- fraction of the base latency
+        self.error_rate = error_rate    # probability a call raises 429/503
+        self.error_codes = tuple(error_codes)
+        self.rng = random.Random(seed)
+        self.calls = {"generate": 0, "embed": 0, "get": 0}
+        self.errors = 0
+        self.models = FakeModels(self)
+        self.aio = _FakeAio(self)
+
+    def record(self, kind: str, model: str):
+        self.calls[kind] += 1
+
+    def latency(self, base: float) -> float:
+        if not self.jitter:
+            return base
+        return max(0.0, base * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+    def maybe_fail(self):
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise FakeAPIError(self.rng.choice(self.error_codes))
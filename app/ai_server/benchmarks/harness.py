@@ -0,0 +1,80 @@
+import os
+import sys
+import asyncio
+import tempfile
+import importlib
+
+# ==========================================
+# SHARED BENCHMARK HARNESS
+# ==========================================
+# Imports main.py against a throwaway ./ai_memory and a fake Gemini client,
+# so nothing here touches the real store or spends quota. The temp store can
+# be seeded through the same pipeline and rule lists as the production seed scripts.
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+from fake_gemini import FakeGenAIClient, fake_embedding  # noqa: E402
+
+# Collection -> (seed script module, rule list variable)
+SEED_SCRIPTS = {
+    "triage_pearls": ("seed_memory", "doctor_rules"),
+    "visual_corrections": ("seed_vision_memory", "rules"),
+}
+
+
+def load_app(fake_client: FakeGenAIClient, workdir: str = None):
+    """ Imports main.py inside a temp (or the given, e.g. pre-seeded) working dir and swaps in the fake client """
+    workdir = workdir or tempfile.mkdtemp(prefix="ai_bench_")
+    os.chdir(workdir)
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark-fake-key")
+    # The fake has no quota; keep the governor from becoming the bottleneck
+    for name in ("GEMINI_GENERATE_RPM", "GEMINI_DEEP_RPM", "GEMINI_EMBED_RPM"):
+        os.environ.setdefault(name, "1000000")
+
+    main = importlib.import_module("main")
+    main.client = fake_client
+    return main, workdir
+
+
+def seed_source(collection: str) -> tuple:
+    """ (source, rules, id prefix, metadata) exactly as the production seed script passes them """
+    module_name, variable = SEED_SCRIPTS[collection]
+    module = importlib.import_module(module_name)
+    return module.SOURCE, getattr(module, variable), module.ID_PREFIX, module.RULE_METADATA
+
+
+async def fake_embed_many(texts: list) -> list:
+    return [fake_embedding(text) for text in texts]
+
+
+async def seed_memory(main) -> dict:
+    """ Seeds the temp collections through the production seeding pipeline, then rebuilds indexes """
+    from seeding import seed_collection
+    collections = {"triage_pearls": main.rule_collection, "visual_corrections": main.correction_collection}
+    counts = {}
+    for name in SEED_SCRIPTS:
+        source, rules, prefix, metadata = seed_source(name)
+        await seed_collection(collections[name].collection, source, rules, prefix, metadata, fake_embed_many)
+        counts[name] = len(rules)
+    for collection in main.MEMORY_COLLECTIONS:
+        collection.shadow.ready = False
+    await asyncio.gather(*[collection.load() for collection in main.MEMORY_COLLECTIONS])
+    await main.warm_local_memory()
+    return counts
+
+
+def sample_patient(i: int = 0) -> dict:
+    return {
+        "details": {"fullName": f"Bench Patient {i}", "age": 40 + i % 30, "gender": "male"},
+        "medicalHistory": {
+            "chiefComplaint": "Low back pain radiating to left leg",
+            "historyDuration": "8 weeks",
+            "bowelBladderIncontinence": False,
+            "limbWeakness": i % 7 == 0,
+        },
+        "examination": {},
+        "expectations": {},
+        "assistantInput": {},
+    }
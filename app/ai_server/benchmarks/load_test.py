@@ -0,0 +1,231 @@
+"""
+Offline load test for the AI server.
+
+Swaps genai.Client for the deterministic fake in fake_gemini.py, points
+Chroma at a throwaway directory seeded from seed_memory.py and
+seed_vision_memory.py, then drives the main endpoints at a fixed
+concurrency. Reports throughput, p50/p95/p99 latency, error/fallback
+counts and peak RSS per endpoint. No network, no quota.
+
+    python benchmarks/load_test.py --requests 200 --concurrency 16
+    python benchmarks/load_test.py --error-rate 0.1 --json results.json
+    python benchmarks/load_test.py --endpoints triage,analyze_images --max-p95 2.0
+"""
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+import httpx
+
+from harness import SERVER_DIR, load_app, sample_patient, seed_memory
+from fake_gemini import FakeGenAIClient, CANNED_TRIAGE
+
+TEST_IMAGE = os.path.join(SERVER_DIR, "..", "..", "vision-test-image")
+ENDPOINTS = ("triage", "analyze_images", "doctor_agree", "submit_correction")
+
+
+def load_test_image() -> bytes:
+    """ The repo's sample film, or a generated stand-in when it's missing """
+    if os.path.exists(TEST_IMAGE):
+        with open(TEST_IMAGE, "rb") as f:
+            return f.read()
+    from PIL import Image
+    out = io.BytesIO()
+    Image.new("RGB", (1120, 690), (40, 40, 40)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+# ---------- request builders (i makes each payload unique, so caches don't hide work) ----------
+def triage_request(i: int, image: bytes):
+    return "POST", "/triage", {"json": sample_patient(i)}
+
+
+def analyze_images_request(i: int, image: bytes):
+    context = {
+        "age": 40 + i % 30, "gender": "female", "chiefComplaint": f"Back pain, visit {i}",
+        "aiTriageResponse": CANNED_TRIAGE,
+    }
+    return "POST", "/analyze_images", {
+        "data": {"patient_context": json.dumps(context)},
+        "files": [("files", (f"film_{i}.jpg", image, "image/jpeg"))],
+    }
+
+
+def doctor_agree_request(i: int, image: bytes):
+    return "POST", "/doctor_agree", {"json": {
+        "patient_data": {"fullName": f"Bench Patient {i}"},
+        "ai_response": CANNED_TRIAGE,
+        "doctor_id": f"doc_{i % 5}",
+    }}
+
+
+def submit_correction_request(i: int, image: bytes):
+    return "POST", "/submit_correction", {"json": {
+        "correct_diagnosis": f"L4 Radiculopathy (case {i})",
+        "doctor_reasoning": "Knee jerk reduced, medial leg numbness.",
+    }}
+
+
+BUILDERS = {
+    "triage": triage_request,
+    "analyze_images": analyze_images_request,
+    "doctor_agree": doctor_agree_request,
+    "submit_correction": submit_correction_request,
+}
+
+
+def is_fallback(endpoint: str, body) -> bool:
+    if not isinstance(body, dict):
+        return False
+    if endpoint == "triage":
+        return "System Error" in str(body.get("reasoning", ""))
+    if endpoint == "analyze_images":
+        return "Fallback" in str(body.get("reasoning_vs_triage", ""))
+    return False
+
+
+def percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarise(name: str, latencies, errors: int, fallbacks: int, elapsed: float) -> dict:
+    return {
+        "endpoint": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "fallbacks": fallbacks,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0,
+    }
+
+
+async def run_endpoint(http, name: str, total: int, concurrency: int, image: bytes, offset: int) -> dict:
+    """ Sends `total` requests to one endpoint with at most `concurrency` in flight """
+    build = BUILDERS[name]
+    latencies, errors, fallbacks = [], 0, 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors, fallbacks
+        method, path, kwargs = build(offset + i, image)
+        async with slots:
+            start = time.perf_counter()
+            try:
+                response = await http.request(method, path, **kwargs)
+            except Exception as e:
+                print(f"🔥 {name} request {i} raised: {e}")
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors += 1
+        elif is_fallback(name, response.json()):
+            fallbacks += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(total)])
+    return summarise(name, latencies, errors, fallbacks, time.perf_counter() - start)
+
+
+async def run(args) -> dict:
+    fake = FakeGenAIClient(
+        generate_latency=args.generate_latency, embed_latency=args.embed_latency,
+        jitter=args.jitter, error_rate=args.error_rate, seed=args.seed,
+    )
+    server, workdir = load_app(fake)
+    seeded = await seed_memory(server)
+    image = load_test_image()
+
+    from image_ingest import peak_rss_kb
+    transport = httpx.ASGITransport(app=server.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as http:
+        for n, name in enumerate(args.endpoints):
+            rss_before = peak_rss_kb()
+            summary = await run_endpoint(http, name, args.requests, args.concurrency, image, offset=n * args.requests)
+            summary["peak_rss_mb"] = round(peak_rss_kb() / 1024, 1)
+            summary["peak_rss_growth_mb"] = round((peak_rss_kb() - rss_before) / 1024, 1)
+            results.append(summary)
+
+    return {
+        "config": {
+            "requests": args.requests, "concurrency": args.concurrency,
+            "generate_latency": args.generate_latency, "embed_latency": args.embed_latency,
+            "jitter": args.jitter, "error_rate": args.error_rate, "seed": args.seed,
+        },
+        "seeded": seeded,
+        "workdir": workdir,
+        "upstream_calls": dict(fake.calls),
+        "upstream_errors_injected": fake.errors,
+        "results": results,
+    }
+
+
+def print_report(report: dict):
+    config = report["config"]
+    print(f"\n📊 {config['requests']} requests/endpoint @ concurrency {config['concurrency']} "
+          f"(generate {config['generate_latency']}s, embed {config['embed_latency']}s, "
+          f"error rate {config['error_rate']:.0%})")
+    print(f"   Seeded: {report['seeded']}  Upstream calls: {report['upstream_calls']} "
+          f"(injected errors: {report['upstream_errors_injected']})\n")
+    header = f"{'endpoint':<18}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'fallback':>10}{'rss MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in report["results"]:
+        print(f"{r['endpoint']:<18}{r['throughput_rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+              f"{r['errors']:>8}{r['fallbacks']:>10}{r['peak_rss_mb']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated subset of " + ", ".join(ENDPOINTS))
+    parser.add_argument("--generate-latency", type=float, default=0.5, help="fake generate latency (s)")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="fake embed latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- latency fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that 429/503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the full report to this file")
+    parser.add_argument("--max-p95", type=float, help="fail (exit 1) if any endpoint's p95 exceeds this many seconds")
+    args = parser.parse_args()
+    args.endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = [e for e in args.endpoints if e not in BUILDERS]
+    if unknown:
+        parser.error(f"unknown endpoints: {unknown}")
+
+    # Keep retry backoff proportional to the fake's latency, not production's seconds
+    os.environ.setdefault("GEMINI_BACKOFF_BASE", str(max(0.05, args.generate_latency / 5)))
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {json_path}")
+
+    if args.max_p95 is not None:
+        slow = [r["endpoint"] for r in report["results"] if r["p95_ms"] > args.max_p95 * 1000]
+        if slow:
+            print(f"❌ p95 above {args.max_p95}s: {slow}")
+            sys.exit(1)
+    if any(r["errors"] for r in report["results"]):
+        print("❌ Some requests returned non-200 responses.")
+        sys.exit(1)
+    print("\n✅ Load test finished.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+import os
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from memory_index import VectorIndex, _empty_result, where_equalities
+
+# ==========================================
+# COMPRESSED INDEX TIER
+# ==========================================
+# For the gold-case archive (years of /doctor_agree + /archive_vision_case).
+# A float32 768-dim vector costs 3 KB of heap per case; this tier keeps only
+#   - int8 codes (per-dimension scalar quantization), optionally of a PCA
+#     projection fit on the archive itself (768 -> COMPRESSED_PCA_DIM)
+#   - two float32 norms per row
+# in memory. The exact float32 rows live in an unlinked, file-backed memory
+# map in COMPRESSED_SPILL_DIR (never heap); an index loaded straight from a
+# memory_snapshot mapping keeps serving its exact rows from that file. Those
+# pages are reclaimable page cache only on a disk-backed filesystem: on
+# tmpfs (often /tmp) they are shared memory that stays resident or goes to
+# swap, so the default is ./index_spill next to the other stores and a
+# tmpfs spill directory is reported at first use (and in stats()).
+#
+# A query scores every row against the codes (int8 widened to float32 one
+# L2-sized block at a time), keeps the best max(k x COMPRESSED_RERANK_FACTOR,
+# COMPRESSED_RERANK_MIN) candidates and re-ranks those on the exact rows, so
+# returned distances are exact. recall@k against brute force is reported by
+# evaluate_recall() (and /memory/index/stats?recall_k=10).
+#
+#     GOLD_CASE_INDEX_TIER=exact | int8 | pca-int8
+
+GOLD_CASE_INDEX_TIER = os.getenv("GOLD_CASE_INDEX_TIER", "exact")
+COMPRESSED_PCA_DIM = int(os.getenv("COMPRESSED_PCA_DIM", "256"))
+COMPRESSED_RERANK_FACTOR = int(os.getenv("COMPRESSED_RERANK_FACTOR", "8"))
+COMPRESSED_RERANK_MIN = int(os.getenv("COMPRESSED_RERANK_MIN", "64"))
+COMPRESSED_SPILL_DIR = os.getenv("COMPRESSED_SPILL_DIR", "") or "./index_spill"  # disk-backed, not tmpfs
+
+PCA_MIN_ROWS = 512       # below this a projection is not worth fitting
+PCA_FIT_SAMPLE = 20000   # rows the projection / quantizer ranges are fit on
+_BLOCK = 16384           # rows copied / encoded at a time on writes
+_SCORE_BLOCK_BYTES = 256 * 1024  # float32 scratch per scoring block: stays in L2
+BYTES_PER_MILLION = 1_000_000
+MEMORY_BACKED_FS = {"tmpfs", "ramfs", "devtmpfs"}
+
+_spill_checked = set()
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """ Type of the filesystem holding path, from /proc/mounts (None where that is unavailable) """
+    try:
+        with open("/proc/mounts") as mounts:
+            entries = [line.split()[1:3] for line in mounts]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best = None
+    for mount_point, fs_type in entries:
+        inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+        if inside and (best is None or len(mount_point) > len(best[0])):
+            best = (mount_point, fs_type)
+    return best[1] if best else None
+
+
+def _spill(capacity: int, dim: int, directory: str = COMPRESSED_SPILL_DIR) -> np.ndarray:
+    """ Zeroed float32 (capacity x dim) map over an already-unlinked temp file """
+    if capacity == 0 or dim == 0:
+        return np.zeros((capacity, dim), dtype=np.float32)
+    if directory not in _spill_checked:
+        os.makedirs(directory, exist_ok=True)
+        if filesystem_type(directory) in MEMORY_BACKED_FS:
+            print(f"⚠️ COMPRESSED_SPILL_DIR {directory} is memory-backed: exact rows will stay resident. "
+                  f"Point it at a disk directory to make them reclaimable page cache")
+        _spill_checked.add(directory)
+    fd, path = tempfile.mkstemp(prefix="spine_exact_", suffix=".f32", dir=directory)
+    try:
+        os.ftruncate(fd, capacity * dim * 4)
+        matrix = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+    finally:
+        os.close(fd)
+        os.unlink(path)  # the mapping keeps the pages; the file vanishes with the process
+    return matrix
+
+
+class CompressedVectorIndex(VectorIndex):
+    """ VectorIndex whose search runs on int8 (optionally PCA-projected) codes, re-ranked exactly """
+
+    def __init__(self, dim: Optional[int] = None, pca_dim: int = 0,
+                 rerank_factor: int = COMPRESSED_RERANK_FACTOR, rerank_min: int = COMPRESSED_RERANK_MIN):
+        super().__init__(dim)
+        self.pca_dim = pca_dim
+        self.rerank_factor = rerank_factor
+        self.rerank_min = rerank_min
+        self._mean: Optional[np.ndarray] = None
+        self._components: Optional[np.ndarray] = None   # (dim x pca_dim)
+        self._base: Optional[np.ndarray] = None         # dequantized value of code -128, per code dim
+        self._scale: Optional[np.ndarray] = None
+        self._codes = np.zeros((0, 0), dtype=np.int8)
+        self._approx_norms = np.zeros(0, dtype=np.float32)
+        self._fitted_rows = 0
+        self.explained_variance: Optional[float] = None
+
+    @property
+    def tier(self) -> str:
+        return "pca-int8" if self._components is not None else "int8"
+
+    @property
+    def code_dim(self) -> int:
+        return self._components.shape[1] if self._components is not None else (self.dim or 0)
+
+    # ---------- codec ----------
+    def _fit(self, sample: np.ndarray):
+        """ PCA (if enabled and worth it) + per-dimension int8 ranges, from a row sample """
+        self._mean = self._components = None
+        self.explained_variance = None
+        if self.pca_dim and self.pca_dim < sample.shape[1] and len(sample) >= PCA_MIN_ROWS:
+            self._mean = sample.mean(axis=0)
+            _, singular, vt = np.linalg.svd(sample - self._mean, full_matrices=False)
+            self._components = np.ascontiguousarray(vt[:self.pca_dim].T)
+            energy = singular ** 2
+            self.explained_variance = float(energy[:self.pca_dim].sum() / max(energy.sum(), 1e-12))
+        projected = self._project(sample)
+        low, high = projected.min(axis=0), projected.max(axis=0)
+        self._scale = np.maximum((high - low) / 255.0, 1e-12).astype(np.float32)
+        self._base = low.astype(np.float32)
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        if self._components is None:
+            return vectors
+        return (vectors - self._mean) @ self._components
+
+    def _encode(self, vectors: np.ndarray):
+        """ -> (int8 codes, squared norms of the dequantized vectors) """
+        steps = np.rint((self._project(vectors) - self._base) / self._scale)
+        codes = (np.clip(steps, 0, 255) - 128).astype(np.int8)
+        approx = self._base + (codes.astype(np.float32) + 128.0) * self._scale
+        return codes, np.einsum("ij,ij->i", approx, approx)
+
+    def _encode_rows(self, start: int, stop: int):
+        for b in range(start, stop, _BLOCK):
+            e = min(b + _BLOCK, stop)
+            self._codes[b:e], self._approx_norms[b:e] = self._encode(np.asarray(self._matrix[b:e]))
+
+    def _refit(self):
+        """ Re-fits the codec on the current rows and re-encodes them (load / archive doubled) """
+        if self.size == 0:
+            return
+        rng = np.random.default_rng(self.size)
+        sample = np.sort(rng.choice(self.size, min(self.size, PCA_FIT_SAMPLE), replace=False))
+        self._fit(np.asarray(self._matrix[sample], dtype=np.float32))
+        self._codes = np.zeros((self._matrix.shape[0], self.code_dim), dtype=np.int8)
+        self._approx_norms = np.zeros(self._matrix.shape[0], dtype=np.float32)
+        self._encode_rows(0, self.size)
+        self._fitted_rows = self.size
+
+    # ---------- writes ----------
+    def load(self, ids, embeddings, documents=None, metadatas=None):
+        n = len(ids)
+        if n:
+            embeddings = np.asarray(embeddings, dtype=np.float32).reshape(n, -1)
+            self.dim = embeddings.shape[1]
+        if n and isinstance(embeddings, np.memmap):
+            self._matrix = embeddings  # already paged from a snapshot file: keep serving from it
+        else:
+            self._matrix = _spill(n, self.dim or 0)
+            for b in range(0, n, _BLOCK):
+                self._matrix[b:b + _BLOCK] = embeddings[b:b + _BLOCK]
+        self._sq_norms = np.zeros(n, dtype=np.float32)
+        for b in range(0, n, _BLOCK):
+            block = np.asarray(self._matrix[b:b + _BLOCK])
+            self._sq_norms[b:b + _BLOCK] = np.einsum("ij,ij->i", block, block)
+        self.size = n
+        self.ids = list(ids)
+        self.documents = list(documents) if documents is not None else [None] * n
+        self.metadatas = [dict(m or {}) for m in metadatas] if metadatas is not None else [{} for _ in ids]
+        self._positions = {id_: i for i, id_ in enumerate(self.ids)}
+        self._columns = {}
+        self._codes = np.zeros((0, 0), dtype=np.int8)
+        self._fitted_rows = 0
+        self._refit()
+
+    def _grow(self, needed: int):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity and self._matrix.shape[1] == self.dim:
+            return
+        new_capacity = max(needed, capacity * 2, 16)
+        matrix = _spill(new_capacity, self.dim)
+        norms = np.zeros(new_capacity, dtype=np.float32)
+        codes = np.zeros((new_capacity, self._codes.shape[1] if self._codes.size else self.code_dim), dtype=np.int8)
+        approx_norms = np.zeros(new_capacity, dtype=np.float32)
+        for b in range(0, self.size, _BLOCK):
+            matrix[b:min(b + _BLOCK, self.size)] = self._matrix[b:min(b + _BLOCK, self.size)]
+        if self.size:
+            norms[:self.size] = self._sq_norms[:self.size]
+            codes[:self.size] = self._codes[:self.size]
+            approx_norms[:self.size] = self._approx_norms[:self.size]
+        self._matrix, self._sq_norms, self._codes, self._approx_norms = matrix, norms, codes, approx_norms
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        if self.size == 0:
+            return self.load(ids, embeddings, documents, metadatas)
+        super().upsert(ids, embeddings, documents, metadatas)
+        if self.size >= 2 * self._fitted_rows:
+            self._refit()  # the archive doubled since the codec was fit: re-fit ranges / projection
+            return
+        positions = [self._positions[id_] for id_ in ids]
+        self._codes[positions], self._approx_norms[positions] = self._encode(
+            np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        )
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        super().update(ids, embeddings, documents, metadatas)
+        if embeddings is not None:
+            present = [(self._positions[id_], vector) for id_, vector in zip(ids, embeddings) if id_ in self._positions]
+            if present:
+                positions = [p for p, _ in present]
+                self._codes[positions], self._approx_norms[positions] = self._encode(
+                    np.asarray([v for _, v in present], dtype=np.float32).reshape(len(present), -1)
+                )
+
+    def delete(self, ids):
+        doomed = {self._positions[id_] for id_ in ids if id_ in self._positions}
+        if not doomed:
+            return
+        keep = np.array([i for i in range(self.size) if i not in doomed], dtype=np.int64)
+        matrix = _spill(len(keep), self.dim)
+        for b in range(0, len(keep), _BLOCK):
+            matrix[b:b + _BLOCK] = self._matrix[keep[b:b + _BLOCK]]
+        self._matrix = matrix
+        self._sq_norms = self._sq_norms[keep]
+        self._codes = self._codes[keep]
+        self._approx_norms = self._approx_norms[keep]
+        self.ids = [self.ids[i] for i in keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self.size = len(keep)
+        self._positions = {id_: i for i, id_ in enumerate(self.ids)}
+        self._columns = {}
+
+    # ---------- reads ----------
+    def approximate_distances(self, queries: np.ndarray) -> np.ndarray:
+        """ (n_queries x size) squared L2 in code space """
+        projected = self._project(queries).astype(np.float32)
+        weighted = np.ascontiguousarray((projected * self._scale).T)
+        offset = projected @ (self._base + 128.0 * self._scale)
+        # numpy has no BLAS path for int8 / float16 products (both measured 5-20x slower than
+        # this), so codes are widened a cache-sized block at a time into one reused float32
+        # buffer: the widening never leaves L2 and the scan stays bound by the int8 reads.
+        rows = max(64, _SCORE_BLOCK_BYTES // (4 * max(self.code_dim, 1)))
+        buffer = np.empty((rows, self.code_dim), dtype=np.float32)
+        dots = np.empty((self.size, len(queries)), dtype=np.float32)
+        for b in range(0, self.size, rows):
+            e = min(b + rows, self.size)
+            block = buffer[:e - b]
+            np.copyto(block, self._codes[b:e], casting="unsafe")
+            np.matmul(block, weighted, out=dots[b:e])
+        query_norms = np.einsum("ij,ij->i", projected, projected)
+        return query_norms[:, None] - 2.0 * (dots.T + offset[:, None]) + self._approx_norms[None, :self.size]
+
+    def query(self, query_embeddings, n_results: int = 10, include=None, where=None) -> dict:
+        """ Approximate pass on the codes, exact re-rank of the best candidates """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        filters = where_equalities(where)
+        if filters is None:
+            raise ValueError(f"Only equality filters are served from the index, got {where}")
+        mask = self.mask(filters)
+        available = self.size if mask is None else int(mask.sum())
+        k = min(n_results, available)
+        if k == 0:
+            return _empty_result(len(queries), include)
+
+        approx = self.approximate_distances(queries)
+        if mask is not None:
+            approx[:, ~mask] = np.inf
+        n_candidates = min(available, max(k * self.rerank_factor, self.rerank_min))
+        result = _empty_result(0, include)
+        for q, row in zip(queries, approx):
+            candidates = (np.argpartition(row, n_candidates - 1)[:n_candidates]
+                          if n_candidates < self.size else np.arange(self.size))
+            candidates.sort()  # ascending offsets: sequential reads from the map
+            exact = float(q @ q) - 2.0 * (np.asarray(self._matrix[candidates]) @ q) + self._sq_norms[candidates]
+            if mask is not None:
+                exact[~mask[candidates]] = np.inf
+            order = np.argsort(exact, kind="stable")[:k]
+            top = candidates[order]
+            result["ids"].append([self.ids[i] for i in top])
+            result["documents"].append([self.documents[i] for i in top])
+            result["metadatas"].append([dict(self.metadatas[i]) for i in top])
+            result["distances"].append([float(max(d, 0.0)) for d in exact[order]])
+            if "embeddings" in result:
+                result["embeddings"].append(np.asarray(self._matrix[top]).copy())
+        return result
+
+    # ---------- reporting ----------
+    def evaluate_recall(self, k: int = 10, samples: int = 200, seed: int = 0) -> Optional[float]:
+        """ recall@k of query() vs brute force on the exact rows, for queries between random row pairs """
+        if self.size <= k:
+            return None
+        rng = np.random.default_rng(seed)
+        pairs = rng.choice(self.size, size=(min(samples, self.size), 2))
+        queries = (np.asarray(self._matrix[pairs[:, 0]]) + np.asarray(self._matrix[pairs[:, 1]])) / 2.0
+        exact = np.empty((len(queries), self.size), dtype=np.float32)
+        for b in range(0, self.size, _BLOCK):
+            e = min(b + _BLOCK, self.size)
+            exact[:, b:e] = self._sq_norms[b:e][None, :] - 2.0 * (queries @ np.asarray(self._matrix[b:e]).T)
+        truth = np.argpartition(exact, k - 1, axis=1)[:, :k]
+        found = self.query(queries, k)["ids"]
+        hits = sum(len({self.ids[i] for i in t} & set(f)) for t, f in zip(truth, found))
+        return hits / (k * len(queries))
+
+    def stats(self, recall_k: int = 0) -> dict:
+        float_bytes = (self.dim or 0) * 4
+        resident = self.code_dim + 8  # int8 codes + exact / approximate squared norms
+        report = {
+            "tier": self.tier,
+            "rows": self.size,
+            "dim": self.dim,
+            "code_dim": self.code_dim,
+            "bytes_per_vector": resident,
+            "float32_bytes_per_vector": float_bytes,
+            "saved_mb_per_million": round((float_bytes - resident) * BYTES_PER_MILLION / 2 ** 20, 1),
+            "explained_variance": None if self.explained_variance is None else round(self.explained_variance, 4),
+            "rerank_candidates": f"max({self.rerank_factor}k, {self.rerank_min})",
+            "spill_dir": COMPRESSED_SPILL_DIR,
+            "spill_filesystem": filesystem_type(COMPRESSED_SPILL_DIR),
+        }
+        if recall_k:
+            report[f"recall@{recall_k}"] = self.evaluate_recall(recall_k)
+        return report
+
+
+def resident_bytes_per_vector(tier: str, dim: int) -> int:
+    """ Heap bytes per row of a tier's index (what stats() reports as bytes_per_vector) """
+    if tier == "exact":
+        return dim * 4 + 4  # float32 row + squared norm
+    code_dim = min(COMPRESSED_PCA_DIM, dim) if tier == "pca-int8" else dim
+    return code_dim + 8     # int8 codes + exact / approximate squared norms
+
+
+def vector_index_factory(tier: str = GOLD_CASE_INDEX_TIER):
+    """ dim -> empty index of the configured tier (for PartitionedIndex partitions) """
+    if tier == "exact":
+        return VectorIndex
+    if tier == "int8":
+        return lambda dim=None: CompressedVectorIndex(dim)
+    if tier == "pca-int8":
+        return lambda dim=None: CompressedVectorIndex(dim, pca_dim=COMPRESSED_PCA_DIM)
+    raise ValueError(f"Unknown index tier {tier!r} (exact | int8 | pca-int8)")
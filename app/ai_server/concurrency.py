@@ -0,0 +1,148 @@
+import os
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from metrics import stage
+from profiling import owned
+
+# ==========================================
+# BLOCKING WORK OFFLOAD
+# ==========================================
+# Chroma (SQLite + HNSW) and any sync SDK call must never run on the
+# uvicorn event loop. Everything blocking goes through one bounded pool.
+BLOCKING_POOL_SIZE = int(os.getenv("AI_BLOCKING_POOL_SIZE", "16"))
+
+_pool = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="ai-blocking")
+_increment_lock = threading.Lock()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """ Runs a sync callable on the bounded pool and awaits the result """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, functools.partial(owned(fn), *args, **kwargs))
+
+
+def increment_metadata(collection, ids: List[str], deltas: List[Dict[str, float]]) -> List[dict]:
+    """ Adds deltas to numeric metadata fields as one read-modify-write (blocking, process-wide lock) """
+    with _increment_lock:
+        current = collection.get(ids=ids, include=["metadatas"])
+        by_id = dict(zip(current["ids"], current["metadatas"]))
+        result = []
+        for id_, delta in zip(ids, deltas):
+            if id_ not in by_id:
+                result.append(None)
+                continue
+            meta = dict(by_id[id_] or {})
+            for field, amount in delta.items():
+                value = meta.get(field, 0) + amount
+                meta[field] = round(value, 4) if isinstance(value, float) else value
+            result.append(meta)
+        present = [(i, m) for i, m in zip(ids, result) if m is not None]
+        if present:
+            collection.update(ids=[i for i, _ in present], metadatas=[m for _, m in present])
+        return result
+
+
+class AsyncCollection:
+    """ Offloaded access layer around a Chroma collection """
+
+    def __init__(self, collection):
+        self.collection = collection
+        # Bumped on every write; anything derived from this collection's
+        # contents (cached prompts, results) is stamped with it.
+        self.version = 0
+        # Optional local-space mirror (embedding_backends.LocalShadow)
+        self.shadow = None
+        # Optional id/text lookup mirror (rule_registry.RuleRegistry)
+        self.registry = None
+
+    @property
+    def name(self):
+        return self.collection.name
+
+    async def query(self, **kwargs):
+        with stage(f"chroma_query.{self.name}"):
+            return await run_blocking(self.collection.query, **kwargs)
+
+    async def get(self, **kwargs):
+        with stage(f"chroma_query.{self.name}"):
+            return await run_blocking(self.collection.get, **kwargs)
+
+    async def add(self, **kwargs):
+        with stage(f"chroma_write.{self.name}"):
+            result = await run_blocking(self.collection.add, **kwargs)
+        self.version += 1
+        for mirror in self._mirrors():
+            mirror.on_upsert(kwargs["ids"], kwargs.get("documents"), kwargs.get("metadatas"))
+        return result
+
+    async def update(self, **kwargs):
+        with stage(f"chroma_write.{self.name}"):
+            result = await run_blocking(self.collection.update, **kwargs)
+        self.version += 1
+        for mirror in self._mirrors():
+            mirror.on_update(kwargs["ids"], kwargs.get("documents"), kwargs.get("metadatas"))
+        return result
+
+    async def upsert(self, **kwargs):
+        with stage(f"chroma_write.{self.name}"):
+            result = await run_blocking(self.collection.upsert, **kwargs)
+        self.version += 1
+        for mirror in self._mirrors():
+            mirror.on_upsert(kwargs["ids"], kwargs.get("documents"), kwargs.get("metadatas"))
+        return result
+
+    async def delete(self, **kwargs):
+        with stage(f"chroma_write.{self.name}"):
+            result = await run_blocking(self.collection.delete, **kwargs)
+        self.version += 1
+        for mirror in self._mirrors():
+            mirror.on_delete(kwargs.get("ids"))
+        return result
+
+    async def increment(self, ids: List[str], deltas: List[Dict[str, float]]) -> List[dict]:
+        """ Atomic counter bump; returns each row's new metadata (None if the id is gone) """
+        # A memory-service proxy applies it owner-side, so it is atomic across workers too
+        with stage(f"chroma_write.{self.name}"):
+            metadatas = await run_blocking(self._increment, ids, deltas)
+        self.version += 1
+        present = [(i, m) for i, m in zip(ids, metadatas) if m is not None]
+        for mirror in self._mirrors():
+            mirror.on_update([i for i, _ in present], None, [m for _, m in present])
+        return metadatas
+
+    async def snapshot(self, include: List[str]) -> dict:
+        """ Full read of the collection (a memory-service proxy also records the version it saw) """
+        with stage(f"chroma_query.{self.name}"):
+            return await run_blocking(self._snapshot, include)
+
+    async def changes(self, include: List[str]) -> Optional[dict]:
+        """ Rows other workers changed since our snapshot (memory-service proxy only); None = reload all """
+        with stage(f"chroma_query.{self.name}"):
+            return await run_blocking(self._changes, include)
+
+    # Capability checks run on the pool too: touching a lazily opened collection opens the store
+    def _increment(self, ids, deltas):
+        apply = getattr(self.collection, "increment", None) or functools.partial(increment_metadata, self.collection)
+        return apply(ids=ids, deltas=deltas)
+
+    def _snapshot(self, include):
+        read = getattr(self.collection, "snapshot", None) or self.collection.get
+        return read(include=include)
+
+    def _changes(self, include):
+        read = getattr(self.collection, "changes", None)
+        return read(include=include) if read is not None else None
+
+    def is_stale(self) -> bool:
+        """ True when another process has written since our last snapshot """
+        return getattr(self.collection, "stale", False)
+
+    def _mirrors(self):
+        return [m for m in (self.shadow, self.registry) if m is not None]
+
+    async def count(self):
+        return await run_blocking(self.collection.count)
@@ -0,0 +1,327 @@
+import os
+import math
+import time
+import asyncio
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from concurrency import run_blocking
+from memory_service import MEMORY_SERVICE_ADDRESS
+from rule_registry import CONFIDENCE_STEP
+
+# ==========================================
+# MEMORY CONSOLIDATION
+# ==========================================
+# Learned rules and gold cases only ever grew: every correction added a new
+# CRITICAL_OVERRIDE, every agreement a new gold case, and the top-5 memory
+# slots filled up with rephrasings of one correction.
+#
+#   write time   The write-behind flusher asks dedupe() about each new row.
+#                A row whose cosine similarity to an existing row of the same
+#                kind (priority + type) is >= CONSOLIDATION_SIMILARITY is not
+#                stored; the existing row gets usage_count/merged_count (and
+#                confidence, where it has one) bumped instead.
+#   background   compact() clusters each collection: near-duplicates are
+#                folded into the strongest row of their cluster, rules idle
+#                for CONSOLIDATION_STALE_DAYS merge at a looser threshold, and
+#                anything above the collection's capacity is evicted by a
+#                retention score (confidence x usage, halved every
+#                EVICTION_HALF_LIFE_DAYS since last seen).
+#
+# Gold cases are doctor-validated precedents and the archive is meant to
+# grow (gold_cases.py offloads oversized partitions, compressed_index.py
+# shrinks what stays resident), so GOLD_CASE_CAPACITY defaults to 0 =
+# unbounded: the compactor only folds near-duplicates there. Setting it
+# bounds the compaction pass (a full read of the collection) and the store's
+# size, at the price of evicting validated precedents by retention score.
+#
+# Curated rows (seed scripts / corpora) are never merged away or evicted,
+# though learned duplicates of the same kind may be folded into them.
+# Survivors list the IDs they absorbed in "merged_from", so older citations
+# of a merged rule still resolve (see rule_registry.py).
+
+CONSOLIDATION_SIMILARITY = float(os.getenv("CONSOLIDATION_SIMILARITY", "0.93"))
+CONSOLIDATION_STALE_SIMILARITY = float(os.getenv("CONSOLIDATION_STALE_SIMILARITY", "0.88"))
+CONSOLIDATION_STALE_DAYS = float(os.getenv("CONSOLIDATION_STALE_DAYS", "30"))
+CONSOLIDATION_INTERVAL = float(os.getenv("CONSOLIDATION_INTERVAL", "900"))  # seconds between compactor passes
+EVICTION_HALF_LIFE_DAYS = float(os.getenv("EVICTION_HALF_LIFE_DAYS", "90"))
+# Several workers sharing one memory service: enable the compactor on exactly one of them
+MEMORY_COMPACTION = os.getenv("MEMORY_COMPACTION", "0" if MEMORY_SERVICE_ADDRESS else "1") == "1"
+MEMORY_CAPACITY = {
+    "triage_pearls": int(os.getenv("RULE_CAPACITY", "2000")),
+    "gold_standard_cases": int(os.getenv("GOLD_CASE_CAPACITY", "0")),  # 0 = unbounded (see above)
+    "visual_corrections": int(os.getenv("VISUAL_RULE_CAPACITY", "2000")),
+}
+
+CURATED_TYPES = ("master_rule", "gold_standard")
+MERGED_FROM_LIMIT = 32  # IDs kept in a survivor's merged_from list
+DEDUPE_CANDIDATES = 3
+_SIMILARITY_BLOCK = 1024
+_DAY = 86400.0
+
+
+def is_protected(metadata: dict) -> bool:
+    """ Curated rows: written by a seed script / corpus (or by the pre-hash seed scripts) """
+    return bool(metadata.get("seed_source")) or metadata.get("type") in CURATED_TYPES
+
+
+def merge_kind(metadata: dict) -> tuple:
+    """ Only rows of the same kind merge (an override never folds into a standard guideline) """
+    return metadata.get("priority"), metadata.get("type")
+
+
+def entry_time(row_id: str, metadata: dict) -> Optional[float]:
+    """ Last time a row was written or merged into (epoch seconds), None if unknown """
+    for field in ("last_seen", "created_at"):
+        if isinstance(metadata.get(field), (int, float)):
+            return float(metadata[field])
+    parts = row_id.rsplit("_", 2)  # new_memory_id(): <prefix>_<time_ns>_<uuid8>
+    if len(parts) == 3 and parts[1].isdigit():
+        return int(parts[1]) / 1e9
+    try:
+        return datetime.fromisoformat(str(metadata["timestamp"])).timestamp()
+    except (KeyError, ValueError):
+        return None
+
+
+def retention_score(row_id: str, metadata: dict, now: float) -> float:
+    """ Higher survives eviction: confidence x log usage, decayed by time since last seen """
+    seen = entry_time(row_id, metadata)
+    age_days = max(0.0, now - seen) / _DAY if seen is not None else 0.0
+    uses = metadata.get("usage_count", 0) + metadata.get("merged_count", 0)
+    return float(metadata.get("confidence", 1.0)) * (1.0 + math.log1p(uses)) * 0.5 ** (age_days / EVICTION_HALF_LIFE_DAYS)
+
+
+def merge_delta(target: dict, absorbed: List[dict]) -> Dict[str, float]:
+    """ Counter deltas for folding `absorbed` rows into `target` """
+    delta = {
+        "usage_count": sum(1 + m.get("usage_count", 0) for m in absorbed),
+        "merged_count": sum(1 + m.get("merged_count", 0) for m in absorbed),
+    }
+    if "confidence" in target:
+        delta["confidence"] = CONFIDENCE_STEP * len(absorbed)
+    return delta
+
+
+def merged_from(target: dict, absorbed_ids: List[str], absorbed: List[dict]) -> str:
+    ids = [i for i in str(target.get("merged_from", "")).split(",") if i]
+    for row_id, metadata in zip(absorbed_ids, absorbed):
+        ids += [i for i in str(metadata.get("merged_from", "")).split(",") if i] + [row_id]
+    return ",".join(list(dict.fromkeys(ids))[-MERGED_FROM_LIMIT:])
+
+
+def _unit(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def plan_compaction(ids: List[str], embeddings, metadatas: List[dict], capacity: int, now: float,
+                    similarity: float = CONSOLIDATION_SIMILARITY,
+                    stale_similarity: float = CONSOLIDATION_STALE_SIMILARITY,
+                    stale_days: float = CONSOLIDATION_STALE_DAYS) -> dict:
+    """ Pure planning step (blocking): {"merges": [(survivor, [victims])], "evict": [ids]} """
+    n = len(ids)
+    if n == 0:
+        return {"merges": [], "evict": []}
+    metadatas = [m or {} for m in metadatas]
+    unit = _unit(np.asarray(embeddings, dtype=np.float32).reshape(n, -1))
+    protected = [is_protected(m) for m in metadatas]
+    kinds = [merge_kind(m) for m in metadatas]
+    stale = [
+        not protected[i] and now - (entry_time(ids[i], metadatas[i]) or now) > stale_days * _DAY
+        for i in range(n)
+    ]
+
+    # Sparse neighbour lists from blocked (block x n) products; the dense n x n matrix never exists
+    floor = min(similarity, stale_similarity)
+    neighbours: List[List[tuple]] = [[] for _ in range(n)]
+    for start in range(0, n, _SIMILARITY_BLOCK):
+        sims = unit[start:start + _SIMILARITY_BLOCK] @ unit.T
+        rows, cols = np.nonzero(sims >= floor)
+        for r, c in zip(rows.tolist(), cols.tolist()):
+            if start + r != c:
+                neighbours[start + r].append((c, float(sims[r, c])))
+
+    # Greedy clustering, strongest rows first: each unclaimed row absorbs its unclaimed look-alikes
+    strength = lambda i: (protected[i], metadatas[i].get("confidence", 0.0),
+                          metadatas[i].get("usage_count", 0) + metadatas[i].get("merged_count", 0),
+                          entry_time(ids[i], metadatas[i]) or 0.0)
+    settled = [False] * n
+    merges = []
+    for i in sorted(range(n), key=strength, reverse=True):
+        if settled[i]:
+            continue
+        settled[i] = True
+        victims = []
+        for j, score in sorted(neighbours[i], key=lambda p: -p[1]):
+            if settled[j] or protected[j] or kinds[j] != kinds[i]:
+                continue
+            if score >= (stale_similarity if stale[j] else similarity):
+                settled[j] = True
+                victims.append(j)
+        if victims:
+            merges.append((i, victims))
+
+    # Capacity: evict the lowest-retention unprotected rows that survive the merges
+    absorbed = {j for _, victims in merges for j in victims}
+    survivors = {i for i, _ in merges}
+    remaining = n - len(absorbed)
+    evict = []
+    if remaining > capacity:
+        candidates = [i for i in range(n) if i not in absorbed and i not in survivors and not protected[i]]
+        candidates.sort(key=lambda i: retention_score(ids[i], metadatas[i], now))
+        evict = [ids[i] for i in candidates[:remaining - capacity]]
+    return {
+        "merges": [(ids[i], [ids[j] for j in victims]) for i, victims in merges],
+        "evict": evict,
+    }
+
+
+class Consolidator:
+    """ Write-time near-duplicate merging plus the background compactor """
+
+    def __init__(self, collections: Dict[str, object], capacity: Dict[str, int] = MEMORY_CAPACITY,
+                 similarity: float = CONSOLIDATION_SIMILARITY, interval: float = CONSOLIDATION_INTERVAL):
+        self.collections = collections   # name -> AsyncCollection
+        self.capacity = capacity
+        self.similarity = similarity
+        self.interval = interval
+        self.exclusive: Optional[Callable[[], object]] = None  # async context that holds off other writers
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {name: {"write_merges": 0, "compaction_merges": 0, "evicted": 0} for name in collections}
+        self.passes = 0
+        self.last_pass_ms = None
+        self.last_error = None
+
+    # ---------- write time ----------
+    async def dedupe(self, collection, ids: List[str], documents: List[str], metadatas: List[dict],
+                     vectors: List[List[float]]) -> List[Optional[str]]:
+        """ For each new row: None (store it) or the ID it was merged into. Stamps kept rows. """
+        now = time.time()
+        unit = _unit(vectors)
+        targets: List[Optional[str]] = [None] * len(ids)
+        kept: List[int] = []
+        for i, metadata in enumerate(metadatas):
+            metadata.setdefault("created_at", now)
+            metadata["last_seen"] = now
+            for j in kept:  # rephrasings inside the same flush
+                if merge_kind(metadatas[j]) == merge_kind(metadata) and float(unit[i] @ unit[j]) >= self.similarity:
+                    for field, amount in merge_delta(metadatas[j], [metadata]).items():
+                        metadatas[j][field] = metadatas[j].get(field, 0) + amount
+                    targets[i] = ids[j]
+                    break
+            else:
+                kept.append(i)
+
+        merges: Dict[str, List[dict]] = {}
+        target_meta: Dict[str, dict] = {}
+        batch_ids = set(ids)
+        if kept and await collection.count():
+            results = await collection.query(
+                query_embeddings=[vectors[i] for i in kept], n_results=DEDUPE_CANDIDATES,
+                include=["embeddings", "metadatas"],
+            )
+            for row, i in enumerate(kept):
+                candidates = zip(results["ids"][row], results["metadatas"][row], results["embeddings"][row])
+                for candidate_id, candidate_meta, candidate_vector in candidates:
+                    candidate_meta = candidate_meta or {}
+                    if candidate_id in batch_ids:  # a replayed row that did go in last time: not a duplicate
+                        continue
+                    if merge_kind(candidate_meta) != merge_kind(metadatas[i]):
+                        continue
+                    if float(unit[i] @ _unit(candidate_vector)[0]) >= self.similarity:
+                        targets[i] = candidate_id
+                        merges.setdefault(candidate_id, []).append(metadatas[i])
+                        target_meta[candidate_id] = candidate_meta
+                        break
+
+        if merges:
+            merged_ids = list(merges)
+            await collection.increment(merged_ids, [merge_delta(target_meta[t], merges[t]) for t in merged_ids])
+            try:  # the counts are in; a missed last_seen must not make the caller retry (and count again)
+                await collection.update(ids=merged_ids, metadatas=[{"last_seen": now} for _ in merged_ids])
+            except Exception as e:
+                print(f"⚠️ last_seen of merged memory rows not updated: {e}")
+        self.counters[collection.name]["write_merges"] += sum(1 for t in targets if t is not None)
+        return targets
+
+    # ---------- background ----------
+    async def compact(self, collection) -> dict:
+        """ One pass over a collection: fold near-duplicate clusters, then enforce capacity """
+        data = await collection.get(include=["embeddings", "metadatas"])
+        ids, metadatas = data["ids"], [m or {} for m in data["metadatas"]]
+        embeddings = data["embeddings"] if data["embeddings"] is not None else []
+        now = time.time()
+        plan = await run_blocking(
+            plan_compaction, ids, embeddings, metadatas, self.capacity.get(collection.name) or len(ids), now,
+            self.similarity,
+        )
+        by_id = dict(zip(ids, metadatas))
+        if plan["merges"]:
+            survivors = [survivor for survivor, _ in plan["merges"]]
+            await collection.increment(survivors, [
+                merge_delta(by_id[s], [by_id[v] for v in victims]) for s, victims in plan["merges"]
+            ])
+            await collection.update(ids=survivors, metadatas=[
+                {"merged_from": merged_from(by_id[s], victims, [by_id[v] for v in victims]), "last_seen": now}
+                for s, victims in plan["merges"]
+            ])
+        doomed = [v for _, victims in plan["merges"] for v in victims] + plan["evict"]
+        if doomed:
+            await collection.delete(ids=doomed)
+        merged = len(doomed) - len(plan["evict"])
+        self.counters[collection.name]["compaction_merges"] += merged
+        self.counters[collection.name]["evicted"] += len(plan["evict"])
+        return {"rows": len(ids), "merged": merged, "evicted": len(plan["evict"]), "remaining": len(ids) - len(doomed)}
+
+    async def compact_all(self) -> Dict[str, dict]:
+        async with self._lock:
+            start = time.perf_counter()
+            report = {}
+            for name, collection in self.collections.items():
+                if self.exclusive is not None:
+                    async with self.exclusive(name):
+                        report[name] = await self.compact(collection)
+                else:
+                    report[name] = await self.compact(collection)
+            self.passes += 1
+            self.last_pass_ms = round((time.perf_counter() - start) * 1000, 1)
+            return report
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                report = await self.compact_all()
+                changed = {n: r for n, r in report.items() if r["merged"] or r["evicted"]}
+                if changed:
+                    print(f"🧹 Memory compaction: {changed}")
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"⚠️ Memory compaction failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "similarity": self.similarity,
+            "capacity": dict(self.capacity),
+            "interval_s": self.interval,
+            "background": self._task is not None and not self._task.done(),
+            "passes": self.passes,
+            "last_pass_ms": self.last_pass_ms,
+            "last_error": self.last_error,
+            "collections": {name: dict(c) for name, c in self.counters.items()},
+        }
@@ -0,0 +1,196 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from result_cache import canonical_hash
+
+# ==========================================
+# SPECULATIVE MEMORY PREFETCH
+# ==========================================
+# The Node app knows a patient's complaint, age and duration at intake, long
+# before the cron sends them to /triage. /prefetch_context embeds that text
+# and renders the institutional-memory block for it then, keyed by a stable
+# hash of the text the lookup reads. At triage time:
+#   - fresh entry (memory version unchanged)    -> block reused, no embed, no queries
+#   - stale entry (a rule / gold case changed)  -> queries re-run on the stored embedding
+#   - no entry                                  -> embedded and queried inline, then stored
+# so /triage only pays for generation when intake ran ahead of it. The
+# memory version is read after settling queued writes (read-your-writes).
+# Blocks retrieved in the local fallback space are served but never stored:
+# once the remote embedder is back they would be the worse answer.
+#
+# Each entry remembers what computing it cost; a hit credits that time (a
+# refresh credits the embed) to saved_ms, which stats() reports with the hit rate.
+
+PREFETCH_CACHE_SIZE = int(os.getenv("PREFETCH_CACHE_SIZE", "4096"))
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "1800"))  # seconds, 0 = never expire
+
+FRESH, REFRESHED, COMPUTED, COALESCED = "fresh", "refreshed", "computed", "coalesced"
+
+
+class PrefetchEntry:
+    __slots__ = ("space", "embedding", "version", "block", "embed_seconds", "render_seconds", "stored_at")
+
+    def __init__(self, space: str, embedding, version, block: str, embed_seconds: float, render_seconds: float):
+        self.space = space
+        self.embedding = embedding
+        self.version = version
+        self.block = block
+        self.embed_seconds = embed_seconds
+        self.render_seconds = render_seconds
+        self.stored_at = time.time()
+
+
+class ContextPrefetcher:
+    """ Patient-keyed cache of (embedding, rendered memory block), validated by memory version """
+
+    def __init__(self,
+                 embed: Callable[[List[str], int], Awaitable[Tuple[str, List[List[float]]]]],
+                 render: Callable[[str, List[List[float]]], Awaitable[List[str]]],
+                 version: Callable[[], Any],
+                 settle: Callable[[], Awaitable[None]],
+                 max_entries: int = PREFETCH_CACHE_SIZE, ttl_seconds: float = PREFETCH_TTL):
+        self.embed = embed  # (texts, priority) -> (space, vectors)
+        self.render = render  # (space, vectors) -> one memory block per vector
+        self.version = version  # versions of every collection the block reads
+        self.settle = settle  # flushes queued writes to those collections
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, PrefetchEntry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.counts = {FRESH: 0, REFRESHED: 0, COMPUTED: 0, COALESCED: 0}
+        self.prefetches = {FRESH: 0, REFRESHED: 0, COMPUTED: 0, COALESCED: 0}
+        self.evictions = 0
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0
+
+    @staticmethod
+    def key(text: str) -> str:
+        return canonical_hash("patient_context", text)
+
+    def _get(self, key: str) -> Optional[PrefetchEntry]:
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl_seconds > 0 and time.time() - entry.stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, entry: PrefetchEntry):
+        if entry.space == "local":
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    # ---------- public ----------
+    async def prefetch(self, text: str, priority: int) -> dict:
+        """ Intake-time: make sure a fresh block exists for this patient text """
+        started = time.perf_counter()
+        (entry, status), = await self._resolve([text], priority)
+        self.prefetches[status] += 1
+        return {
+            "patient_key": self.key(text),
+            "status": status,
+            "memory_version": list(entry.version),
+            "space": entry.space,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    async def contexts(self, texts: List[str], priority: int) -> List[str]:
+        """ Triage-time: one memory block per patient text, reusing prefetched ones """
+        started = time.perf_counter()
+        resolved = await self._resolve(texts, priority)
+        for entry, status in resolved:
+            self.counts[status] += 1
+            if status == FRESH:
+                self.saved_seconds += entry.embed_seconds + entry.render_seconds
+            elif status == REFRESHED:
+                self.saved_seconds += entry.embed_seconds
+        self.lookup_seconds += time.perf_counter() - started
+        return [entry.block for entry, _ in resolved]
+
+    # ---------- internals ----------
+    async def _resolve(self, texts: List[str], priority: int) -> List[Tuple[PrefetchEntry, str]]:
+        await self.settle()
+        version = self.version()
+        keys = [self.key(t) for t in texts]
+        results: List[Optional[Tuple[PrefetchEntry, str]]] = [None] * len(texts)
+        stale: Dict[str, List[Tuple[int, PrefetchEntry]]] = {}  # space -> entries to re-query as they are
+        missing: List[int] = []
+        waiting: List[Tuple[int, asyncio.Future]] = []
+        mine: Dict[str, asyncio.Future] = {}
+
+        for i, key in enumerate(keys):
+            entry = self._get(key)
+            if entry is not None and entry.version == version:
+                results[i] = (entry, FRESH)
+            elif key in self._inflight or key in mine:
+                waiting.append((i, self._inflight.get(key) or mine[key]))
+            else:
+                mine[key] = asyncio.get_running_loop().create_future()
+                if entry is not None:
+                    stale.setdefault(entry.space, []).append((i, entry))
+                else:
+                    missing.append(i)
+        self._inflight.update(mine)
+
+        try:
+            for space, old in stale.items():
+                started = time.perf_counter()
+                blocks = await self.render(space, [e.embedding for _, e in old])
+                render_seconds = (time.perf_counter() - started) / len(old)
+                for (i, e), block in zip(old, blocks):
+                    entry = PrefetchEntry(space, e.embedding, version, block, e.embed_seconds, render_seconds)
+                    results[i] = (entry, REFRESHED)
+            if missing:
+                started = time.perf_counter()
+                space, vectors = await self.embed([texts[i] for i in missing], priority)
+                embed_seconds = (time.perf_counter() - started) / len(missing)
+                started = time.perf_counter()
+                blocks = await self.render(space, vectors)
+                render_seconds = (time.perf_counter() - started) / len(missing)
+                for i, vector, block in zip(missing, vectors, blocks):
+                    results[i] = (PrefetchEntry(space, vector, version, block, embed_seconds, render_seconds), COMPUTED)
+        except BaseException as e:
+            for flight in mine.values():
+                if not flight.done():
+                    flight.set_exception(e if isinstance(e, Exception) else RuntimeError("prefetch cancelled"))
+                    flight.exception()  # mark retrieved so lone failures don't warn
+            raise
+        finally:
+            for key in mine:
+                self._inflight.pop(key, None)
+
+        for i, key in enumerate(keys):
+            if key in mine and not mine[key].done():
+                entry, _ = results[i]
+                self._store(key, entry)
+                mine[key].set_result(entry)
+
+        # Same patient already being computed (a prefetch racing its triage): share that result
+        for i, flight in waiting:
+            results[i] = (await asyncio.shield(flight), COALESCED)
+        return results
+
+    def stats(self) -> dict:
+        lookups = sum(self.counts.values())
+        reused = self.counts[FRESH] + self.counts[REFRESHED]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "prefetches": dict(self.prefetches),
+            "lookups": dict(self.counts),
+            "evictions": self.evictions,
+            "hit_rate": round(self.counts[FRESH] / lookups, 4) if lookups else 0.0,
+            "reuse_rate": round(reused / lookups, 4) if lookups else 0.0,
+            "saved_ms": round(self.saved_seconds * 1000, 1),
+            "saved_ms_per_lookup": round(self.saved_seconds / lookups * 1000, 2) if lookups else None,
+            "lookup_ms_mean": round(self.lookup_seconds / lookups * 1000, 2) if lookups else None,
+        }
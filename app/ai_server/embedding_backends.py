@@ -0,0 +1,163 @@
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Tuple
+
+import numpy as np
+
+from memory_index import VectorIndex
+
+# ==========================================
+# PLUGGABLE EMBEDDING BACKENDS
+# ==========================================
+# "remote" = Gemini text-embedding-004 (what Chroma stores).
+# "local"  = CPU TF-IDF over hashed word/bigram features, fit on the rule
+#            corpus. Local vectors live in a different space, so every
+#            collection keeps a LocalShadow index of its documents.
+# The router sends reads to local when configured to, or automatically when
+# the remote embedder gets slow or starts failing.
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "auto")  # remote | local | auto
+LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "1024"))
+REMOTE_EMBED_LATENCY_THRESHOLD = float(os.getenv("REMOTE_EMBED_LATENCY_THRESHOLD", "2.0"))  # seconds (median)
+REMOTE_EMBED_ERROR_RATE_THRESHOLD = float(os.getenv("REMOTE_EMBED_ERROR_RATE_THRESHOLD", "0.5"))
+REMOTE_EMBED_COOLDOWN = float(os.getenv("REMOTE_EMBED_COOLDOWN", "60"))  # seconds on local before re-probing
+REMOTE_HEALTH_WINDOW = 20
+REMOTE_HEALTH_MIN_SAMPLES = 5
+
+
+class LocalEmbedder:
+    """ Hashing + TF-IDF text embedder (no network, microseconds per query) """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM):
+        self.name = f"local-tfidf-hashing-{dim}"
+        self.dim = dim
+        self._vectorizer = None
+        self.tfidf = None
+
+    @property
+    def vectorizer(self):
+        # scikit-learn is imported on first use: it costs seconds of startup and only the fallback needs it
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._vectorizer = HashingVectorizer(
+                n_features=self.dim, alternate_sign=False, ngram_range=(1, 2), norm=None, lowercase=True
+            )
+        return self._vectorizer
+
+    def fit(self, corpus: List[str]):
+        """ Learns IDF weights from the institutional corpus """
+        from sklearn.feature_extraction.text import TfidfTransformer
+        corpus = [doc for doc in corpus if doc]
+        if corpus:
+            self.tfidf = TfidfTransformer(sublinear_tf=True).fit(self.vectorizer.transform(corpus))
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        from sklearn.preprocessing import normalize
+        counts = self.vectorizer.transform([t or "" for t in texts])
+        weighted = self.tfidf.transform(counts) if self.tfidf is not None else normalize(counts)
+        return weighted.toarray().astype(np.float32)
+
+
+class LocalShadow:
+    """ Local-space copy of one Chroma collection, kept in step with its writes """
+
+    def __init__(self, embedder: LocalEmbedder, index=None):
+        self.embedder = embedder
+        self.index = index if index is not None else VectorIndex()
+        self.ready = False
+
+    def rebuild(self, ids, documents, metadatas):
+        plan = getattr(self.index, "plan", None)
+        if plan is not None:  # a capped partitioned index: embed only the partitions it will hold
+            keep = set(plan(ids, metadatas))
+            rows = [(i, d, m) for i, d, m in zip(ids, documents, metadatas) if i in keep]
+            ids, documents, metadatas = [r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows]
+        vectors = self.embedder.embed(documents) if ids else np.zeros((0, self.embedder.dim), np.float32)
+        self.index.load(ids, vectors, documents, metadatas)
+        self.ready = True
+
+    def on_upsert(self, ids, documents=None, metadatas=None):
+        if not self.ready or documents is None:
+            return
+        self.index.upsert(ids, self.embedder.embed(documents), documents, metadatas)
+
+    def on_update(self, ids, documents=None, metadatas=None):
+        if not self.ready:
+            return
+        vectors = self.embedder.embed(documents) if documents is not None else None
+        self.index.update(ids, vectors, documents, metadatas)
+
+    def on_delete(self, ids):
+        if self.ready and ids:
+            self.index.delete(ids)
+
+    def query(self, query_embeddings, n_results: int = 10, where=None) -> dict:
+        return self.index.query(query_embeddings, n_results, where=where)
+
+
+class EmbeddingRouter:
+    """ Chooses remote vs local per call and tracks remote health """
+
+    def __init__(self, remote_embed: Callable[[List[str], int], Awaitable[List[List[float]]]],
+                 local: LocalEmbedder, mode: str = EMBEDDING_BACKEND):
+        self.remote_embed = remote_embed
+        self.local = local
+        self.mode = mode
+        self._window = deque(maxlen=REMOTE_HEALTH_WINDOW)  # (latency_s, ok)
+        self.degraded_until = 0.0
+        self.routed = {"remote": 0, "local": 0}
+        self.fallbacks = 0
+        self.trips = 0
+
+    def remote_degraded(self) -> bool:
+        return time.monotonic() < self.degraded_until
+
+    def _record(self, latency: float, ok: bool):
+        self._window.append((latency, ok))
+        if len(self._window) < REMOTE_HEALTH_MIN_SAMPLES:
+            return
+        error_rate = sum(1 for _, good in self._window if not good) / len(self._window)
+        median = sorted(lat for lat, _ in self._window)[len(self._window) // 2]
+        if error_rate >= REMOTE_EMBED_ERROR_RATE_THRESHOLD or median >= REMOTE_EMBED_LATENCY_THRESHOLD:
+            print(f"⚠️ Remote embedder degraded (errors {error_rate:.0%}, p50 {median:.2f}s). "
+                  f"Routing reads to {self.local.name} for {REMOTE_EMBED_COOLDOWN:.0f}s")
+            self.degraded_until = time.monotonic() + REMOTE_EMBED_COOLDOWN
+            self.trips += 1
+            self._window.clear()
+
+    def _local(self, texts: List[str]) -> Tuple[str, List[List[float]]]:
+        self.routed["local"] += 1
+        return "local", self.local.embed(texts).tolist()
+
+    async def embed(self, texts: List[str], priority: int) -> Tuple[str, List[List[float]]]:
+        """ Returns (space, vectors); space tells the caller which index to query """
+        if self.mode == "local" or (self.mode == "auto" and self.remote_degraded()):
+            return self._local(texts)
+
+        start = time.monotonic()
+        try:
+            vectors = await self.remote_embed(texts, priority)
+        except Exception as e:
+            self._record(time.monotonic() - start, False)
+            if self.mode == "remote":
+                raise
+            print(f"⚠️ Remote embedding failed ({e}); using local backend")
+            self.fallbacks += 1
+            return self._local(texts)
+        self._record(time.monotonic() - start, True)
+        self.routed["remote"] += 1
+        return "remote", vectors
+
+    def stats(self) -> dict:
+        window = list(self._window)
+        return {
+            "mode": self.mode,
+            "local_backend": self.local.name,
+            "remote_degraded": self.remote_degraded(),
+            "degraded_for_s": round(max(0.0, self.degraded_until - time.monotonic()), 1),
+            "routed": dict(self.routed),
+            "fallbacks": self.fallbacks,
+            "trips": self.trips,
+            "remote_window_error_rate": round(sum(1 for _, ok in window if not ok) / len(window), 3) if window else 0.0,
+        }
@@ -0,0 +1,198 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from concurrency import run_blocking
+
+# ==========================================
+# SHARED EMBEDDING CACHE
+# ==========================================
+# Key: (embedding model, sha256(text)). Layer 1 is an in-process LRU with an
+# optional TTL, layer 2 is an optional SQLite file that survives restarts.
+#
+# A vector never goes stale for its (model, text) key, so the TTL stays off
+# by default. The disk layer is bounded by rows instead:
+# EMBEDDING_CACHE_DISK_ROWS keeps the most recently used rows (used_at moves
+# on every write and disk hit). Pruning runs at open and then once per 1% of
+# the cap in new writes, so the file can overshoot the cap by about 1%.
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "0"))  # seconds, 0 = never expire
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.sqlite3")  # "" = memory only
+EMBEDDING_CACHE_DISK_ROWS = int(os.getenv("EMBEDDING_CACHE_DISK_ROWS", "100000"))  # ~3 KB each at 768 dims, 0 = unbounded
+
+CHARS_PER_TOKEN = 4  # rough Gemini tokenizer ratio, only used for the quota estimate
+
+
+def cache_key(model: str, text: str) -> str:
+    return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class EmbeddingCache:
+    """ Two-level (LRU + SQLite) cache for embedding vectors """
+
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE, ttl_seconds: float = EMBEDDING_CACHE_TTL,
+                 db_path: Optional[str] = EMBEDDING_CACHE_PATH, max_disk_rows: int = EMBEDDING_CACHE_DISK_ROWS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_rows = max_disk_rows
+        self._prune_every = max(1, max_disk_rows // 100)
+        self._writes_since_prune = 0
+        self.disk_pruned = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, created_at REAL, used_at REAL)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")}
+            if "used_at" not in columns:  # cache written before the disk layer was bounded
+                self._db.execute("ALTER TABLE embeddings ADD COLUMN used_at REAL")
+                self._db.execute("UPDATE embeddings SET used_at = created_at")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)")
+            self._db.commit()
+            self._prune()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.chars_saved = 0
+
+    # ---------- layer 1: in-process LRU ----------
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and (time.time() - created_at) > self.ttl_seconds
+
+    def _memory_get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, created_at = entry
+            if self._is_expired(created_at):
+                del self._entries[key]
+                self.expired += 1
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def _memory_put(self, key: str, vector: List[float], created_at: float):
+        with self._lock:
+            self._entries[key] = (vector, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # ---------- layer 2: SQLite ----------
+    def _disk_get(self, key: str):
+        with self._db_lock:
+            row = self._db.execute("SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        blob, created_at = row
+        if self._is_expired(created_at):
+            with self._db_lock:
+                self._db.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self._db.commit()
+            self.expired += 1
+            return None
+        with self._db_lock:
+            self._db.execute("UPDATE embeddings SET used_at = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return array("f", blob).tolist(), created_at
+
+    def _disk_put(self, key: str, vector: List[float], created_at: float):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at, used_at) VALUES (?, ?, ?, ?)",
+                (key, array("f", vector).tobytes(), created_at, created_at),
+            )
+            self._db.commit()
+            self._writes_since_prune += 1
+            due = self._writes_since_prune >= self._prune_every
+        if due:
+            self._prune()
+
+    def _prune(self):
+        """ Drops the least recently used rows beyond max_disk_rows (blocking) """
+        if self.max_disk_rows <= 0:
+            return
+        with self._db_lock:
+            self._writes_since_prune = 0
+            (rows,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if rows <= self.max_disk_rows:
+                return
+            cursor = self._db.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY used_at LIMIT ?)",
+                (rows - self.max_disk_rows,),
+            )
+            self._db.commit()
+            self.disk_pruned += cursor.rowcount
+
+    # ---------- public API ----------
+    async def get(self, model: str, text: str) -> Optional[List[float]]:
+        """ Looks up both layers, counting hits. Returns None on a miss. """
+        key = cache_key(model, text)
+        vector = self._memory_get(key)
+        if vector is not None:
+            self.memory_hits += 1
+            self.chars_saved += len(text)
+            return vector
+
+        if self._db is not None:
+            row = await run_blocking(self._disk_get, key)
+            if row is not None:
+                vector, created_at = row
+                self._memory_put(key, vector, created_at)
+                self.disk_hits += 1
+                self.chars_saved += len(text)
+                return vector
+
+        self.misses += 1
+        return None
+
+    async def put(self, model: str, text: str, vector: List[float]):
+        key = cache_key(model, text)
+        created_at = time.time()
+        vector = list(vector)
+        self._memory_put(key, vector, created_at)
+        if self._db is not None:
+            await run_blocking(self._disk_put, key, vector, created_at)
+
+    async def get_or_embed(self, model: str, text: str,
+                           embed_fn: Callable[[str], Awaitable[List[float]]]) -> List[float]:
+        vector = await self.get(model, text)
+        if vector is None:
+            vector = await embed_fn(text)
+            await self.put(model, text, vector)
+        return vector
+
+    def stats(self) -> dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "disk_layer": self._db is not None,
+            "max_disk_rows": self.max_disk_rows,
+            "disk_pruned": self.disk_pruned,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "round_trips_saved": hits,
+            "est_tokens_saved": self.chars_saved // CHARS_PER_TOKEN,
+        }
@@ -0,0 +1,302 @@
+import io
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import registry
+
+try:
+    from PIL import Image
+except ImportError:  # without Pillow there is nothing to hash; the index stays empty
+    Image = None
+
+HASHING_AVAILABLE = Image is not None
+
+# ==========================================
+# PERCEPTUAL FILM INDEX (NEAR-DUPLICATE SCANS)
+# ==========================================
+# Doctors photograph the same films several times (another angle, a
+# re-upload after a dropped connection), and byte-level dedup / the result
+# cache only catch identical files. Every film that goes through the vision
+# pipeline gets two 64-bit perceptual hashes computed on the CPU:
+#   pHash  low-frequency DCT signs of a 32x32 grey thumbnail (robust to
+#          re-encoding, scaling, exposure)        -> search key
+#   dHash  horizontal gradient signs of a 9x8 thumbnail -> confirmation
+# and is stored with its study (the set of films in one request) and that
+# study's result: the model's analysis from /analyze_images, later upgraded
+# to the doctor-verified one by /archive_vision_case.
+#
+# A new request matches a study when EVERY film in it is within
+# FILM_PHASH_DISTANCE (and FILM_DHASH_DISTANCE) of one of that study's films.
+# By default (FILM_REUSE=precedent) any match only goes into the prompt as a
+# precedent: a read is about the films AND the patient, and near-identical
+# films of another visit or another patient must still be read against their
+# own history. FILM_REUSE=short_circuit also skips the model call, but only
+# for a verified study whose films are all covered in turn and that is either
+# the very same upload (equal study IDs, i.e. original digests) or was read
+# for the same clinical context (context key: patient summary, triage
+# hypothesis, doctor verdict). The triage comparison fields of a reused read
+# are recomputed for the current context when that differs. FILM_REUSE=off
+# only records. Rows live in SQLite next to the other stores; each worker
+# keeps a multi-index hash over them and pulls rows other workers added
+# before every lookup.
+
+FILM_INDEX_PATH = os.getenv("FILM_INDEX_PATH", "./film_index.sqlite3")
+FILM_REUSE = os.getenv("FILM_REUSE", "precedent")  # precedent | short_circuit | off
+FILM_PHASH_DISTANCE = int(os.getenv("FILM_PHASH_DISTANCE", "12"))  # bits out of 64
+FILM_DHASH_DISTANCE = int(os.getenv("FILM_DHASH_DISTANCE", "10"))
+
+VERIFIED, ANALYSIS = "verified", "analysis"
+
+FILM_LOOKUPS = registry.counter(
+    "ai_film_index_lookups_total", "Vision requests checked against the film index, by outcome", ("outcome",))
+
+
+# ---------- hashing ----------
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def _bits(flags: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(flags.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def perceptual_hashes(data: bytes) -> Tuple[int, int]:
+    """ (pHash, dHash) of an encoded image (blocking: decodes on the calling thread) """
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("L", (128, 128))  # JPEG: decode at reduced scale
+        grey = img.convert("L")
+        small = np.asarray(grey.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+        strip = np.asarray(grey.resize((9, 8), Image.LANCZOS), dtype=np.float64)
+    coeffs = (_DCT32 @ small @ _DCT32.T)[:8, :8].ravel()
+    phash = _bits(coeffs > np.median(coeffs[1:]))
+    dhash = _bits(strip[:, 1:] > strip[:, :-1])
+    return phash, dhash
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# ---------- multi-index hashing ----------
+class MultiIndexHash:
+    """ Hamming search over 64-bit hashes: one hash table per 16-bit chunk.
+    Two hashes within distance r agree to within r // 4 bits on at least one
+    chunk (pigeonhole), so a search probes each table with the chunk and its
+    small-flip neighbours and only verifies those candidates. A BK-tree
+    degenerates towards a full scan at radii this large. """
+
+    def __init__(self, chunks: int = 4):
+        self.chunks = chunks
+        self.width = 64 // chunks
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in range(chunks)]
+        self.entries: List[Tuple[int, object]] = []
+        self._flips: Dict[int, List[int]] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.entries)
+
+    def _parts(self, key: int) -> List[int]:
+        mask = (1 << self.width) - 1
+        return [(key >> (self.width * c)) & mask for c in range(self.chunks)]
+
+    def _flip_masks(self, bits: int) -> List[int]:
+        """ Every chunk-wide mask with at most `bits` bits set """
+        if bits not in self._flips:
+            masks = [0]
+            for _ in range(bits):
+                masks = sorted({m | (1 << b) for m in masks for b in range(self.width)} | set(masks))
+            self._flips[bits] = masks
+        return self._flips[bits]
+
+    def add(self, key: int, payload):
+        position = len(self.entries)
+        self.entries.append((key, payload))
+        for table, part in zip(self.tables, self._parts(key)):
+            table.setdefault(part, []).append(position)
+
+    def search(self, key: int, radius: int) -> List[Tuple[int, object]]:
+        """ -> [(distance, payload)] for every stored hash within radius """
+        flips = self._flip_masks(radius // self.chunks)
+        seen, found = set(), []
+        for table, part in zip(self.tables, self._parts(key)):
+            for flip in flips:
+                for position in table.get(part ^ flip, ()):
+                    if position in seen:
+                        continue
+                    seen.add(position)
+                    stored, payload = self.entries[position]
+                    distance = hamming(key, stored)
+                    if distance <= radius:
+                        found.append((distance, payload))
+        return found
+
+
+# ---------- index ----------
+class FilmMatch:
+    """ A stored study that covers every film of a request """
+
+    def __init__(self, study_id: str, source: str, result: dict, context: Optional[str], distances: List[int],
+                 complete: bool):
+        self.study_id = study_id
+        self.source = source
+        self.result = result
+        self.context = context  # clinical context key the result was read / verified for
+        self.distances = distances  # best distance per request film
+        self.complete = complete  # every film of the stored study was matched too
+
+    @property
+    def verified(self) -> bool:
+        return self.source == VERIFIED
+
+    def reusable(self, study_id: str, context: str) -> bool:
+        """ A verified read of all these films, for the same upload or the same clinical context """
+        return self.verified and self.complete and (self.study_id == study_id or self.context == context)
+
+    def report(self) -> dict:
+        return {"study_id": self.study_id, "source": self.source, "complete": self.complete,
+                "max_distance": max(self.distances)}
+
+    def precedent(self) -> str:
+        findings = ", ".join(f.get("observation", "") for f in self.result.get("visual_findings", [])
+                             if isinstance(f, dict))
+        diagnosis = ", ".join(self.result.get("final_radiological_diagnosis", []))
+        label = "doctor-verified" if self.verified else "earlier AI read, unverified"
+        return f"PRECEDENT (these films were analysed before, {label}): Findings: {findings}. Final Dx: {diagnosis}."
+
+
+class FilmIndex:
+    """ Perceptual hashes of analysed films, their studies and results (SQLite + per-worker multi-index hash) """
+
+    def __init__(self, db_path: str = FILM_INDEX_PATH, phash_distance: int = FILM_PHASH_DISTANCE,
+                 dhash_distance: int = FILM_DHASH_DISTANCE):
+        self.phash_distance = phash_distance
+        self.dhash_distance = dhash_distance
+        self.tree = MultiIndexHash()
+        self.studies: Dict[str, Tuple[str, dict, Optional[str]]] = {}  # study_id -> (source, result, context)
+        self.study_sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._seen_film = 0
+        self._seen_study = 0.0
+        self.counts = {"verified": 0, "analysis": 0, "partial": 0, "miss": 0}
+        self.lookup_seconds = 0.0
+        self.short_circuits = 0
+        self._db = sqlite3.connect(db_path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS films (
+            id INTEGER PRIMARY KEY, study_id TEXT, position INTEGER, phash TEXT, dhash TEXT,
+            UNIQUE(study_id, position))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS studies (
+            study_id TEXT PRIMARY KEY, source TEXT, result TEXT, verified_by TEXT, updated_at REAL, context TEXT)""")
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(studies)")}
+        if "context" not in columns:  # index written before studies kept their clinical context
+            self._db.execute("ALTER TABLE studies ADD COLUMN context TEXT")
+        self._db.commit()
+
+    # Hashes are stored as hex text: SQLite integers are signed 64-bit
+    def sync(self):
+        """ Pulls rows added since the last sync (by this or another worker) into memory (blocking) """
+        with self._lock:
+            films = self._db.execute(
+                "SELECT id, study_id, position, phash, dhash FROM films WHERE id > ? ORDER BY id",
+                (self._seen_film,)).fetchall()
+            for row_id, study_id, position, phash, dhash in films:
+                self.tree.add(int(phash, 16), (study_id, position, int(dhash, 16)))
+                self.study_sizes[study_id] = max(self.study_sizes.get(study_id, 0), position + 1)
+                self._seen_film = row_id
+            studies = self._db.execute(
+                "SELECT study_id, source, result, context, updated_at FROM studies WHERE updated_at >= ? "
+                "ORDER BY updated_at", (self._seen_study,)).fetchall()
+            for study_id, source, result, context, updated_at in studies:
+                self.studies[study_id] = (source, json.loads(result), context)
+                self._seen_study = updated_at
+
+    def match(self, hashes: List[Tuple[int, int]]) -> Tuple[Optional[FilmMatch], str]:
+        """ Best stored study covering every film (verified first, then closest) -> (match, outcome) """
+        started = time.perf_counter()
+        self.sync()
+        per_study: Dict[str, Tuple[Dict[int, int], set]] = {}  # study -> ({request film: distance}, stored films hit)
+        with self._lock:  # sync() from another request may be growing the tree
+            for i, (phash, dhash) in enumerate(hashes):
+                for distance, (study_id, position, stored_dhash) in self.tree.search(phash, self.phash_distance):
+                    if hamming(dhash, stored_dhash) > self.dhash_distance:
+                        continue
+                    best, positions = per_study.setdefault(study_id, ({}, set()))
+                    best[i] = min(distance, best.get(i, distance))
+                    positions.add(position)
+            covering = [
+                FilmMatch(study_id, *self.studies[study_id], list(best.values()),
+                          len(positions) == self.study_sizes[study_id])
+                for study_id, (best, positions) in per_study.items()
+                if len(best) == len(hashes) and study_id in self.studies
+            ]
+        if covering:
+            found = min(covering, key=lambda m: (not (m.verified and m.complete), not m.verified, sum(m.distances)))
+            outcome = found.source
+        else:
+            found, outcome = None, "partial" if per_study else "miss"
+        with self._lock:
+            self.counts[outcome] += 1
+            self.lookup_seconds += time.perf_counter() - started
+        FILM_LOOKUPS.inc(outcome=outcome)
+        return found, outcome
+
+    def record(self, study_id: str, hashes: List[Tuple[int, int]], result: dict, context: Optional[str] = None,
+               source: str = ANALYSIS, verified_by: Optional[str] = None):
+        """ Stores a study's films and result; an analysis never overwrites a verified result (blocking) """
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO films (study_id, position, phash, dhash) VALUES (?, ?, ?, ?)",
+                [(study_id, i, f"{phash:016x}", f"{dhash:016x}") for i, (phash, dhash) in enumerate(hashes)])
+            self._db.execute(
+                """INSERT INTO studies (study_id, source, result, verified_by, updated_at, context)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(study_id) DO UPDATE SET source=excluded.source, result=excluded.result,
+                   verified_by=excluded.verified_by, updated_at=excluded.updated_at, context=excluded.context
+                   WHERE studies.source != 'verified' OR excluded.source = 'verified'""",
+                (study_id, source, json.dumps(result), verified_by, time.time(), context))
+            self._db.commit()
+        self.sync()
+
+    def verify(self, study_id: str, result: dict, verified_by: str, context: Optional[str] = None) -> bool:
+        """ Upgrades an analysed study to the doctor-verified result; False if its films were never seen """
+        with self._lock:
+            known = self._db.execute("SELECT 1 FROM films WHERE study_id = ? LIMIT 1", (study_id,)).fetchone()
+        if not known:
+            return False
+        self.record(study_id, [], result, context, VERIFIED, verified_by)
+        return True
+
+    def note_short_circuit(self):
+        with self._lock:
+            self.short_circuits += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = sum(self.counts.values())
+            matched = self.counts[VERIFIED] + self.counts[ANALYSIS]
+            return {
+                "enabled": HASHING_AVAILABLE and FILM_REUSE != "off",
+                "reuse": FILM_REUSE,
+                "films": self.tree.size,
+                "studies": len(self.studies),
+                "verified_studies": sum(1 for source, _, _ in self.studies.values() if source == VERIFIED),
+                "thresholds": {"phash": self.phash_distance, "dhash": self.dhash_distance},
+                "lookups": dict(self.counts),
+                "match_rate": round(matched / lookups, 4) if lookups else 0.0,
+                "verified_match_rate": round(self.counts[VERIFIED] / lookups, 4) if lookups else 0.0,
+                "short_circuits": self.short_circuits,
+                "lookup_ms_mean": round(self.lookup_seconds / lookups * 1000, 3) if lookups else None,
+            }
@@ -0,0 +1,109 @@
+import os
+import argparse
+from typing import Dict, Optional
+
+# ==========================================
+# GOLD-CASE PARTITIONS
+# ==========================================
+# gold_standard_cases holds two kinds of precedent:
+#   text_precedent     /doctor_agree          "Case: <name>. Dx: [...]"
+#   vision_precedent   /archive_vision_case   "VERIFIED VISUAL DIAGNOSIS: ..."
+# The in-memory index is partitioned on "type", so text triage only scans
+# text precedents (and vision lookups only imaging narratives), however large
+# the other partition grows. scan_quality / validated_by narrow a query
+# within its partition.
+#
+# Every worker holds its own copy of the in-memory partitions, so a large
+# archive is paid for once per worker (145k vision cases x 3 KB float32 is
+# ~435 MB each). A partition whose vectors would take more than
+# GOLD_CASE_PARTITION_MAX_MB of resident memory is therefore left in
+# Chroma: its queries go to Chroma's HNSW index with the same `where`
+# filter (milliseconds slower and on the blocking pool, but no resident
+# copy per worker), while the small, hot text partition stays in memory.
+# The budget is in bytes, not rows, so a compressed tier holds
+# proportionally more (64 MB is ~21k 768-dim cases exact, ~86k int8,
+# ~250k pca-int8). Only the vectors are counted; ids, documents and
+# metadata add a tier-independent cost per row on top. The local-embedding
+# fallback sizes its own partitions the same way (exact, its own
+# dimension), so a partition it offloads has no local-space precedents.
+# Chroma filters on the stored "type" only: run the backfill below before a
+# partition outgrows the budget. 0 keeps everything in memory.
+#
+# Records written before /doctor_agree tagged its cases have no "type"; the
+# index classifies them on the fly, and the backfill below makes it permanent
+# so Chroma-side filters (and other tools) see it too:
+#
+#     python gold_cases.py backfill [--dry-run]
+
+TEXT_PRECEDENT = "text_precedent"
+VISION_PRECEDENT = "vision_precedent"
+CASE_TYPE_FIELD = "type"
+BACKFILL_PAGE_SIZE = 1000
+GOLD_CASE_PARTITION_MAX_MB = float(os.getenv("GOLD_CASE_PARTITION_MAX_MB", "64"))  # resident vectors per partition
+
+
+def infer_case_type(case_id: str, document: Optional[str], metadata: dict) -> str:
+    """ The stored type, or the one implied by the writer's ID prefix / narrative / fields """
+    case_type = (metadata or {}).get(CASE_TYPE_FIELD)
+    if case_type:
+        return case_type
+    if (case_id.startswith("gold_vision") or "scan_quality" in (metadata or {})
+            or "VERIFIED VISUAL DIAGNOSIS" in (document or "")):
+        return VISION_PRECEDENT
+    return TEXT_PRECEDENT
+
+
+def partition_max_rows(bytes_per_vector: int, max_mb: float = GOLD_CASE_PARTITION_MAX_MB) -> int:
+    """ Rows a partition may hold within the resident budget (0 = no cap) """
+    if max_mb <= 0:
+        return 0
+    return max(1, int(max_mb * 2 ** 20) // max(bytes_per_vector, 1))
+
+
+def gold_case_filter(case_type: str, scan_quality: Optional[str] = None,
+                     validated_by: Optional[str] = None) -> Dict:
+    """ Chroma-style `where` for one partition, optionally narrowed """
+    clauses = [{CASE_TYPE_FIELD: case_type}]
+    if scan_quality:
+        clauses.append({"scan_quality": scan_quality})
+    if validated_by:
+        clauses.append({"validated_by": validated_by})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def backfill_case_types(collection, dry_run: bool = False, page_size: int = BACKFILL_PAGE_SIZE) -> Dict[str, int]:
+    """ Writes the inferred type onto every untyped record (blocking; paged reads, chunked updates) """
+    counts: Dict[str, int] = {}
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            return counts
+        offset += len(page["ids"])
+        ids, metadatas = [], []
+        for case_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"]):
+            if (metadata or {}).get(CASE_TYPE_FIELD):
+                continue
+            case_type = infer_case_type(case_id, document, metadata or {})
+            counts[case_type] = counts.get(case_type, 0) + 1
+            ids.append(case_id)
+            metadatas.append({CASE_TYPE_FIELD: case_type})
+        if ids and not dry_run:
+            collection.update(ids=ids, metadatas=metadatas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gold-case maintenance")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--dry-run", action="store_true", help="count untyped records without writing")
+    args = parser.parse_args()
+
+    from memory_service import open_memory_client
+    collection = open_memory_client().get_or_create_collection(name="gold_standard_cases")
+    counts = backfill_case_types(collection, dry_run=args.dry_run)
+    verb = "Would tag" if args.dry_run else "Tagged"
+    print(f"✅ {verb} {sum(counts.values())} untyped gold cases: {counts or 'none found'}")
+
+
+if __name__ == "__main__":
+    main()
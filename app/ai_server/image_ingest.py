@@ -0,0 +1,212 @@
+import io
+import os
+import json
+import asyncio
+import hashlib
+import resource
+from typing import List, Tuple
+
+from concurrency import run_blocking
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # resizing is an optimisation; without Pillow images pass through untouched
+    Image = ImageOps = None
+
+# ==========================================
+# MEMORY-BOUNDED IMAGE INGESTION
+# ==========================================
+# Uploads are read in fixed-size chunks from Starlette's spooled temp files
+# (memory up to 1 MB, disk beyond), hashed while streaming and checked
+# against size caps before anything is held in RAM. Oversized photos are
+# downscaled/re-encoded on the blocking pool, and byte-identical films are
+# dropped, so a request only ever holds the (small) final payload.
+#
+# Those caps only bite once Starlette has spooled the whole body, so
+# BodySizeLimit (an ASGI middleware in front of the routes) also refuses
+# a request body over INGEST_MAX_BODY_BYTES: up front from Content-Length,
+# else as soon as the streamed bytes pass it, answering 413 before the
+# rest is written to a temp file.
+#
+# The ingest report carries rss_delta_kb, the change in current RSS across
+# the call (concurrent requests show up in it too); ru_maxrss is a lifetime
+# peak and only moves when this process sets a new record.
+
+INGEST_CHUNK_BYTES = 256 * 1024
+INGEST_MAX_FILES = int(os.getenv("INGEST_MAX_FILES", "12"))
+INGEST_MAX_FILE_BYTES = int(os.getenv("INGEST_MAX_FILE_BYTES", str(25 * 1024 * 1024)))
+INGEST_MAX_TOTAL_BYTES = int(os.getenv("INGEST_MAX_TOTAL_BYTES", str(100 * 1024 * 1024)))
+# Whole request body (files + form fields + multipart framing); 0 = no limit
+INGEST_MAX_BODY_BYTES = int(os.getenv("INGEST_MAX_BODY_BYTES", str(INGEST_MAX_TOTAL_BYTES + 1024 * 1024)))
+INGEST_TARGET_EDGE = int(os.getenv("INGEST_TARGET_EDGE", "1536"))          # px, longest side sent to the model
+INGEST_REENCODE_BYTES = int(os.getenv("INGEST_REENCODE_BYTES", str(1024 * 1024)))  # re-encode anything bigger
+INGEST_JPEG_QUALITY = int(os.getenv("INGEST_JPEG_QUALITY", "85"))
+INGEST_RESIZE_CONCURRENCY = int(os.getenv("INGEST_RESIZE_CONCURRENCY", "2"))
+
+_PAGE_KB = os.sysconf("SC_PAGE_SIZE") // 1024 if hasattr(os, "sysconf") else 4
+
+# Caps how many full-resolution bitmaps can be decoded at once across requests
+_resize_slots = asyncio.Semaphore(INGEST_RESIZE_CONCURRENCY)
+
+
+class IngestError(Exception):
+    """ Upload rejected before reaching the model (size / count caps) """
+
+    def __init__(self, message: str, status_code: int = 413):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IngestedImage:
+    def __init__(self, digest: str, data: bytes, mime_type: str, original_bytes: int, resized: bool):
+        self.digest = digest            # sha256 of the ORIGINAL upload
+        self.data = data                # bytes actually sent to the model
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.resized = resized
+
+
+def peak_rss_kb() -> int:
+    """ Process peak RSS (Linux reports KB, macOS bytes) """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if os.uname().sysname == "Darwin" else peak
+
+
+def current_rss_kb() -> int:
+    """ Resident set size right now (Linux /proc; elsewhere falls back to the peak) """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_KB
+    except (OSError, ValueError, IndexError):
+        return peak_rss_kb()
+
+
+class BodySizeLimit:
+    """ ASGI middleware: 413 for a request body over max_bytes, before Starlette spools the rest """
+
+    def __init__(self, app, max_bytes: int = INGEST_MAX_BODY_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received, started, rejected = 0, False, False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request" and not rejected:
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    rejected = True
+                    if not started:
+                        await self._reject(send)
+                    return {"type": "http.disconnect"}  # the app stops reading; its own answer is dropped
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if rejected:
+                return
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"Request body exceeds {self.max_bytes / (1024 * 1024):.1f} MB"}).encode()
+        await send({"type": "http.response.start", "status": 413,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                                (b"connection", b"close")]})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def _stream_digest(upload) -> Tuple[str, int]:
+    """ Hashes an upload chunk by chunk, enforcing the per-file cap as it goes """
+    digest = hashlib.sha256()
+    size = 0
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(INGEST_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > INGEST_MAX_FILE_BYTES:
+            raise IngestError(f"{upload.filename} exceeds {INGEST_MAX_FILE_BYTES / (1024 * 1024):.1f} MB")
+        digest.update(chunk)
+    await upload.seek(0)
+    return digest.hexdigest(), size
+
+
+def _shrink(fileobj) -> Tuple[bytes, bool]:
+    """ Decodes, downscales to INGEST_TARGET_EDGE and re-encodes as JPEG (blocking) """
+    fileobj.seek(0)
+    with Image.open(fileobj) as img:
+        if max(img.size) <= INGEST_TARGET_EDGE and img.format == "JPEG":
+            return b"", False
+        img.draft("RGB", (INGEST_TARGET_EDGE, INGEST_TARGET_EDGE))  # JPEG: decode at reduced scale
+        img = ImageOps.exif_transpose(img)  # the re-encode drops EXIF: bake the Orientation into the pixels
+        img = img.convert("RGB")
+        img.thumbnail((INGEST_TARGET_EDGE, INGEST_TARGET_EDGE))
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=INGEST_JPEG_QUALITY, optimize=True)
+        return out.getvalue(), True
+
+
+async def _prepare(upload, digest: str, size: int) -> IngestedImage:
+    mime_type = upload.content_type or "application/octet-stream"
+    if Image is not None and mime_type.startswith("image/") and size > INGEST_REENCODE_BYTES:
+        async with _resize_slots:
+            try:
+                data, resized = await run_blocking(_shrink, upload.file)
+            except Exception as e:
+                print(f"Image resize skipped for {upload.filename}: {e}")
+                data, resized = b"", False
+        if resized:
+            return IngestedImage(digest, data, "image/jpeg", size, True)
+    await upload.seek(0)
+    return IngestedImage(digest, await upload.read(), mime_type, size, False)
+
+
+async def ingest_images(uploads) -> Tuple[List[IngestedImage], dict]:
+    """ Returns de-duplicated, size-bounded images plus an ingest report """
+    if len(uploads) > INGEST_MAX_FILES:
+        raise IngestError(f"Too many files ({len(uploads)} > {INGEST_MAX_FILES})")
+
+    rss_before = current_rss_kb()
+    seen = set()
+    unique = []
+    total = 0
+    duplicates = 0
+    for upload in uploads:
+        digest, size = await _stream_digest(upload)
+        total += size
+        if total > INGEST_MAX_TOTAL_BYTES:
+            raise IngestError(f"Upload exceeds {INGEST_MAX_TOTAL_BYTES / (1024 * 1024):.1f} MB in total")
+        if digest in seen:
+            duplicates += 1
+            continue
+        seen.add(digest)
+        unique.append((upload, digest, size))
+
+    images = await asyncio.gather(*[_prepare(u, d, s) for u, d, s in unique])
+    report = {
+        "files": len(uploads),
+        "duplicates": duplicates,
+        "resized": sum(1 for img in images if img.resized),
+        "bytes_in": total,
+        "bytes_payload": sum(len(img.data) for img in images),
+        "rss_delta_kb": current_rss_kb() - rss_before,
+    }
+    return list(images), report
@@ -1,21 +1,92 @@
 import os
 import json
 import time
-import chromadb
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+import copy
+import asyncio
+import hashlib
+import hmac
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Union
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 from datetime import datetime
 
+load_dotenv()  # before the local modules below read their env configuration
+
+from concurrency import run_blocking
+from embedding_cache import EmbeddingCache
+from memory_index import IndexedCollection, PartitionedIndex
+from compressed_index import GOLD_CASE_INDEX_TIER, resident_bytes_per_vector, vector_index_factory
+from gold_cases import (
+    TEXT_PRECEDENT, VISION_PRECEDENT, gold_case_filter, infer_case_type, partition_max_rows,
+)
+from embedding_backends import EmbeddingRouter, LocalEmbedder, LocalShadow
+from rule_registry import RuleRegistry
+from write_behind import MemoryJournal, WriteBehindQueue, new_memory_id
+from consolidation import MEMORY_COMPACTION, Consolidator
+from memory_service import MEMORY_SERVICE_ADDRESS, VersionWatcher, open_memory_client
+from memory_snapshot import IMPORT_BATCH_SIZE, MemorySnapshot, SnapshotError
+from result_cache import ResultCache, canonical_hash
+from context_prefetch import ContextPrefetcher
+from structured_output import StructuredOutput
+from film_index import FILM_REUSE, HASHING_AVAILABLE, VERIFIED, FilmIndex, perceptual_hashes
+from resources import LazyGenAIClient, LazyResource, LazyStore, StartupState
+from model_router import (
+    FAST_MODEL_ID, DEEP_MODEL_ID, ModelRouter, RouteFeatures, SchemaError, count_overrides, red_flags,
+)
+from image_ingest import BodySizeLimit, IngestError, ingest_images, peak_rss_kb
+from vision_jobs import JobProgress, JobQueueFull, JobStore, VisionJobQueue, sse_event
+from metrics import (
+    registry, gauge_lines, stage, begin_request, server_timing_header, record_size, request_sizes,
+    REQUEST_SECONDS, FALLBACKS, UPLOAD_BYTES,
+)
+from profiling import PROFILE_INTERVAL_MS, Profiler, ProfiledRequests, SlowRequestLog
+from quota_governor import (
+    QuotaGovernor, estimate_tokens, is_retryable_error,
+    PRIORITY_URGENT, PRIORITY_INTERACTIVE, PRIORITY_ROUTINE, PRIORITY_BACKGROUND,
+)
+
 # ==========================================
 # 1. CONFIGURATION
 # ==========================================
-load_dotenv()
-app = FastAPI()
+# STARTUP: the server accepts requests as soon as the lifespan starts; the
+# memory store, indexes, local fallback, fixed query embeddings and a model
+# probe warm up in the background (STARTUP_WARMUP=blocking waits for them
+# instead). Until then /readyz answers 503, and any request that needs memory
+# loads it on demand. Heavy SDKs (google-genai, chromadb, scikit-learn) are
+# imported on first use, not at import time (see resources.py).
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")  # background | blocking
+READYZ_MODEL_PROBE_INTERVAL = float(os.getenv("READYZ_MODEL_PROBE_INTERVAL", "30"))  # seconds
+MODEL_PROBE_TIMEOUT = 5.0  # seconds
+
+# PROFILING: /admin/profile samples wall-clock stacks of chosen routes on demand, and
+# requests slower than SLOW_REQUEST_SECONDS are kept with their stage breakdown
+# (see profiling.py). Admin routes need ADMIN_TOKEN, sent as X-Admin-Token; while it
+# is unset they are closed (CORS is open to any origin, so "no token" must not mean open).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_services()
+    warm = asyncio.create_task(warm_up())
+    if STARTUP_WARMUP == "blocking":
+        await warm
+    yield
+    if not warm.done():
+        warm.cancel()
+        await asyncio.gather(warm, return_exceptions=True)
+    await stop_services()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Oversized uploads get their 413 before Starlette spools them (see image_ingest.py)
+app.add_middleware(BodySizeLimit)
 
 # Enable CORS for React Frontend
 app.add_middleware(
@@ -26,25 +97,249 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# AI CONFIGURATION
-MODEL_ID = "gemini-3-flash-preview" 
+profiler = Profiler()
+slow_requests = SlowRequestLog()
+app.add_middleware(ProfiledRequests, profiler=profiler)  # inner: runs in the endpoint's own task
+
+
+def route_template(request: Request) -> str:
+    """ Route path (e.g. /jobs/{id}) so metric labels stay low-cardinality """
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """ Records end-to-end latency and returns the per-stage breakdown as Server-Timing """
+    endpoint = route_template(request)
+    stages = begin_request(endpoint)
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, status=str(response.status_code))
+    response.headers["Server-Timing"] = server_timing_header(stages + [("total", elapsed)])
+    capture_if_slow(elapsed, endpoint, stages, path=request.url.path, status=response.status_code)
+    return response
+
+
+def capture_if_slow(elapsed: float, endpoint: str, stages, **details):
+    """ Keeps the stage breakdown and payload sizes of a request over SLOW_REQUEST_SECONDS """
+    if elapsed >= slow_requests.threshold:
+        slow_requests.maybe_record(elapsed, endpoint, stages=[(name, round(seconds * 1000, 1)) for name, seconds in stages],
+                                   sizes=request_sizes(), **details)
+
+# AI CONFIGURATION (fast / deep generation tiers: see model_router.py)
 EMBEDDING_MODEL = "models/text-embedding-004" 
+EMBEDDING_DIM = 768  # its vector size: sizes the gold-case partition budget (see gold_cases.py)
+EMBED_BATCH_MAX = 100  # texts per embed request (the API rejects larger batches)
+
+# Optional cold-start snapshot (see memory_snapshot.py)
+MEMORY_SNAPSHOT_PATH = os.getenv("MEMORY_SNAPSHOT_PATH", "")
+MEMORY_SNAPSHOT_VERIFY = os.getenv("MEMORY_SNAPSHOT_VERIFY", "1") == "1"
+
+# /triage_batch limits
+TRIAGE_BATCH_MAX_SIZE = int(os.getenv("TRIAGE_BATCH_MAX_SIZE", "50"))
+TRIAGE_BATCH_CONCURRENCY = int(os.getenv("TRIAGE_BATCH_CONCURRENCY", "4"))
 
-API_KEY = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=API_KEY)
+# Built on first use from GEMINI_API_KEY (benchmarks swap in a fake before that)
+client = LazyGenAIClient()
+
+# UPSTREAM QUOTA (per-model RPM/TPM ceilings; tune to the project's Gemini tier)
+quota_governor = QuotaGovernor()
+quota_governor.configure(
+    FAST_MODEL_ID,
+    rpm=float(os.getenv("GEMINI_GENERATE_RPM", "60")),
+    tpm=float(os.getenv("GEMINI_GENERATE_TPM", "1000000")),
+)
+quota_governor.configure(
+    DEEP_MODEL_ID,
+    rpm=float(os.getenv("GEMINI_DEEP_RPM", "30")),
+    tpm=float(os.getenv("GEMINI_DEEP_TPM", "1000000")),
+)
+quota_governor.configure(
+    EMBEDDING_MODEL,
+    rpm=float(os.getenv("GEMINI_EMBED_RPM", "1500")),
+    tpm=float(os.getenv("GEMINI_EMBED_TPM", "1000000")),
+)
+
+# EMBEDDING CACHE (LRU + optional SQLite layer next to ./ai_memory)
+embedding_cache = LazyResource(EmbeddingCache)
+
+# RESULT CACHE (single-flight + LRU for identical triage / vision inputs)
+result_cache = ResultCache()
 
 # DATABASE CONNECTION
-# We share the same client for both Text and Vision memory
-chroma_client = chromadb.PersistentClient(path="./ai_memory")
+# We share the same client for both Text and Vision memory. With
+# MEMORY_SERVICE_ADDRESS set this is a proxy to the owner process instead of
+# the SQLite files themselves (see memory_service.py), so workers can scale.
+# Opened on first use (warm-up, or the first request that gets there sooner).
+memory_store = LazyStore(open_memory_client)
 
+# All collection access is offloaded to the blocking pool (see concurrency.py).
+# The two small rule collections are also mirrored into in-process NumPy
+# indexes (see memory_index.py); Chroma remains the durable store.
 # Collection 1: Text Rules (Learned from Triage Disagreements)
-rule_collection = chroma_client.get_or_create_collection(name="triage_pearls")
+rule_collection = IndexedCollection(memory_store.collection("triage_pearls"))
 
-# Collection 2: Gold Standard Cases (Text & Vision Agreements)
-gold_case_collection = chroma_client.get_or_create_collection(name="gold_standard_cases")
+# Collection 2: Gold Standard Cases (Text & Vision Agreements), partitioned by case type (see gold_cases.py).
+# GOLD_CASE_INDEX_TIER=int8 | pca-int8 keeps the archive's partitions compressed (see compressed_index.py);
+# partitions over GOLD_CASE_PARTITION_MAX_MB of resident vectors (in that tier) stay in Chroma.
+gold_case_collection = IndexedCollection(
+    memory_store.collection("gold_standard_cases"),
+    index=PartitionedIndex("type", infer_case_type, vector_index_factory(GOLD_CASE_INDEX_TIER),
+                           partition_max_rows(resident_bytes_per_vector(GOLD_CASE_INDEX_TIER, EMBEDDING_DIM))),
+)
 
 # Collection 3: Visual Rules (Learned from Scan Disagreements)
-correction_collection = chroma_client.get_or_create_collection(name="visual_corrections")
+correction_collection = IndexedCollection(memory_store.collection("visual_corrections"))
+
+# LOCAL EMBEDDING FALLBACK: every collection gets a local-space shadow index
+local_embedder = LocalEmbedder()
+MEMORY_COLLECTIONS = (rule_collection, gold_case_collection, correction_collection)
+for _collection in MEMORY_COLLECTIONS:
+    _collection.shadow = LocalShadow(local_embedder)
+gold_case_collection.shadow = LocalShadow(local_embedder, PartitionedIndex(
+    "type", infer_case_type, max_rows=partition_max_rows(resident_bytes_per_vector("exact", local_embedder.dim))))
+
+def on_remote_memory_change(name: str, version: int, epoch: str):
+    """ Another worker wrote: invalidate cached results and mark snapshots stale """
+    for collection in MEMORY_COLLECTIONS:
+        if collection.name == name and collection.collection.observe_published(version, epoch):
+            collection.version += 1
+            collection.shadow.ready = False
+
+
+memory_watcher = VersionWatcher(MEMORY_SERVICE_ADDRESS, on_remote_memory_change) if MEMORY_SERVICE_ADDRESS else None
+
+# RULE REGISTRY: O(1) rule lookup by ID / text for citations and reinforcement
+rule_registry = RuleRegistry()
+rule_collection.registry = rule_registry
+
+
+startup = StartupState()
+model_probe: Dict[str, Any] = {"ok": False, "checked_at": 0.0, "detail": "not probed yet"}
+_model_probe_lock = asyncio.Lock()
+
+# Query strings the endpoints embed on every call: embedded once during warm-up
+VISION_MEMORY_QUERY = "radiology miss"
+FIXED_MEMORY_QUERIES = (VISION_MEMORY_QUERY,)
+
+
+async def start_services():
+    """ Cheap, local-only startup: journals and background tasks (no store, no network) """
+    local_stores = (embedding_cache, memory_writes.journal, film_index, vision_jobs.store)
+    await run_blocking(lambda: [store.resolve() for store in local_stores])
+    if memory_watcher is not None:
+        memory_watcher.start()
+    await memory_writes.start()
+    await vision_jobs.start()
+
+
+async def warm_up():
+    """ Store, indexes, local fallback, fixed query embeddings, model probe; then /readyz turns green """
+    try:
+        started = time.perf_counter()
+        if MEMORY_SNAPSHOT_PATH and await boot_from_snapshot():
+            startup.step("snapshot_boot", started)
+        else:
+            started = time.perf_counter()
+            await run_blocking(lambda: [c.collection.resolve() for c in MEMORY_COLLECTIONS])
+            startup.step("open_store", started)
+            started = time.perf_counter()
+            await asyncio.gather(*[c.ensure_loaded() for c in MEMORY_COLLECTIONS])
+            startup.step("load_indexes", started)
+            started = time.perf_counter()
+            await warm_local_memory()
+            startup.step("local_memory", started)
+        print(f"🧠 Memory indexes loaded: {rule_collection.index.size} rules, "
+              f"{correction_collection.index.size} visual rules, gold cases {gold_case_collection.index.sizes()}")
+
+        started = time.perf_counter()
+        try:
+            await embed_for_query(list(FIXED_MEMORY_QUERIES), PRIORITY_BACKGROUND)
+        except Exception as e:
+            print(f"⚠️ Fixed query embeddings not precomputed: {e}")
+        startup.step("fixed_queries", started)
+
+        started = time.perf_counter()
+        await probe_model(force=True)
+        startup.step("model_probe", started)
+
+        if MEMORY_COMPACTION:
+            memory_consolidator.start()
+        startup.mark_ready()
+        print(f"✅ Warm-up finished in {startup.ready_in_ms:.0f} ms: {startup.steps}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        startup.error = str(e)
+        print(f"🔥 Warm-up failed: {e} (memory will load on demand)")
+
+
+async def probe_model(force: bool = False) -> bool:
+    """ Is the generation model reachable (or faked)? Cached for READYZ_MODEL_PROBE_INTERVAL """
+    async with _model_probe_lock:
+        if not force and time.time() - model_probe["checked_at"] < READYZ_MODEL_PROBE_INTERVAL:
+            return model_probe["ok"]
+        try:
+            model = await asyncio.wait_for(client.aio.models.get(model=FAST_MODEL_ID), MODEL_PROBE_TIMEOUT)
+            model_probe.update(ok=True, detail=f"{getattr(model, 'name', FAST_MODEL_ID)} via {type(client).__name__}")
+        except Exception as e:
+            model_probe.update(ok=False, detail=f"{type(e).__name__}: {e}")
+        model_probe["checked_at"] = time.time()
+        return model_probe["ok"]
+
+
+async def boot_from_snapshot() -> bool:
+    """ Serves reads from a mapped snapshot right away; Chroma is attached in the background """
+    start = time.perf_counter()
+    try:
+        snapshot = await run_blocking(MemorySnapshot.open, MEMORY_SNAPSHOT_PATH, EMBEDDING_MODEL, MEMORY_SNAPSHOT_VERIFY)
+    except SnapshotError as e:
+        print(f"⚠️ Snapshot boot skipped ({e}); loading from Chroma")
+        return False
+    for collection in (rule_collection, gold_case_collection, correction_collection):
+        rows = snapshot.collection(collection.name)
+        if rows is not None:
+            collection.install(rows.ids, rows.embeddings, rows.documents, rows.metadatas)
+    empty = {"ids": [], "documents": [], "metadatas": []}
+    await build_local_memory([
+        snapshot.collection(c.name).columns() if snapshot.collection(c.name) else empty for c in MEMORY_COLLECTIONS
+    ])
+    print(f"📦 Booted memory from {MEMORY_SNAPSHOT_PATH} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    asyncio.create_task(attach_snapshot_to_store(snapshot))
+    return True
+
+
+async def attach_snapshot_to_store(snapshot: MemorySnapshot):
+    """ Empty store: import the snapshot (no embedding calls). Otherwise Chroma wins: resync. """
+    for collection in MEMORY_COLLECTIONS:
+        rows = snapshot.collection(collection.name)
+        try:
+            if await collection.count() == 0 and rows is not None and len(rows):
+                for i in range(0, len(rows), IMPORT_BATCH_SIZE):
+                    await collection.upsert(
+                        ids=rows.ids[i:i + IMPORT_BATCH_SIZE],
+                        embeddings=rows.embeddings[i:i + IMPORT_BATCH_SIZE].tolist(),
+                        documents=rows.documents[i:i + IMPORT_BATCH_SIZE],
+                        metadatas=[m or None for m in rows.metadatas[i:i + IMPORT_BATCH_SIZE]],
+                    )
+                print(f"📦 Imported {len(rows)} snapshot rows into {collection.name}")
+            elif isinstance(collection, IndexedCollection):
+                await collection.load()
+        except Exception as e:
+            print(f"⚠️ Attaching {collection.name} to the store failed: {e}")
+
+
+async def stop_services():
+    await vision_jobs.stop()
+    await memory_consolidator.stop()
+    await memory_writes.stop()
+    if memory_watcher is not None:
+        await memory_watcher.stop()
 
 
 # ==========================================
@@ -57,6 +352,11 @@ class PatientData(BaseModel):
     expectations: Dict[str, Any]
     assistantInput: Dict[str, Any]
 
+class PatientContextRequest(BaseModel):
+    """ Intake-time subset of PatientData: only what the memory lookup reads """
+    details: Dict[str, Any] = {}
+    medicalHistory: Dict[str, Any] = {}
+
 class TriageOutput(BaseModel):
     scans: List[str]
     reasoning: str
@@ -65,75 +365,291 @@ class TriageOutput(BaseModel):
     safety_override: Optional[str] = None
     Additional_comments: str
     cited_rules: List[str] = []
+    confidence: Optional[float] = None
+
+class VisualFinding(BaseModel):
+    structure: str
+    observation: str
+    severity: str = "Unknown"
+
+class VisionOutput(BaseModel):
+    """ Neuro-Vision answer (DEEP_VISION_PROMPT); the UI renders the required fields """
+    scan_quality: str
+    visual_findings: List[VisualFinding]
+    final_radiological_diagnosis: List[str]
+    agreement_with_triage: Optional[str] = None
+    reasoning_vs_triage: str = ""
+    critic_notes: str = ""
+    confidence: Optional[float] = None
+
+class TriageComparison(BaseModel):
+    """ The triage-dependent part of a VisionOutput, re-derived when a verified read is reused """
+    agreement_with_triage: Optional[str] = None
+    reasoning_vs_triage: str
+
+class TriageBatchItem(BaseModel):
+    index: int
+    status: str  # "ok" | "error"
+    result: Optional[TriageOutput] = None
+    error: Optional[str] = None
+    retryable: bool = False
+
+class TriageBatchResponse(BaseModel):
+    results: List[TriageBatchItem]
+    succeeded: int
+    failed: int
+
+class ProfileRequest(BaseModel):
+    seconds: float = 60
+    routes: List[str] = []  # route templates, e.g. "/triage"; empty = every route
+    sample_rate: float = 1.0  # share of matching requests to profile
+    interval_ms: float = PROFILE_INTERVAL_MS
 
 
 # ==========================================
 # 3. HELPER FUNCTIONS
 # ==========================================
-def get_institutional_memory(patient_summary: str):
-    """ Retrieves text-based triage rules using embeddings """
-    try:
-        # 1. Generate Embedding
-        result = client.models.embed_content(
-            model=EMBEDDING_MODEL,
-            contents=patient_summary
-        )
-        embedding = result.embeddings[0].values
-        
-        # 2. Query Database
-        rule_results = rule_collection.query(query_embeddings=[embedding], n_results=5)
-        case_results = gold_case_collection.query(query_embeddings=[embedding], n_results=1)
+async def embed_remote(contents, priority: int = PRIORITY_ROUTINE):
+    """ Raw embed call (string or list), admitted by the quota governor """
+    async def call():
+        with stage("embed"):
+            return await client.aio.models.embed_content(model=EMBEDDING_MODEL, contents=contents)
+
+    record_size("embedded_texts", 1 if isinstance(contents, str) else len(contents))
+    return await quota_governor.call(
+        EMBEDDING_MODEL, call, est_tokens=estimate_tokens(contents), priority=priority
+    )
+
+
+async def embed_text(text: str, priority: int = PRIORITY_ROUTINE) -> List[float]:
+    """ Embeds a single string, served from the embedding cache when possible """
+    async def embed_one(t: str) -> List[float]:
+        result = await embed_remote(t, priority)
+        return result.embeddings[0].values
+
+    return await embedding_cache.get_or_embed(EMBEDDING_MODEL, text, embed_one)
+
+
+async def embed_texts(texts: List[str], priority: int = PRIORITY_ROUTINE) -> List[List[float]]:
+    """ Embeds many strings in batched calls (EMBED_BATCH_MAX each), skipping cached ones """
+    vectors: List[Optional[List[float]]] = [await embedding_cache.get(EMBEDDING_MODEL, t) for t in texts]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    for start in range(0, len(missing), EMBED_BATCH_MAX):
+        chunk = missing[start:start + EMBED_BATCH_MAX]
+        result = await embed_remote([texts[i] for i in chunk], priority)
+        for i, embedding in zip(chunk, result.embeddings):
+            vectors[i] = embedding.values
+            await embedding_cache.put(EMBEDDING_MODEL, texts[i], embedding.values)
+    return vectors
+
+
+async def _remote_embed_many(texts: List[str], priority: int) -> List[List[float]]:
+    return await embed_texts(texts, priority)
+
+
+embedding_router = EmbeddingRouter(_remote_embed_many, local_embedder)
+
+# CONSOLIDATION: near-duplicate merging at write time + background compaction / capacity bounds
+memory_consolidator = Consolidator({c.name: c for c in MEMORY_COLLECTIONS})
+
+# WRITE-BEHIND: feedback endpoints journal their writes; a flusher batches them into Chroma
+memory_writes = WriteBehindQueue(
+    LazyResource(MemoryJournal),
+    {c.name: c for c in MEMORY_COLLECTIONS},
+    lambda texts: embed_texts(texts, PRIORITY_BACKGROUND),
+    consolidate=memory_consolidator.dedupe,
+)
+memory_consolidator.exclusive = memory_writes.exclusive
+_local_memory_lock = asyncio.Lock()
+
+
+async def warm_local_memory():
+    """ Fits the local embedder on all stored documents and builds the shadow indexes """
+    async with _local_memory_lock:
+        if all(c.shadow.ready for c in MEMORY_COLLECTIONS):
+            return
+        snapshots = await asyncio.gather(*[c.get(include=["documents", "metadatas"]) for c in MEMORY_COLLECTIONS])
+        await _fit_local_memory(snapshots)
+
+
+async def build_local_memory(snapshots):
+    """ Same as warm_local_memory, from rows already in hand (one per collection) """
+    async with _local_memory_lock:
+        await _fit_local_memory(snapshots)
+
+
+async def _fit_local_memory(snapshots):
+    corpus = [doc for snap in snapshots for doc in snap["documents"] if doc]
+    await run_blocking(local_embedder.fit, corpus)
+    for collection, snap in zip(MEMORY_COLLECTIONS, snapshots):
+        await run_blocking(collection.shadow.rebuild, snap["ids"], snap["documents"], snap["metadatas"])
+
+
+async def embed_for_query(texts: List[str], priority: int = PRIORITY_ROUTINE):
+    """ Read-path embedding: (space, vectors) from whichever backend the router picks """
+    space, vectors = await embedding_router.embed(texts, priority)
+    if space == "local":
+        await warm_local_memory()
+    return space, vectors
+
+
+async def query_memory(collection, space: str, embeddings, n_results: int, where: Optional[dict] = None):
+    """ Queries the index that matches the embedding space """
+    if space == "local":
+        with stage(f"local_query.{collection.name}"):
+            return collection.shadow.query(embeddings, n_results, where=where)
+    return await collection.query(query_embeddings=embeddings, n_results=n_results, where=where)
+
+
+class StreamedResponse:
+    """ The joined text of a streamed generation (callers only read .text) """
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+async def generate(contents, config: Optional[dict] = None,
+                   priority: int = PRIORITY_ROUTINE, model: str = FAST_MODEL_ID,
+                   on_text: Optional[Callable[[str], None]] = None,
+                   on_restart: Optional[Callable[[], None]] = None):
+    """ Runs a generation with the async Gemini client, admitted by the quota governor.
+    With on_text the answer is streamed and every chunk is passed on as it arrives;
+    on_restart() runs before a retried stream, whose chunks start the answer over. """
+    attempts = 0
+
+    async def call():
+        nonlocal attempts
+        attempts += 1
+        with stage("generate"):
+            if on_text is None:
+                return await client.aio.models.generate_content(model=model, contents=contents, config=config)
+            if attempts > 1 and on_restart is not None:
+                on_restart()  # the failed stream's chunks were already passed on
+            chunks = []
+            stream = await client.aio.models.generate_content_stream(model=model, contents=contents, config=config)
+            async for chunk in stream:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    on_text(chunk.text)
+            return StreamedResponse("".join(chunks))
+
+    est_tokens = estimate_tokens(contents)
+    record_payload_sizes(contents, est_tokens)
+    response = await quota_governor.call(model, call, est_tokens=est_tokens, priority=priority)
+    record_size("response_chars", len(response.text or ""))
+    return response
+
+
+def record_payload_sizes(contents, est_tokens: int):
+    """ Prompt / image sizes of one model call, kept with slow-request captures """
+    record_size("model_calls", 1)
+    record_size("prompt_tokens_est", est_tokens)
+    for part in contents if isinstance(contents, list) else [contents]:
+        if isinstance(part, str):
+            record_size("prompt_chars", len(part))
+        elif isinstance(part, dict) and "inline_data" in part:
+            record_size("images", 1)
+            record_size("image_bytes", len(part["inline_data"]["data"]))
+
+
+# Picks the fast or deep model per call and escalates unusable / unsure answers
+model_router = ModelRouter(generate)
+JSON_CONFIG = {"response_mime_type": "application/json"}  # plain dicts: no SDK types import at startup
+
+
+def render_institutional_memory(rule_results, case_results, index: int = 0) -> str:
+    """ Renders the memory block for one query row of a (possibly batched) Chroma result """
+    memory_text = ""
+    overrides = []
+    standard_rules = []
+
+    if rule_results['documents']:
+        for i, doc in enumerate(rule_results['documents'][index]):
+            rule_id = rule_results['ids'][index][i]
+            meta = rule_results['metadatas'][index][i]
+            confidence = meta.get('confidence', 1.0)
+            priority = meta.get('priority', 'standard')
+            
+            # The [ID] tag is what the model cites back (see rule_registry.py)
+            if priority == "CRITICAL_OVERRIDE":
+                overrides.append(f"!!! CRITICAL: [{rule_id}] {doc} (Learned Correction)")
+            else:
+                standard_rules.append(f"- [{rule_id}] {doc} (Conf: {confidence:.1f})")
+
+    if overrides:
+        memory_text += "🚨 *** CRITICAL MEDICAL OVERRIDES (MUST FOLLOW) ***\n" + "\n".join(overrides) + "\n\n"
+    
+    if standard_rules:
+        memory_text += "CLINICAL GUIDELINES:\n" + "\n".join(standard_rules) + "\n\n"
         
-        memory_text = ""
-        overrides = []
-        standard_rules = []
-
-        if rule_results['documents']:
-            for i, doc in enumerate(rule_results['documents'][0]):
-                meta = rule_results['metadatas'][0][i]
-                confidence = meta.get('confidence', 1.0)
-                priority = meta.get('priority', 'standard')
-                
-                if priority == "CRITICAL_OVERRIDE":
-                    overrides.append(f"!!! CRITICAL: {doc} (Learned Correction)")
-                else:
-                    standard_rules.append(f"- {doc} (Conf: {confidence:.1f})")
-
-        if overrides:
-            memory_text += "🚨 *** CRITICAL MEDICAL OVERRIDES (MUST FOLLOW) ***\n" + "\n".join(overrides) + "\n\n"
+    if case_results['documents'] and case_results['documents'][index]:
+        memory_text += f"SIMILAR PAST CASE (PRECEDENT):\n{case_results['documents'][index][0]}\n"
         
-        if standard_rules:
-            memory_text += "CLINICAL GUIDELINES:\n" + "\n".join(standard_rules) + "\n\n"
-            
-        if case_results['documents'] and case_results['documents'][0]:
-            memory_text += f"SIMILAR PAST CASE (PRECEDENT):\n{case_results['documents'][0][0]}\n"
-            
-        return memory_text if memory_text else "No specific past records found."
+    return memory_text if memory_text else "No specific past records found."
+
+
+# Text triage only searches text precedents (vision narratives live in their own partition)
+TEXT_PRECEDENT_FILTER = gold_case_filter(TEXT_PRECEDENT)
+
+
+async def query_institutional_memory(space: str, embeddings) -> List[str]:
+    """ One memory block per query embedding (both collections queried in parallel) """
+    rule_results, case_results = await asyncio.gather(
+        query_memory(rule_collection, space, embeddings, 5),
+        query_memory(gold_case_collection, space, embeddings, 1, TEXT_PRECEDENT_FILTER),
+    )
+    return [render_institutional_memory(rule_results, case_results, i) for i in range(len(embeddings))]
+
+
+async def settle_triage_memory():
+    await memory_writes.settle(rule_collection.name, gold_case_collection.name)
+
+
+# SPECULATIVE PREFETCH: /prefetch_context fills this at intake; every triage path reads through it
+context_prefetcher = ContextPrefetcher(
+    embed_for_query,
+    query_institutional_memory,
+    lambda: (rule_collection.version, gold_case_collection.version),
+    settle_triage_memory,
+)
+
+
+async def get_institutional_memory(patient_summary: str, priority: int = PRIORITY_ROUTINE):
+    """ Retrieves text-based triage rules using embeddings (prefetched block when still fresh) """
+    try:
+        # Embedding (remote, or local when the remote embedder is degraded) + both collections
+        blocks = await context_prefetcher.contexts([patient_summary], priority)
+        return blocks[0]
 
     except Exception as e:
         print(f"Memory Retrieval Error: {e}")
         return "Memory Retrieval Failed."
 
 
-# ==========================================
-# 4. API ENDPOINTS (TEXT BOT)
-# ==========================================
+async def get_institutional_memory_batch(patient_summaries: List[str]) -> List[str]:
+    """ Batched variant: one embed call and one vectorized query per collection for the misses """
+    try:
+        return await context_prefetcher.contexts(patient_summaries, PRIORITY_ROUTINE)
 
-@app.post("/triage", response_model=TriageOutput)
-async def triage_patient(patient: PatientData):
+    except Exception as e:
+        print(f"Batch Memory Retrieval Error: {e}")
+        return ["Memory Retrieval Failed."] * len(patient_summaries)
+
+
+def build_patient_text(patient: Union[PatientData, PatientContextRequest]) -> str:
     age = patient.details.get('age', 'Unknown')
     gender = patient.details.get('gender', 'Unknown')
     complaint = patient.medicalHistory.get('chiefComplaint', 'Unknown')
     
-    patient_text = f"""
+    return f"""
     PATIENT: {age}yo {gender}.
     COMPLAINT: {complaint}.
     HISTORY: {patient.medicalHistory.get('historyDuration', 'Unknown')}.
     """
 
-    memory_context = get_institutional_memory(patient_text)
 
-    prompt = f"""
+def build_triage_prompt(patient_text: str, memory_context: str) -> str:
+    return f"""
     Act as a Senior Neuro-Council (Resident + Critic).
     [PATIENT DATA]
     {patient_text}
@@ -141,7 +657,8 @@ async def triage_patient(patient: PatientData):
     {memory_context}
     [INSTRUCTION]
     1. Check MEMORY first. "CRITICAL OVERRIDE" trumps all other logic.
-    2. Output the specific Rules you used in 'cited_rules'.
+    2. Output the [ID] of each Rule you used in 'cited_rules' (e.g. "senior_rule_003"), not its text.
+    3. 'confidence' is your certainty in the urgency and diagnosis, 0.0 to 1.0.
     [OUTPUT JSON]
     {{
       "scans": ["..."],
@@ -150,34 +667,147 @@ async def triage_patient(patient: PatientData):
       "medical_diagnosis": ["..."],
       "safety_override": null,
       "Additional_comments": "...",
-      "cited_rules": []
+      "cited_rules": [],
+      "confidence": 0.0
     }}
     """
-    
-    # Retry Logic for robustness (Handle 503/429 errors)
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            response = client.models.generate_content(
-                model=MODEL_ID,
-                contents=prompt,
-                config=types.GenerateContentConfig(response_mime_type="application/json")
-            )
-            return json.loads(response.text)
-        except Exception as e:
-            print(f"⚠️ Attempt {attempt + 1} failed: {e}")
-            if "503" in str(e) or "429" in str(e):
-                if attempt < max_retries - 1:
-                    time.sleep(2)
-                    continue
-            return {
-                "scans": ["Clinical Judgment Required"],
-                "reasoning": "⚠️ System temporarily unavailable.",
-                "urgency": "Routine",
-                "medical_diagnosis": ["System Unavailable"],
-                "Additional_comments": str(e),
-                "cited_rules": []
-            }
+
+
+def triage_priority(patient: PatientData) -> int:
+    """ Red-flag patients jump the upstream queue """
+    history = patient.medicalHistory
+    if history.get('bowelBladderIncontinence') or history.get('limbWeakness'):
+        return PRIORITY_URGENT
+    return PRIORITY_ROUTINE
+
+
+def triage_features(patient: PatientData, memory_context: str) -> RouteFeatures:
+    return RouteFeatures(
+        red_flags=red_flags(patient.medicalHistory),
+        critical_overrides=count_overrides(memory_context.splitlines()),
+    )
+
+
+# STRUCTURED OUTPUT: malformed answers are repaired locally or completed by a
+# partial re-ask before the router regenerates them (see structured_output.py).
+# A cut-off answer also re-asks for confidence, which drives escalation.
+triage_output = StructuredOutput("triage", TriageOutput, reask_if_truncated=("confidence",))
+vision_output = StructuredOutput("vision", VisionOutput, reask_if_truncated=("confidence",))
+triage_comparison_output = StructuredOutput("vision_triage_comparison", TriageComparison)
+
+
+def parse_triage(text: str) -> dict:
+    """ JSON that validates as TriageOutput (repaired / re-asked if need be), else the router escalates """
+    with stage("json_parse"):
+        return triage_output.parse(text)
+
+
+async def generate_triage(prompt: str, features: RouteFeatures, priority: int = PRIORITY_ROUTINE) -> dict:
+    """ Runs the routed triage generation (503/429 retries live in the quota governor) """
+    result = await model_router.run(
+        "triage", prompt, features, parse_triage,
+        confidence=lambda r: r.get("confidence"), config=JSON_CONFIG, priority=priority,
+    )
+    # Citations leave as rule IDs, so /doctor_agree can reinforce without re-embedding
+    result["cited_rules"] = rule_registry.canonicalize(result.get("cited_rules") or [])
+    return result
+
+
+# ==========================================
+# 4. API ENDPOINTS (TEXT BOT)
+# ==========================================
+
+def triage_cache_key(patient: PatientData) -> str:
+    """ Patient inputs + version of every collection the triage prompt reads """
+    memory_version = (rule_collection.version, gold_case_collection.version)
+    return canonical_hash("triage", model_router.signature, patient.model_dump(), memory_version)
+
+
+@app.post("/triage", response_model=TriageOutput)
+async def triage_patient(patient: PatientData):
+    patient_text = build_patient_text(patient)
+    priority = triage_priority(patient)
+
+    async def run_triage():
+        memory_context = await get_institutional_memory(patient_text, priority)
+        with stage("prompt_build"):
+            prompt = build_triage_prompt(patient_text, memory_context)
+        return await generate_triage(prompt, triage_features(patient, memory_context), priority)
+
+    try:
+        # Identical resends share one generation; fallbacks are never cached
+        return await result_cache.get_or_compute(triage_cache_key(patient), run_triage)
+    except Exception as e:
+        print(f"⚠️ Triage failed: {e}")
+        FALLBACKS.inc(endpoint="/triage")
+        return {
+            "scans": ["Clinical Judgment Required"],
+            "reasoning": "⚠️ System temporarily unavailable.",
+            "urgency": "Routine",
+            "medical_diagnosis": ["System Unavailable"],
+            "Additional_comments": str(e),
+            "cited_rules": []
+        }
+
+
+@app.post("/prefetch_context")
+async def prefetch_context(patient: PatientContextRequest):
+    """ Intake-time speculation: embed + retrieve memory now so /triage only pays for generation """
+    try:
+        return await context_prefetcher.prefetch(build_patient_text(patient), PRIORITY_BACKGROUND)
+    except Exception as e:
+        print(f"⚠️ Prefetch failed: {e}")
+        raise HTTPException(status_code=503, detail=f"Prefetch failed: {e}")
+
+
+@app.get("/prefetch_context/stats")
+async def prefetch_context_stats():
+    """ Hit rate and latency saved by intake-time prefetch """
+    return context_prefetcher.stats()
+
+
+@app.post("/triage_batch", response_model=TriageBatchResponse)
+async def triage_batch(patients: List[PatientData]):
+    """ Triage many patients at once. Failures are reported per patient. """
+    if len(patients) > TRIAGE_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch too large (max {TRIAGE_BATCH_MAX_SIZE})")
+
+    keys = [triage_cache_key(p) for p in patients]
+    results: List[Optional[TriageBatchItem]] = [None] * len(patients)
+
+    # Cached patients are answered directly; only the rest pay for memory + generation
+    pending = []
+    for i, key in enumerate(keys):
+        cached = result_cache.peek(key)
+        if cached is not None:
+            results[i] = TriageBatchItem(index=i, status="ok", result=TriageOutput(**cached))
+        else:
+            pending.append(i)
+
+    patient_texts = {i: build_patient_text(patients[i]) for i in pending}
+    memory_contexts = dict(zip(pending, await get_institutional_memory_batch([patient_texts[i] for i in pending])))
+
+    # Fan out generation through a bounded pool so one batch can't exhaust quota
+    pool = asyncio.Semaphore(TRIAGE_BATCH_CONCURRENCY)
+
+    async def run_one(index: int) -> TriageBatchItem:
+        async with pool:
+            try:
+                with stage("prompt_build"):
+                    prompt = build_triage_prompt(patient_texts[index], memory_contexts[index])
+                raw = await result_cache.get_or_compute(
+                    keys[index],
+                    lambda: generate_triage(prompt, triage_features(patients[index], memory_contexts[index]),
+                                            triage_priority(patients[index]))
+                )
+                return TriageBatchItem(index=index, status="ok", result=TriageOutput(**raw))
+            except Exception as e:
+                return TriageBatchItem(index=index, status="error", error=str(e), retryable=is_retryable_error(e))
+
+    for item in await asyncio.gather(*[run_one(i) for i in pending]):
+        results[item.index] = item
+    succeeded = sum(1 for r in results if r.status == "ok")
+    return TriageBatchResponse(results=results, succeeded=succeeded, failed=len(results) - succeeded)
 
 
 @app.post("/doctor_agree")
@@ -191,39 +821,35 @@ async def doctor_agree(request: Request):
 
         case_narrative = f"Case: {patient_data.get('fullName', 'Unknown')}. Dx: {ai_response.get('medical_diagnosis')}"
         
-        # 1. Archive Case
-        embedding_result = client.models.embed_content(model=EMBEDDING_MODEL, contents=case_narrative)
-        embedding = embedding_result.embeddings[0].values
-        
-        gold_case_collection.add(
-            ids=[f"gold_case_{datetime.now().timestamp()}"],
-            documents=[case_narrative],
-            embeddings=[embedding],
-            metadatas=[{"validated_by": doctor_id, "timestamp": str(datetime.now())}]
+        # 1. Archive Case (journaled; embedded + stored by the write-behind flusher)
+        await memory_writes.add(
+            gold_case_collection.name,
+            new_memory_id("gold_case"),
+            case_narrative,
+            {"type": TEXT_PRECEDENT, "validated_by": doctor_id, "timestamp": str(datetime.now())}
         )
 
-        # 2. Boost Rules
+        # 2. Boost Rules (IDs resolve in the registry; unmatched free text is resolved at flush)
+        reinforced = []
         cited_rules = ai_response.get('cited_rules', [])
         if cited_rules:
-            for rule_text in cited_rules:
-                rule_embed_result = client.models.embed_content(model=EMBEDDING_MODEL, contents=rule_text)
-                rule_vector = rule_embed_result.embeddings[0].values
-
-                results = rule_collection.query(query_embeddings=[rule_vector], n_results=1)
-                
-                if results['ids'] and results['ids'][0]:
-                    rule_id = results['ids'][0][0]
-                    meta = results['metadatas'][0][0]
-                    new_conf = meta.get('confidence', 1.0) + 0.1
-                    meta['confidence'] = new_conf
-                    rule_collection.update(ids=[rule_id], metadatas=[meta])
-
-        return {"status": "success", "message": "Memory Reinforced"}
+            await rule_collection.ensure_loaded()
+            reinforced, unresolved = rule_registry.resolve(cited_rules)
+            await memory_writes.reinforce(rule_collection.name, reinforced, unresolved)
+
+        return {"status": "success", "message": "Memory Reinforced", "reinforced_rules": reinforced}
     except Exception as e:
         print(f"🔥 Error in doctor_agree: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def parse_learned_rule(text: str) -> str:
+    rule = (text or "").strip()
+    if not rule.upper().startswith("CRITICAL OVERRIDE"):
+        raise SchemaError("rule does not start with 'CRITICAL OVERRIDE:'")
+    return rule
+
+
 @app.post("/submit_correction")
 async def submit_correction(request: Request):
     """ Handles Doctor Disagreement -> Learns new Rule """
@@ -238,17 +864,15 @@ async def submit_correction(request: Request):
         REASON: {doctor_reasoning}
         Create a generic IF-THEN medical rule starting with 'CRITICAL OVERRIDE:'.
         """
-        resp = client.models.generate_content(model=MODEL_ID, contents=learning_prompt)
-        new_rule = resp.text.strip()
-        
-        embedding_result = client.models.embed_content(model=EMBEDDING_MODEL, contents=new_rule)
-        embedding = embedding_result.embeddings[0].values
+        new_rule = await model_router.run(
+            "rule_synthesis", learning_prompt, RouteFeatures(), parse_learned_rule, priority=PRIORITY_INTERACTIVE
+        )
         
-        rule_collection.add(
-            ids=[f"learned_rule_{datetime.now().timestamp()}"],
-            documents=[new_rule],
-            embeddings=[embedding],
-            metadatas=[{"priority": "CRITICAL_OVERRIDE", "confidence": 5.0}]
+        await memory_writes.add(
+            rule_collection.name,
+            new_memory_id("learned_rule"),
+            new_rule,
+            {"priority": "CRITICAL_OVERRIDE", "confidence": 5.0}
         )
         return {"status": "success", "new_rule": new_rule}
     except Exception as e:
@@ -299,86 +923,326 @@ The Triage AI (Text-Based) has already assessed this patient:
 }}
 """
 
+def parse_vision(text: str) -> dict:
+    """ JSON that validates as VisionOutput (repaired / re-asked if need be), else the router escalates """
+    with stage("json_parse"):
+        return vision_output.parse(text)
+
+
+def vision_stream_hooks(progress: JobProgress):
+    """ Job progress callbacks that also validate the streamed answer field by field """
+    parser = None
+
+    def on_attempt(tier: str, reason: str):
+        nonlocal parser
+        progress.restart(tier, reason)
+        parser = vision_output.stream(progress.field)
+
+    def on_text(chunk: str):
+        progress.text(chunk)
+        parser.feed(chunk)
+
+    return on_text, on_attempt
+
+def vision_prompt_context(patient_data: dict) -> dict:
+    """ Clinical basics, the triage bot's hypothesis and the doctor's verdict, for DEEP_VISION_PROMPT """
+    # Extract Clinical Basics
+    summary = f"{patient_data.get('age')}yo {patient_data.get('gender')}. {patient_data.get('chiefComplaint')}."
+    
+    # Extract Triage Bot Data
+    ai_triage = patient_data.get('aiTriageResponse', {})
+    
+    # Extract Doctor's Verdict
+    feedback = patient_data.get('doctorFeedback')
+    if feedback:
+         doc_verdict = f"Doctor Disagreed. Correction: {feedback.get('correctedDiagnosis')}. Reason: {feedback.get('correctionReason')}"
+    else:
+         doc_verdict = "Doctor Agreed with Triage Assessment."
+
+    return {
+        "patient_summary": summary,
+        "triage_diagnosis": ai_triage.get('medical_diagnosis', ['Unknown']),
+        "triage_reasoning": ai_triage.get('reasoning', 'No reasoning provided.'),
+        "doctor_feedback": doc_verdict,
+    }
+
+
+async def run_vision(patient_data: dict, images, progress: Optional[JobProgress] = None,
+                     precedent: Optional[str] = None) -> dict:
+    """ Memory -> prompt -> model for ingested films (progress: job stage / streaming reports) """
+    # 2. RETRIEVE VISUAL MEMORY (RAG) - ✅ FIXED BLOCK
+    # We must generate the embedding manually to match the 768 dimensions of the DB
+    if progress is not None:
+        await progress.stage("memory")
+    try:
+        space, query_vectors = await embed_for_query([VISION_MEMORY_QUERY], PRIORITY_INTERACTIVE)
+        await memory_writes.settle(correction_collection.name)
+        
+        # Use embeddings, NOT query_texts
+        memory_results = await query_memory(correction_collection, space, query_vectors, 3)
+        rule_texts = memory_results['documents'][0] if memory_results['documents'] else []
+        learned_rules = "\n".join(rule_texts) if rule_texts else "No specific past errors."
+    except Exception as e:
+        print(f"Memory Query Error: {e}")
+        rule_texts, learned_rules = [], "Memory unavailable."
+    if precedent:
+        learned_rules += "\n" + precedent
+
+    # 3. PREPARE GEMINI REQUEST
+    if progress is not None:
+        await progress.stage("prompt")
+    with stage("prompt_build"):
+        prompt = DEEP_VISION_PROMPT.format(learned_rules=learned_rules, **vision_prompt_context(patient_data))
+
+        content_payload = [prompt]
+        for image in images:
+            content_payload.append({"inline_data": {"data": image.data, "mime_type": image.mime_type}})
+
+    # 4. RUN MODEL (fast tier unless red flags / a large film set; low-confidence reads escalate)
+    features = RouteFeatures(
+        red_flags=red_flags(patient_data.get('medicalHistory') or patient_data),
+        critical_overrides=count_overrides(rule_texts),
+        image_count=len(images),
+    )
+    on_text, on_attempt = vision_stream_hooks(progress) if progress is not None else (None, None)
+    return await model_router.run(
+        "vision", content_payload, features, parse_vision,
+        confidence=lambda r: r.get("confidence"), config=JSON_CONFIG, priority=PRIORITY_INTERACTIVE,
+        on_text=on_text, on_attempt=on_attempt,
+    )
+
+
+# FILM INDEX: perceptual hashes of analysed / verified film sets (see film_index.py)
+film_index = LazyResource(FilmIndex)
+
+
+def film_study_id(images) -> str:
+    """ Stable ID of a film set (original upload digests), echoed in results for /archive_vision_case """
+    return canonical_hash("films", sorted(image.digest for image in images))
+
+
+async def hash_films(images) -> Optional[list]:
+    """ (pHash, dHash) per film on the blocking pool, or None when they can't be computed """
+    if not HASHING_AVAILABLE or not images:
+        return None
+    try:
+        with stage("film_hash"):
+            return list(await asyncio.gather(*[run_blocking(perceptual_hashes, image.data) for image in images]))
+    except Exception as e:
+        print(f"⚠️ Film hashing skipped: {e}")
+        return None
+
+
+TRIAGE_COMPARISON_PROMPT = """
+You are "Neuro-Vision," an expert AI Neuroradiologist.
+These MRI LUMBAR SPINE films were already read and the read was verified by a doctor:
+- Visual Findings: {findings}
+- Final Radiological Diagnosis: {diagnosis}
+
+[PATIENT CLINICAL HISTORY]
+{patient_summary}
+
+[TRIAGE BOT HYPOTHESIS]
+- Suspected Diagnosis: {triage_diagnosis}
+- Clinical Reasoning: {triage_reasoning}
+- Doctor's Feedback/Agreement: {doctor_feedback}
+
+[TASK]
+Does the verified read support the Triage hypothesis for THIS patient? Do not re-read the films.
+
+[OUTPUT JSON]
+{{
+  "agreement_with_triage": "Yes/No/Partial",
+  "reasoning_vs_triage": "The Triage bot suspected L5 root compression, and the MRI confirms..."
+}}
+"""
+
+
+def film_context_key(patient_data: dict) -> str:
+    """ Everything of the patient a vision read depends on (the DEEP_VISION_PROMPT context) """
+    return canonical_hash("film_context", vision_prompt_context(patient_data))
+
+
+def parse_triage_comparison(text: str) -> dict:
+    with stage("json_parse"):
+        return triage_comparison_output.parse(text)
+
+
+async def compare_with_triage(patient_data: dict, result: dict) -> dict:
+    """ agreement_with_triage / reasoning_vs_triage of a reused read, for this patient's triage (text only) """
+    findings = ", ".join(f.get("observation", "") for f in result.get("visual_findings", []) if isinstance(f, dict))
+    prompt = TRIAGE_COMPARISON_PROMPT.format(
+        findings=findings, diagnosis=", ".join(result.get("final_radiological_diagnosis", [])),
+        **vision_prompt_context(patient_data))
+    comparison = await model_router.run(
+        "vision_triage_comparison", prompt, RouteFeatures(), parse_triage_comparison,
+        config=JSON_CONFIG, priority=PRIORITY_INTERACTIVE,
+    )
+    return {k: comparison[k] for k in TriageComparison.model_fields}
+
+
+async def analyze_films(patient_data: dict, images, progress: Optional[JobProgress] = None) -> dict:
+    """ Film index first: a verified read of the same films and patient context (FILM_REUSE=short_circuit)
+    answers directly, any other match is a precedent """
+    study_id = film_study_id(images)
+    context = film_context_key(patient_data)
+    hashes = await hash_films(images)
+    match = None
+    if hashes and FILM_REUSE != "off":
+        with stage("film_match"):
+            match, _ = await run_blocking(film_index.match, hashes)
+
+    result = None
+    if match is not None and FILM_REUSE == "short_circuit" and match.reusable(study_id, context):
+        if progress is not None:
+            await progress.stage("film_match", **match.report())
+        result = copy.deepcopy(match.result)
+        if match.context != context:  # same films, another context: only the triage comparison is redone
+            try:
+                result.update(await compare_with_triage(patient_data, result))
+            except Exception as e:
+                print(f"⚠️ Triage comparison for a reused read failed ({e}); reading the films")
+                result = None
+        if result is not None:
+            film_index.note_short_circuit()
+    if result is None:
+        result = await run_vision(patient_data, images, progress, match.precedent() if match is not None else None)
+    if hashes:
+        await run_blocking(film_index.record, study_id, hashes, strip_film_fields(result), context)
+
+    result["film_study_id"] = study_id
+    if match is not None:
+        result["film_match"] = match.report()
+    return result
+
+
+def strip_film_fields(result: dict) -> dict:
+    return {k: v for k, v in result.items() if k not in ("film_study_id", "film_match")}
+
+
+def vision_cache_key(patient_data: dict, images) -> str:
+    """ Re-runs on the same films share one generation until visual memory changes """
+    return canonical_hash(
+        "vision", model_router.signature, patient_data, [image.digest for image in images],
+        correction_collection.version
+    )
+
+
+def vision_fallback(e: Exception) -> dict:
+    return {
+        "scan_quality": "Readable",
+        "agreement_with_triage": "Partial",
+        "reasoning_vs_triage": "System Error - Showing Fallback. " + str(e),
+        "visual_findings": [{"structure": "Unknown", "observation": "Analysis Failed", "severity": "Unknown"}],
+        "critic_notes": "Could not access memory.",
+        "final_radiological_diagnosis": ["Manual Review Required"],
+        "confidence": 0.0
+    }
+
 # Inside ai_server/main.py
 
 @app.post("/analyze_images")
 async def analyze_images(
+    response: Response,
     patient_context: str = Form(...),
     files: List[UploadFile] = File(...)
 ):
     try:
         # 1. PARSE CONTEXT
         patient_data = json.loads(patient_context)
-        
-        # Extract Clinical Basics
-        summary = f"{patient_data.get('age')}yo {patient_data.get('gender')}. {patient_data.get('chiefComplaint')}."
-        
-        # Extract Triage Bot Data
-        ai_triage = patient_data.get('aiTriageResponse', {})
-        triage_diagnosis = ai_triage.get('medical_diagnosis', ['Unknown'])
-        triage_reasoning = ai_triage.get('reasoning', 'No reasoning provided.')
-        
-        # Extract Doctor's Verdict
-        feedback = patient_data.get('doctorFeedback')
-        if feedback:
-             doc_verdict = f"Doctor Disagreed. Correction: {feedback.get('correctedDiagnosis')}. Reason: {feedback.get('correctionReason')}"
-        else:
-             doc_verdict = "Doctor Agreed with Triage Assessment."
 
-        # 2. RETRIEVE VISUAL MEMORY (RAG) - ✅ FIXED BLOCK
-        # We must generate the embedding manually to match the 768 dimensions of the DB
-        query_text = "radiology miss"
-        try:
-            embedding_result = client.models.embed_content(
-                model=EMBEDDING_MODEL,
-                contents=query_text
-            )
-            query_vector = embedding_result.embeddings[0].values
-            
-            memory_results = correction_collection.query(
-                query_embeddings=[query_vector], # Use embeddings, NOT query_texts
-                n_results=3
-            )
-            learned_rules = "\n".join(memory_results['documents'][0]) if memory_results['documents'] else "No specific past errors."
-        except Exception as e:
-            print(f"Memory Query Error: {e}")
-            learned_rules = "Memory unavailable."
-
-        # 3. PREPARE GEMINI REQUEST
-        prompt = DEEP_VISION_PROMPT.format(
-            patient_summary=summary,
-            triage_diagnosis=triage_diagnosis,
-            triage_reasoning=triage_reasoning,
-            doctor_feedback=doc_verdict,
-            learned_rules=learned_rules
-        )
+        # Streamed, capped, de-duplicated and downscaled (see image_ingest.py)
+        with stage("ingest"):
+            images, ingest_report = await ingest_images(files)
+        for image in images:
+            UPLOAD_BYTES.observe(image.original_bytes, endpoint="/analyze_images")
+            record_size("upload_bytes", image.original_bytes)
+        response.headers["X-Ingest-Report"] = ", ".join(f"{k}={v}" for k, v in ingest_report.items())
 
-        content_payload = [prompt]
-        for file in files:
-            file_bytes = await file.read()
-            image_part = types.Part.from_bytes(data=file_bytes, mime_type=file.content_type)
-            content_payload.append(image_part)
-
-        # 4. RUN MODEL
-        response = client.models.generate_content(
-            model=MODEL_ID,
-            contents=content_payload,
-            config=types.GenerateContentConfig(response_mime_type="application/json")
+        return await result_cache.get_or_compute(
+            vision_cache_key(patient_data, images), lambda: analyze_films(patient_data, images)
         )
-        
-        return json.loads(response.text)
 
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         print(f"Vision Error: {e}")
-        return {
-            "scan_quality": "Readable",
-            "agreement_with_triage": "Partial",
-            "reasoning_vs_triage": "System Error - Showing Fallback. " + str(e),
-            "visual_findings": [{"structure": "Unknown", "observation": "Analysis Failed", "severity": "Unknown"}],
-            "critic_notes": "Could not access memory.",
-            "final_radiological_diagnosis": ["Manual Review Required"],
-            "confidence": 0.0
-        }
+        FALLBACKS.inc(endpoint="/analyze_images")
+        return vision_fallback(e)
+
+
+# ASYNC JOB MODE (see vision_jobs.py): same pipeline, run by the job workers
+async def run_vision_job(patient_data: dict, uploads, progress: JobProgress) -> dict:
+    stages = begin_request("/analyze_images/jobs")
+    start, status = time.perf_counter(), "failed"
+    try:
+        with profiler.track("/analyze_images/jobs"):
+            await progress.stage("ingest")
+            with stage("ingest"):
+                images, ingest_report = await ingest_images(uploads)
+            for image in images:
+                UPLOAD_BYTES.observe(image.original_bytes, endpoint="/analyze_images/jobs")
+                record_size("upload_bytes", image.original_bytes)
+            await progress.stage("ingested", **ingest_report)
+            result = await result_cache.get_or_compute(
+                vision_cache_key(patient_data, images), lambda: analyze_films(patient_data, images, progress)
+            )
+        status = "done"
+        return result
+    finally:
+        capture_if_slow(time.perf_counter() - start, "/analyze_images/jobs", stages,
+                        path=f"/jobs/{progress.job_id}", status=status)
+
+
+vision_jobs = VisionJobQueue(LazyResource(JobStore), run_vision_job)
+
+
+@app.post("/analyze_images/jobs", status_code=202)
+async def submit_vision_job(
+    patient_context: str = Form(...),
+    files: List[UploadFile] = File(...)
+):
+    """ Queues a vision analysis and returns its job ID immediately """
+    try:
+        json.loads(patient_context)
+        job_id = await vision_jobs.submit(patient_context, files)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"patient_context is not JSON: {e}")
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}",
+            "events_url": f"/jobs/{job_id}/events"}
+
+
+@app.get("/jobs/{job_id}")
+async def get_vision_job(job_id: str):
+    """ Status, stage history and (once finished) the result or error """
+    job = await vision_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+@app.get("/jobs/{job_id}/events")
+async def vision_job_events(job_id: str):
+    """ Server-Sent Events: stage transitions, streamed partial output, then the result """
+    if await vision_jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def stream():
+        async for event, data in vision_jobs.events(job_id):
+            yield sse_event(event, data)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/vision_jobs/stats")
+async def vision_jobs_stats():
+    """ Queue depth, running / finished counts and job durations """
+    return await run_blocking(vision_jobs.stats)
 
 @app.post("/learn_from_mistake")
 async def learn_from_mistake(
@@ -387,15 +1251,13 @@ async def learn_from_mistake(
 ):
     """ Learns visual rules from doctor feedback (Vision Disagree) """
     try:
-        # Embedding the rule
-        embedding_result = client.models.embed_content(model=EMBEDDING_MODEL, contents=correction)
-        embedding = embedding_result.embeddings[0].values
-
-        correction_collection.add(
-            ids=[f"visual_rule_{int(time.time())}"],
-            documents=[f"CRITICAL VISUAL RULE: {correction}"],
-            embeddings=[embedding],
-            metadatas=[{"author": doctor_id, "type": "visual_correction"}]
+        # Journal the rule (the vector is of the raw correction, as before)
+        await memory_writes.add(
+            correction_collection.name,
+            new_memory_id("visual_rule"),
+            f"CRITICAL VISUAL RULE: {correction}",
+            {"author": doctor_id, "type": "visual_correction"},
+            embed_text=correction
         )
         return {"status": "success", "message": "Visual rule learned."}
     except Exception as e:
@@ -406,9 +1268,10 @@ async def learn_from_mistake(
 async def archive_vision_case(
     patient_context: str = Form(...),
     vision_result: str = Form(...),
-    doctor_id: str = Form(...)
+    doctor_id: str = Form(...),
+    files: Optional[List[UploadFile]] = File(None)
 ):
-    """ Archives a verified Visual Diagnosis (Vision Agree) """
+    """ Archives a verified Visual Diagnosis (Vision Agree); films optional (else matched by film_study_id) """
     try:
         # Parse JSONs
         patient_data = json.loads(patient_context)
@@ -422,22 +1285,240 @@ async def archive_vision_case(
         Final Dx: {', '.join(vision_data.get('final_radiological_diagnosis', []))}.
         """
         
-        # Embed and Save
-        embedding_result = client.models.embed_content(model=EMBEDDING_MODEL, contents=narrative)
-        embedding = embedding_result.embeddings[0].values
-        
-        gold_case_collection.add(
-            ids=[f"gold_vision_{int(time.time())}"],
-            documents=[narrative],
-            embeddings=[embedding],
-            metadatas=[{
-                "type": "vision_precedent", 
+        # Journal and return; the flusher embeds and saves in batches
+        await memory_writes.add(
+            gold_case_collection.name,
+            new_memory_id("gold_vision"),
+            narrative,
+            {
+                "type": VISION_PRECEDENT,
                 "validated_by": doctor_id,
                 "scan_quality": vision_data.get('scan_quality', 'Unknown')
-            }]
+            }
         )
-        
-        return {"status": "success", "message": "Visual Case Archived"}
+
+        film_study = await verify_film_study(patient_data, vision_data, doctor_id, files)
+        return {"status": "success", "message": "Visual Case Archived", "film_study": film_study}
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def verify_film_study(patient_data: dict, vision_data: dict, doctor_id: str, files) -> Optional[str]:
+    """ Marks the film set behind a verified read as verified in the film index; the study ID or None """
+    context = film_context_key(patient_data)
+    try:
+        if files:
+            images, _ = await ingest_images(files)
+            hashes = await hash_films(images)
+            if not hashes:
+                return None
+            study_id = film_study_id(images)
+            await run_blocking(film_index.record, study_id, hashes, strip_film_fields(vision_data), context,
+                               VERIFIED, doctor_id)
+            return study_id
+        study_id = vision_data.get("film_study_id")
+        if study_id and await run_blocking(film_index.verify, study_id, strip_film_fields(vision_data), doctor_id,
+                                           context):
+            return study_id
+    except Exception as e:
+        print(f"⚠️ Film index not updated: {e}")
+    return None
+
+
+@app.get("/film_index/stats")
+async def film_index_stats():
+    """ Near-duplicate film matches: rate by outcome and model calls short-circuited """
+    return film_index.stats()
+
+
+@app.get("/structured_output/stats")
+async def structured_output_stats():
+    """ Answers valid as-is / repaired / re-asked / failed, and generations saved, per output kind """
+    return {"triage": triage_output.stats(), "vision": vision_output.stats(),
+            "vision_triage_comparison": triage_comparison_output.stats()}
+
+
+@app.get("/embedding_cache/stats")
+async def embedding_cache_stats():
+    """ Hit/miss counters for the shared embedding cache """
+    return embedding_cache.stats()
+
+
+@app.get("/quota/stats")
+async def quota_stats():
+    """ Queue depth, wait times and retry counts per upstream model """
+    return quota_governor.stats()
+
+
+@app.get("/result_cache/stats")
+async def result_cache_stats():
+    """ Hits, coalesced in-flight requests and generations saved """
+    return result_cache.stats()
+
+
+def collect_runtime_metrics():
+    """ Scrape-time gauges for the caches and the quota governor """
+    embed_stats = embedding_cache.stats()
+    result_stats = result_cache.stats()
+    quota = quota_governor.stats()
+    lines = []
+    lines += gauge_lines("ai_embedding_cache_events", "Embedding cache hits/misses since start", {
+        ("memory_hit",): embed_stats["memory_hits"],
+        ("disk_hit",): embed_stats["disk_hits"],
+        ("miss",): embed_stats["misses"],
+    }, ("event",))
+    lines += gauge_lines("ai_result_cache_events", "Result cache hits/coalesced/misses since start", {
+        ("hit",): result_stats["hits"],
+        ("coalesced",): result_stats["coalesced"],
+        ("miss",): result_stats["misses"],
+    }, ("event",))
+    prefetch = context_prefetcher.stats()
+    lines += gauge_lines("ai_prefetch_lookups", "Triage memory lookups by prefetch outcome since start",
+                         {(status,): count for status, count in prefetch["lookups"].items()}, ("status",))
+    lines += gauge_lines("ai_prefetch_saved_seconds", "Embed + retrieval time skipped thanks to prefetch",
+                         {(): prefetch["saved_ms"] / 1000})
+    lines += gauge_lines("ai_quota_queue_depth", "Calls waiting for upstream quota",
+                         {(model,): q["queue_depth"] for model, q in quota.items()}, ("model",))
+    lines += gauge_lines("ai_quota_wait_p95_seconds", "p95 wait for upstream quota",
+                         {(model,): q["wait_ms"]["p95"] / 1000 for model, q in quota.items()}, ("model",))
+    lines += gauge_lines("ai_memory_writes_pending", "Journaled memory writes not yet in Chroma",
+                         {(): memory_writes.stats()["pending"]})
+    consolidation = memory_consolidator.stats()["collections"]
+    lines += gauge_lines("ai_memory_consolidation_events", "Rows merged (write time / compaction) or evicted since start", {
+        (name, event): count for name, counters in consolidation.items() for event, count in counters.items()
+    }, ("collection", "event"))
+    lines += gauge_lines("ai_process_peak_rss_kb", "Peak resident set size of this worker",
+                         {(): peak_rss_kb()})
+    return lines
+
+
+registry.register_collector(collect_runtime_metrics)
+
+
+@app.get("/healthz")
+async def healthz():
+    """ Liveness: the event loop is serving """
+    return {"status": "alive", "uptime_s": startup.report()["uptime_s"]}
+
+
+@app.get("/readyz")
+async def readyz():
+    """ Readiness: memory indexes loaded, warm-up finished, generation model reachable (or faked) """
+    checks = {
+        "memory": all(c.loaded for c in MEMORY_COLLECTIONS),
+        "warm_up": startup.warmed,
+        "model": await probe_model(),
+    }
+    ready = all(checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "ready": ready, "checks": checks, "model": model_probe["detail"], **startup.report(),
+    })
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """ Prometheus scrape endpoint """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/memory_writes/stats")
+async def memory_writes_stats():
+    """ Journal backlog and flush counters for the write-behind queue """
+    return memory_writes.stats()
+
+
+@app.get("/memory/consolidation/stats")
+async def memory_consolidation_stats():
+    """ Merge / eviction counters and the compactor's settings """
+    return memory_consolidator.stats()
+
+
+@app.post("/memory/compact")
+async def compact_memory(request: Request):
+    """ Runs one compaction pass now (merge near-duplicates, enforce capacity); admin only: it rewrites memory """
+    require_admin(request)
+    return await memory_consolidator.compact_all()
+
+
+@app.get("/memory/index/stats")
+async def memory_index_stats(recall_k: int = 0):
+    """ Per-collection index tier and footprint; recall_k > 0 also measures recall@k against exact search """
+    report = {}
+    for collection in MEMORY_COLLECTIONS:
+        await collection.ensure_loaded()
+        report[collection.name] = await run_blocking(collection.index.stats, recall_k)
+    return report
+
+
+@app.get("/model_router/stats")
+async def model_router_stats():
+    """ Per-tier calls / latency / cost, escalations, and the blended speedup vs deep-only """
+    return model_router.stats()
+
+
+@app.get("/embedding_router/stats")
+async def embedding_router_stats():
+    """ Which embedding backend is serving reads, and why """
+    return embedding_router.stats()
+
+
+# ==========================================
+# ADMIN: PROFILING + SLOW REQUESTS
+# ==========================================
+def require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled: set ADMIN_TOKEN")
+    if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.post("/admin/profile")
+async def start_profile(body: ProfileRequest, request: Request):
+    """ Starts a wall-clock sampling session for a time window / share of requests """
+    require_admin(request)
+    if profiler.active:
+        raise HTTPException(status_code=409, detail="A profiling session is already running")
+    try:
+        return profiler.start(body.seconds, body.routes, body.sample_rate, body.interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/profile")
+async def profile_status(request: Request):
+    """ The current (or last) session: window, requests profiled, samples, sampler overhead """
+    require_admin(request)
+    return profiler.stats()
+
+
+@app.delete("/admin/profile")
+async def stop_profile(request: Request):
+    """ Ends the session early; its samples stay downloadable """
+    require_admin(request)
+    report = profiler.stop()
+    if report is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return report
+
+
+@app.get("/admin/profile/download")
+async def download_profile(request: Request, format: str = "speedscope"):
+    """ Samples as speedscope JSON or collapsed stacks (flamegraph.pl / speedscope import) """
+    require_admin(request)
+    if profiler.session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed(), headers={
+            "Content-Disposition": 'attachment; filename="ai_server.collapsed.txt"'})
+    if format == "speedscope":
+        return JSONResponse(profiler.speedscope(), headers={
+            "Content-Disposition": 'attachment; filename="ai_server.speedscope.json"'})
+    raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'speedscope'")
+
+
+@app.get("/admin/slow_requests")
+async def list_slow_requests(request: Request, limit: int = 50, route: Optional[str] = None):
+    """ Newest requests over SLOW_REQUEST_SECONDS with stage breakdown and payload sizes """
+    require_admin(request)
+    return {**slow_requests.stats(), "requests": slow_requests.entries(limit, route)}
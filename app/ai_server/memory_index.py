@@ -0,0 +1,496 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from concurrency import AsyncCollection
+from metrics import stage
+
+# ==========================================
+# IN-PROCESS VECTOR INDEX
+# ==========================================
+# The rule collections are tiny (tens of rows), so an HNSW query through
+# SQLite costs far more than the maths. Each collection is mirrored into one
+# contiguous float32 matrix and top-k is a matrix-vector product plus
+# argpartition. Chroma stays the durable store; this is a read replica that
+# is updated in place on every write.
+#
+# Equality `where` filters ({"type": "x"}, {"$and": [...]}) are served here
+# too: a boolean mask over cached metadata columns. A PartitionedIndex keeps
+# one VectorIndex per value of a field, so a query filtered on that field
+# only scans its own partition, however large the others grow. A partition
+# over max_rows is not held at all ("offloaded"): its rows stay in Chroma and
+# queries that target it (or span partitions) go there with the same `where`.
+
+
+LOAD_PAGE_SIZE = 5000  # ids per get() when loading only some partitions
+
+
+def where_equalities(where) -> Optional[dict]:
+    """ Chroma `where` made only of equality tests -> {field: value}; None for anything else """
+    if not where:
+        return {}
+    if set(where) == {"$and"}:
+        filters = {}
+        for clause in where["$and"]:
+            part = where_equalities(clause)
+            if part is None:
+                return None
+            filters.update(part)
+        return filters
+    filters = {}
+    for field, condition in where.items():
+        if field.startswith("$"):
+            return None
+        if isinstance(condition, dict):
+            if set(condition) != {"$eq"}:
+                return None
+            condition = condition["$eq"]
+        filters[field] = condition
+    return filters
+
+
+def _empty_result(n_queries: int, include=None) -> dict:
+    result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+    if include and "embeddings" in include:
+        result["embeddings"] = []
+    for _ in range(n_queries):
+        for column in result.values():
+            column.append([])
+    return result
+
+
+class VectorIndex:
+    """ Contiguous float32 matrix + parallel id/document/metadata columns """
+
+    def __init__(self, dim: Optional[int] = None):
+        self.dim = dim
+        self._matrix = np.zeros((0, dim or 0), dtype=np.float32)
+        self._sq_norms = np.zeros(0, dtype=np.float32)
+        self.size = 0
+        self.ids: List[str] = []
+        self.documents: List[Optional[str]] = []
+        self.metadatas: List[dict] = []
+        self._positions: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}  # metadata field -> values, for where masks
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[:self.size]
+
+    def load(self, ids, embeddings, documents=None, metadatas=None):
+        """ Replaces the whole index (startup / resync) """
+        if len(ids) == 0:
+            embeddings = np.zeros((0, self.dim or 0), dtype=np.float32)
+        else:
+            embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+            self.dim = embeddings.shape[1]
+        self._matrix = np.ascontiguousarray(embeddings)
+        self._sq_norms = np.einsum("ij,ij->i", self._matrix, self._matrix)
+        self.size = len(ids)
+        self.ids = list(ids)
+        self.documents = list(documents) if documents is not None else [None] * self.size
+        self.metadatas = [dict(m or {}) for m in metadatas] if metadatas is not None else [{} for _ in ids]
+        self._positions = {id_: i for i, id_ in enumerate(self.ids)}
+        self._columns = {}
+
+    def _grow(self, needed: int):
+        capacity = self._matrix.shape[0]
+        if needed <= capacity and self._matrix.shape[1] == self.dim:
+            return
+        new_capacity = max(needed, capacity * 2, 16)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        norms = np.zeros(new_capacity, dtype=np.float32)
+        if self.size:
+            matrix[:self.size] = self._matrix[:self.size]
+            norms[:self.size] = self._sq_norms[:self.size]
+        self._matrix, self._sq_norms = matrix, norms
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        self._columns = {}
+        if self.dim is None or self.size == 0:
+            self.dim = embeddings.shape[1]
+        for i, id_ in enumerate(ids):
+            pos = self._positions.get(id_)
+            if pos is None:
+                self._grow(self.size + 1)
+                pos = self.size
+                self.size += 1
+                self.ids.append(id_)
+                self.documents.append(None)
+                self.metadatas.append({})
+                self._positions[id_] = pos
+            self._matrix[pos] = embeddings[i]
+            self._sq_norms[pos] = float(embeddings[i] @ embeddings[i])
+            if documents is not None:
+                self.documents[pos] = documents[i]
+            if metadatas is not None:
+                self.metadatas[pos] = dict(metadatas[i] or {})
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        """ Mirrors Chroma's update: metadata keys are merged, not replaced """
+        for i, id_ in enumerate(ids):
+            pos = self._positions.get(id_)
+            if pos is None:
+                continue
+            if embeddings is not None:
+                vector = np.asarray(embeddings[i], dtype=np.float32)
+                self._matrix[pos] = vector
+                self._sq_norms[pos] = float(vector @ vector)
+            if documents is not None:
+                self.documents[pos] = documents[i]
+            if metadatas is not None:
+                self.metadatas[pos].update(metadatas[i] or {})
+        if metadatas is not None:
+            self._columns = {}
+
+    def delete(self, ids):
+        doomed = {self._positions[id_] for id_ in ids if id_ in self._positions}
+        if not doomed:
+            return
+        keep = [i for i in range(self.size) if i not in doomed]
+        self.load(
+            [self.ids[i] for i in keep],
+            self.matrix[keep] if keep else np.zeros((0, self.dim), dtype=np.float32),
+            [self.documents[i] for i in keep],
+            [self.metadatas[i] for i in keep],
+        )
+
+    def stats(self, recall_k: int = 0) -> dict:
+        """ Footprint report (exact tier: recall is 1 by construction) """
+        report = {
+            "tier": "exact",
+            "rows": self.size,
+            "dim": self.dim,
+            "bytes_per_vector": (self.dim or 0) * 4 + 4,
+        }
+        if recall_k:
+            report[f"recall@{recall_k}"] = 1.0
+        return report
+
+    def mask(self, filters: dict) -> Optional[np.ndarray]:
+        """ Rows whose metadata equals every filter value (None = no filtering) """
+        if not filters:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        for field, value in filters.items():
+            column = self._columns.get(field)
+            if column is None:
+                column = self._columns[field] = np.array([m.get(field) for m in self.metadatas], dtype=object)
+            mask &= column == value
+        return mask
+
+    def query(self, query_embeddings, n_results: int = 10, include=None, where=None) -> dict:
+        """ Exact top-k by squared L2 (Chroma's default space), Chroma-shaped result """
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if include and "embeddings" in include:
+            result["embeddings"] = []
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        filters = where_equalities(where)
+        if filters is None:
+            raise ValueError(f"Only equality filters are served from the index, got {where}")
+        mask = self.mask(filters)
+        k = min(n_results, self.size if mask is None else int(mask.sum()))
+        if k == 0:
+            return _empty_result(len(queries), include)
+
+        # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2  ->  one (n_queries x dim) @ (dim x n) product
+        dots = queries @ self.matrix.T
+        distances = (np.einsum("ij,ij->i", queries, queries)[:, None] - 2.0 * dots
+                     + self._sq_norms[:self.size][None, :])
+        if mask is not None:
+            distances[:, ~mask] = np.inf
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k] if k < self.size else np.arange(self.size)
+            top = top[np.argsort(row[top], kind="stable")]
+            result["ids"].append([self.ids[i] for i in top])
+            result["documents"].append([self.documents[i] for i in top])
+            result["metadatas"].append([dict(self.metadatas[i]) for i in top])
+            result["distances"].append([float(max(row[i], 0.0)) for i in top])
+            if "embeddings" in result:
+                result["embeddings"].append(self.matrix[top].copy())
+        return result
+
+
+class PartitionedIndex:
+    """ One VectorIndex per value of a metadata field, behind the VectorIndex interface """
+
+    def __init__(self, field: str, classify: Optional[Callable[[str, Optional[str], dict], Any]] = None,
+                 factory: Callable[[Optional[int]], VectorIndex] = VectorIndex, max_rows: int = 0):
+        self.field = field
+        self.factory = factory  # dim -> empty partition (VectorIndex, or a compressed tier)
+        self.max_rows = max_rows  # larger partitions are left in Chroma (0 = hold everything)
+        self.offloaded: Set[Any] = set()
+        # Partition key for a row; defaults to the field's value (rows missing it share the None partition)
+        self.classify = classify or (lambda id_, document, metadata: metadata.get(field))
+        self.partitions: Dict[Any, VectorIndex] = {}
+        self._owner: Dict[str, Any] = {}
+        self.dim: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        return sum(p.size for p in self.partitions.values())
+
+    @property
+    def ids(self) -> List[str]:
+        return [id_ for p in self.partitions.values() for id_ in p.ids]
+
+    @property
+    def metadatas(self) -> List[dict]:
+        return [m for p in self.partitions.values() for m in p.metadatas]
+
+    def sizes(self) -> Dict[Any, int]:
+        return {key: p.size for key, p in self.partitions.items()}
+
+    def stats(self, recall_k: int = 0) -> dict:
+        report = {str(key): p.stats(recall_k) for key, p in self.partitions.items()}
+        report.update({str(key): {"tier": "chroma", "max_rows": self.max_rows} for key in self.offloaded})
+        return report
+
+    def plan(self, ids, metadatas) -> List[str]:
+        """ Picks the partitions to hold from ids + metadata alone; -> ids whose rows must be fetched """
+        keys = [self.classify(id_, None, dict(m or {})) for id_, m in zip(ids, metadatas)]
+        counts: Dict[Any, int] = {}
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+        self.offloaded = {key for key, n in counts.items() if self.max_rows and n > self.max_rows}
+        return [id_ for id_, key in zip(ids, keys) if key not in self.offloaded]
+
+    def serves(self, where) -> bool:
+        """ False when the query needs rows of an offloaded partition """
+        if not self.offloaded:
+            return True
+        filters = where_equalities(where) or {}
+        return self.field in filters and filters[self.field] not in self.offloaded
+
+    def _offload(self, key):
+        partition = self.partitions.pop(key, None)
+        self.offloaded.add(key)
+        if partition is not None:
+            for id_ in partition.ids:
+                self._owner.pop(id_, None)
+            print(f"📦 Gold-case partition {key!r} passed {self.max_rows} rows: now served from Chroma")
+
+    def _partition(self, key) -> VectorIndex:
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.partitions[key] = self.factory(self.dim)
+        return partition
+
+    def load(self, ids, embeddings, documents=None, metadatas=None):
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = [dict(m or {}) for m in metadatas] if metadatas is not None else [{} for _ in ids]
+        groups: Dict[Any, List[int]] = {}
+        for i, id_ in enumerate(ids):
+            groups.setdefault(self.classify(id_, documents[i], metadatas[i]), []).append(i)
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1) if len(ids) else None
+        if matrix is not None:
+            self.dim = matrix.shape[1]
+        self.partitions, self._owner = {}, {}
+        self.offloaded |= {key for key, positions in groups.items() if self.max_rows and len(positions) > self.max_rows}
+        for key, positions in groups.items():
+            if key in self.offloaded:
+                continue
+            self._partition(key).load(
+                [ids[i] for i in positions], matrix[positions],
+                [documents[i] for i in positions], [metadatas[i] for i in positions],
+            )
+            self._owner.update((ids[i], key) for i in positions)
+
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        self.dim = self.dim or embeddings.shape[1]
+        for i, id_ in enumerate(ids):
+            document = documents[i] if documents is not None else None
+            metadata = dict(metadatas[i] or {}) if metadatas is not None else {}
+            key = self.classify(id_, document, metadata)
+            old = self._owner.get(id_)
+            if old is not None and old != key:
+                self.partitions[old].delete([id_])
+                del self._owner[id_]
+            if key in self.offloaded:
+                continue
+            partition = self._partition(key)
+            partition.upsert([id_], embeddings[i:i + 1],
+                             [document] if documents is not None else None,
+                             [metadata] if metadatas is not None else None)
+            self._owner[id_] = key
+            if self.max_rows and partition.size > self.max_rows:
+                self._offload(key)
+
+    def update(self, ids, embeddings=None, documents=None, metadatas=None):
+        for i, id_ in enumerate(ids):
+            key = self._owner.get(id_)
+            if key is None:
+                continue
+            partition = self.partitions[key]
+            pos = partition._positions[id_]
+            vector = embeddings[i] if embeddings is not None else partition.matrix[pos].copy()
+            document = documents[i] if documents is not None else partition.documents[pos]
+            metadata = {**partition.metadatas[pos], **(metadatas[i] or {})} if metadatas is not None else None
+            new_key = self.classify(id_, document, metadata if metadata is not None else partition.metadatas[pos])
+            if new_key == key:
+                partition.update([id_], None if embeddings is None else [vector],
+                                 None if documents is None else [document],
+                                 None if metadatas is None else [metadatas[i]])
+            else:  # the partition field changed: move the row
+                self.upsert([id_], [vector], [document], [metadata or partition.metadatas[pos]])
+
+    def delete(self, ids):
+        by_key: Dict[Any, List[str]] = {}
+        for id_ in ids:
+            key = self._owner.pop(id_, None)
+            if key is not None:
+                by_key.setdefault(key, []).append(id_)
+        for key, doomed in by_key.items():
+            self.partitions[key].delete(doomed)
+
+    def query(self, query_embeddings, n_results: int = 10, include=None, where=None) -> dict:
+        filters = where_equalities(where)
+        if filters is None:
+            raise ValueError(f"Only equality filters are served from the index, got {where}")
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        n_queries = 1 if queries.ndim == 1 else len(queries)
+        if self.field in filters:
+            partition = self.partitions.get(filters.pop(self.field))
+            if partition is None:
+                return _empty_result(n_queries, include)
+            return partition.query(query_embeddings, n_results, include, filters)
+
+        # No partition key: top-k of each partition, merged by distance
+        merged = _empty_result(n_queries, include)
+        parts = [p.query(query_embeddings, n_results, include, filters) for p in self.partitions.values() if p.size]
+        for row in range(n_queries):
+            hits = sorted(
+                ((part["distances"][row][j], part, j) for part in parts for j in range(len(part["ids"][row]))),
+                key=lambda hit: hit[0],
+            )[:n_results]
+            for column in merged:
+                merged[column][row] = [part[column][row][j] for _, part, j in hits]
+        return merged
+
+
+class IndexedCollection(AsyncCollection):
+    """ Chroma collection whose nearest-neighbour reads are served from a VectorIndex """
+
+    def __init__(self, collection, index=None):
+        super().__init__(collection)
+        self.index = index if index is not None else VectorIndex()
+        self.loaded = False
+        self.refreshes = {"delta": 0, "full": 0}  # stale snapshots brought up to date, by how
+        self._load_lock = asyncio.Lock()
+
+    async def load(self):
+        """ Pulls every row out of Chroma into the in-memory matrix """
+        async with self._load_lock:
+            await self._load()
+
+    async def _load(self):
+        plan = getattr(self.index, "plan", None)
+        if plan is None:
+            data = await self.snapshot(include=["embeddings", "documents", "metadatas"])
+            embeddings = data["embeddings"] if data["embeddings"] is not None else []
+            self.install(data["ids"], embeddings, data["documents"], data["metadatas"])
+            return
+        # Capped partitioned index: metadata first, then only the rows of the partitions it holds
+        listing = await self.snapshot(include=["metadatas"])
+        keep = plan(listing["ids"], listing["metadatas"])
+        ids, embeddings, documents, metadatas = [], [], [], []
+        for b in range(0, len(keep), LOAD_PAGE_SIZE):
+            page = await self.get(ids=keep[b:b + LOAD_PAGE_SIZE], include=["embeddings", "documents", "metadatas"])
+            ids += page["ids"]
+            embeddings += list(page["embeddings"]) if page["embeddings"] is not None else []
+            documents += page["documents"]
+            metadatas += page["metadatas"]
+        self.install(ids, embeddings, documents, metadatas)
+
+    def install(self, ids, embeddings, documents, metadatas):
+        """ Replaces the index contents (rows from Chroma or a memory_snapshot file) """
+        self.index.load(ids, embeddings, documents, metadatas)
+        if self.registry is not None:
+            self.registry.rebuild(ids, documents, metadatas)
+        self.loaded = True
+
+    async def ensure_loaded(self):
+        if self.loaded and not self.is_stale():
+            return
+        async with self._load_lock:
+            # A concurrent caller (warm-up / request) may have loaded it
+            if not self.loaded:
+                await self._load()
+            elif self.is_stale():
+                await self._refresh()
+
+    async def _refresh(self):
+        """ Applies just the rows other workers changed; a full reload if the owner can't tell which """
+        delta = await self.changes(include=["embeddings", "documents", "metadatas"])
+        if delta is None:
+            self.refreshes["full"] += 1
+            await self._load()
+            return
+        self.refreshes["delta"] += 1
+        if delta["deleted"]:
+            self.index.delete(delta["deleted"])
+            if self.registry is not None:
+                self.registry.on_delete(delta["deleted"])
+        if delta["ids"]:
+            self.index.upsert(delta["ids"], delta["embeddings"], delta["documents"], delta["metadatas"])
+            if self.registry is not None:
+                self.registry.on_upsert(delta["ids"], delta["documents"], delta["metadatas"])
+
+    async def query(self, **kwargs):
+        # Text queries and non-equality filters still go to Chroma
+        if ("query_embeddings" not in kwargs or kwargs.get("where_document")
+                or where_equalities(kwargs.get("where")) is None):
+            return await super().query(**kwargs)
+        await self.ensure_loaded()
+        serves = getattr(self.index, "serves", None)
+        if serves is not None and not serves(kwargs.get("where")):
+            return await super().query(**kwargs)  # an offloaded partition: Chroma's HNSW + where
+        with stage(f"index_query.{self.name}"):
+            return self.index.query(kwargs["query_embeddings"], kwargs.get("n_results", 10),
+                                    kwargs.get("include"), kwargs.get("where"))
+
+    async def add(self, **kwargs):
+        await self.ensure_loaded()
+        result = await super().add(**kwargs)
+        self._apply_upsert(kwargs)
+        return result
+
+    async def upsert(self, **kwargs):
+        await self.ensure_loaded()
+        result = await super().upsert(**kwargs)
+        self._apply_upsert(kwargs)
+        return result
+
+    async def update(self, **kwargs):
+        await self.ensure_loaded()
+        result = await super().update(**kwargs)
+        self.index.update(kwargs["ids"], kwargs.get("embeddings"), kwargs.get("documents"), kwargs.get("metadatas"))
+        return result
+
+    async def increment(self, ids, deltas):
+        await self.ensure_loaded()
+        metadatas = await super().increment(ids, deltas)
+        present = [(i, m) for i, m in zip(ids, metadatas) if m is not None]
+        self.index.update([i for i, _ in present], None, None, [m for _, m in present])
+        return metadatas
+
+    async def delete(self, **kwargs):
+        await self.ensure_loaded()
+        result = await super().delete(**kwargs)
+        if kwargs.get("ids"):
+            self.index.delete(kwargs["ids"])
+        else:
+            await self.load()
+        return result
+
+    def _apply_upsert(self, kwargs):
+        if kwargs.get("embeddings") is None:
+            # Chroma embedded the documents itself; resync lazily on next read
+            self.loaded = False
+            return
+        self.index.upsert(kwargs["ids"], kwargs["embeddings"], kwargs.get("documents"), kwargs.get("metadatas"))
@@ -0,0 +1,466 @@
+import os
+import hmac
+import json
+import uuid
+import fcntl
+import socket
+import struct
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from concurrency import increment_metadata, run_blocking
+
+# ==========================================
+# MEMORY SERVICE (single owner, many workers)
+# ==========================================
+# SQLite + HNSW files must only be opened by one process. With
+# MEMORY_SERVICE_ADDRESS set, the store is owned by a separate process:
+#
+#     python memory_service.py                        # owner, holds ./ai_memory
+#     MEMORY_SERVICE_ADDRESS=unix:/tmp/spine_memory.sock uvicorn main:app --workers 4
+#
+# Workers talk to the owner over a local socket (4-byte length + JSON).
+# Every write bumps a per-collection version that the owner pushes to all
+# subscribed workers; a worker whose in-memory snapshot is older marks it
+# stale and on its next read asks the owner for the rows changed since the
+# version it holds: the owner keeps the ids each recent version touched
+# (MEMORY_CHANGE_LOG versions per collection) and answers with those rows and
+# the ids deleted meanwhile. Only a worker further behind than the log, a
+# delete by `where`, or an owner restart falls back to a full snapshot.
+# A worker resends a request once after a dropped connection; writes carry a
+# request ID and the owner answers a resent write from its record of recent
+# ones (MEMORY_REQUEST_DEDUP) instead of applying it twice.
+# Reads of the indexed collections never leave the worker, so read
+# throughput scales with worker count.
+# Without the variable the server opens ./ai_memory in-process, as before.
+#
+# One owner per store: the owner holds an exclusive flock on
+# <MEMORY_PATH>.owner.lock (with its pid in it) and refuses to start while
+# another owner holds it. It only replaces an existing unix socket file that
+# no longer answers. A unix socket is guarded by its file permissions. A
+# tcp: address takes writes to clinical memory from anything that can
+# reach the port, so the owner refuses tcp: without MEMORY_SERVICE_TOKEN.
+# When a token is set, every connection must first send it in a "hello"
+# frame (compared with hmac.compare_digest, like the admin routes).
+
+MEMORY_PATH = os.getenv("MEMORY_PATH", "./ai_memory")
+MEMORY_SERVICE_ADDRESS = os.getenv("MEMORY_SERVICE_ADDRESS", "")  # "" | unix:/path.sock | tcp:host:port
+DEFAULT_SERVICE_ADDRESS = "unix:/tmp/spine_memory.sock"
+MEMORY_CHANGE_LOG = int(os.getenv("MEMORY_CHANGE_LOG", "4096"))  # versions per collection served as deltas
+MEMORY_REQUEST_DEDUP = int(os.getenv("MEMORY_REQUEST_DEDUP", "4096"))  # recent write IDs the owner remembers
+MEMORY_SERVICE_TOKEN = os.getenv("MEMORY_SERVICE_TOKEN", "")  # shared secret; required for tcp:
+
+_HEADER = struct.Struct(">I")
+WRITE_OPS = {"add", "update", "upsert", "delete", "increment"}
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _encode(message: dict) -> bytes:
+    body = json.dumps(_jsonable(message)).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+def parse_address(address: str) -> Tuple[str, object]:
+    kind, _, rest = address.partition(":")
+    if kind == "unix":
+        return "unix", rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"Unsupported memory service address: {address!r}")
+
+
+class MemoryServiceError(Exception):
+    pass
+
+
+def _lock_store(path: str):
+    """ Exclusive, non-blocking flock next to the store; the open file holds it for our lifetime """
+    lock = open(f"{path.rstrip('/')}.owner.lock", "a+")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.seek(0)
+        holder = lock.read().strip() or "?"
+        lock.close()
+        raise MemoryServiceError(f"{path} is already owned by a live memory service (pid {holder})")
+    lock.truncate(0)
+    lock.write(str(os.getpid()))
+    lock.flush()
+    return lock
+
+
+def _socket_answers(path: str) -> bool:
+    """ True if something is listening on the unix socket (a live owner, not a stale file) """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    probe.settimeout(1.0)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+# ---------- owner ----------
+class MemoryOwner:
+    """ Holds the PersistentClient and serialises every write to it """
+
+    def __init__(self, path: str = MEMORY_PATH, token: str = MEMORY_SERVICE_TOKEN):
+        self.path = path
+        self.token = token
+        self._store_lock = _lock_store(path)  # before the store is opened: a second owner stops here
+        import chromadb
+        self.client = chromadb.PersistentClient(path=path)
+        self.epoch = uuid.uuid4().hex  # lets workers tell an owner restart from a version rewind
+        self.versions: Dict[str, int] = {}
+        self._changes: Dict[str, deque] = {}  # name -> (version, ids written; None = unknown rows)
+        self._collections = {}
+        self._write_locks: Dict[str, asyncio.Lock] = {}
+        self._writes: "OrderedDict[str, asyncio.Future]" = OrderedDict()  # request ID -> response
+        self.duplicate_writes = 0
+        self._subscribers = set()
+
+    def _collection(self, name: str):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = self.client.get_or_create_collection(name=name)
+            self.versions.setdefault(name, 0)
+            self._changes.setdefault(name, deque(maxlen=MEMORY_CHANGE_LOG))
+            self._write_locks.setdefault(name, asyncio.Lock())
+        return collection
+
+    async def handle(self, request: dict) -> dict:
+        request_id = request.get("request_id")
+        if request_id is None:
+            return await self._handle(request)
+        # A resent write (the worker lost the connection before our reply) gets the first answer
+        done = self._writes.get(request_id)
+        if done is not None:
+            self.duplicate_writes += 1
+            return await asyncio.shield(done)
+        done = self._writes[request_id] = asyncio.get_running_loop().create_future()
+        while len(self._writes) > MEMORY_REQUEST_DEDUP:
+            self._writes.popitem(last=False)
+        try:
+            response = await self._handle(request)
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        done.set_result(response)
+        return response
+
+    async def _handle(self, request: dict) -> dict:
+        op, name, kwargs = request["op"], request.get("collection"), request.get("kwargs") or {}
+        if op == "versions":
+            return {"ok": True, "result": dict(self.versions), "epoch": self.epoch}
+        collection = self._collection(name)
+        if op == "changes":
+            return await self._changes_since(name, collection, kwargs["since"], kwargs.get("epoch"), kwargs["include"])
+        if op in ("get", "query", "count"):
+            # Version taken before the read: a write racing the read can only make us look older
+            version = self.versions[name]
+            result = await run_blocking(getattr(collection, op), **kwargs)
+        elif op in WRITE_OPS:
+            # One writer per collection, so version order == apply order
+            async with self._write_locks[name]:
+                if op == "increment":
+                    result = await run_blocking(increment_metadata, collection, kwargs["ids"], kwargs["deltas"])
+                else:
+                    result = await run_blocking(getattr(collection, op), **kwargs)
+                self.versions[name] += 1
+                version = self.versions[name]
+                self._changes[name].append((version, kwargs.get("ids")))
+            await self._publish(name, version)
+        else:
+            return {"ok": False, "error": f"unknown op {op}"}
+        return {"ok": True, "result": result, "version": version, "epoch": self.epoch}
+
+    async def _changes_since(self, name: str, collection, since: int, epoch: Optional[str], include) -> dict:
+        """ Rows written after version `since` plus the ids deleted since, or {"full": True} """
+        # Version and log read together, before the rows: a write racing the read is re-sent next time
+        version = self.versions[name]
+        written = [ids for v, ids in self._changes[name] if v > since]
+        if epoch != self.epoch or len(written) != version - since or any(ids is None for ids in written):
+            return {"ok": True, "result": {"full": True}, "version": version, "epoch": self.epoch}
+        ids = list(dict.fromkeys(i for batch in written for i in batch))
+        rows = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+        if ids:
+            rows = await run_blocking(collection.get, ids=ids, include=include)
+        present = set(rows["ids"])
+        result = {k: rows.get(k) for k in ("ids", "embeddings", "documents", "metadatas")}
+        result.update(full=False, deleted=[i for i in ids if i not in present])
+        return {"ok": True, "result": result, "version": version, "epoch": self.epoch}
+
+    async def _publish(self, name: str, version: int):
+        event = _encode({"event": "version", "collection": name, "version": version, "epoch": self.epoch})
+        for writer in list(self._subscribers):
+            try:
+                writer.write(event)
+                await writer.drain()
+            except (ConnectionError, RuntimeError):
+                self._subscribers.discard(writer)
+
+    async def _serve_connection(self, reader, writer):
+        authenticated = not self.token
+        try:
+            while True:
+                header = await reader.readexactly(_HEADER.size)
+                request = json.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+                if not authenticated:
+                    token = request.get("token") if request.get("op") == "hello" else None
+                    authenticated = isinstance(token, str) and hmac.compare_digest(token, self.token)
+                    writer.write(_encode({"ok": True} if authenticated else {"ok": False, "error": "unauthorized"}))
+                    await writer.drain()
+                    if not authenticated:
+                        return
+                    continue
+                if request.get("op") == "hello":
+                    writer.write(_encode({"ok": True}))
+                    await writer.drain()
+                    continue
+                if request.get("op") == "subscribe":
+                    self._subscribers.add(writer)
+                    for name in self.versions:
+                        writer.write(_encode({"event": "version", "collection": name,
+                                              "version": self.versions[name], "epoch": self.epoch}))
+                    await writer.drain()
+                    continue
+                try:
+                    response = await self.handle(request)
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(_encode(response))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    async def serve(self, address: str):
+        kind, target = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(target):
+                if _socket_answers(target):
+                    raise MemoryServiceError(f"A memory service already answers on {address}")
+                os.unlink(target)  # left by an owner that exited
+            server = await asyncio.start_unix_server(self._serve_connection, path=target)
+        else:
+            if not self.token:
+                raise MemoryServiceError(f"{address} needs MEMORY_SERVICE_TOKEN: tcp accepts writes from the network")
+            server = await asyncio.start_server(self._serve_connection, *target)
+        print(f"🗄️ Memory service owning {self.path} on {address}")
+        async with server:
+            await server.serve_forever()
+
+
+# ---------- worker side ----------
+class MemoryServiceClient:
+    """ Blocking request/response client; one socket per thread of the blocking pool """
+
+    def __init__(self, address: str, token: str = MEMORY_SERVICE_TOKEN):
+        self.address = address
+        self.token = token
+        self._local = threading.local()
+
+    def _socket(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            kind, target = parse_address(self.address)
+            if kind == "unix":
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            else:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.connect(target)
+            if self.token:
+                sock.sendall(_encode({"op": "hello", "token": self.token}))
+                reply = json.loads(self._recv(sock, _HEADER.unpack(self._recv(sock, _HEADER.size))[0]))
+                if not reply.get("ok"):
+                    sock.close()
+                    raise MemoryServiceError(f"memory service refused the token: {reply.get('error')}")
+            self._local.sock = sock
+        return sock
+
+    def _recv(self, sock, size: int) -> bytes:
+        chunks = bytearray()
+        while len(chunks) < size:
+            chunk = sock.recv(size - len(chunks))
+            if not chunk:
+                raise ConnectionError("memory service closed the connection")
+            chunks.extend(chunk)
+        return bytes(chunks)
+
+    def call(self, op: str, collection: Optional[str] = None, **kwargs) -> dict:
+        request = {"op": op, "collection": collection, "kwargs": kwargs}
+        if op in WRITE_OPS:
+            request["request_id"] = uuid.uuid4().hex  # lets the owner drop the resend of an applied write
+        message = _encode(request)
+        for attempt in range(2):  # one reconnect (owner restart / idle socket closed)
+            sock = self._socket()
+            try:
+                sock.sendall(message)
+                size = _HEADER.unpack(self._recv(sock, _HEADER.size))[0]
+                response = json.loads(self._recv(sock, size))
+                break
+            except (ConnectionError, OSError):
+                sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+        if not response.get("ok"):
+            raise MemoryServiceError(response.get("error"))
+        return response
+
+    def get_or_create_collection(self, name: str) -> "RemoteCollection":
+        return RemoteCollection(self, name)
+
+
+class RemoteCollection:
+    """ Chroma-Collection-shaped proxy; tracks which owner version this worker has seen """
+
+    def __init__(self, client: MemoryServiceClient, name: str):
+        self.client = client
+        self.name = name
+        self.epoch = None
+        self.seen_version = 0
+        self.stale = False
+        self._lock = threading.Lock()
+
+    def _call(self, op: str, **kwargs):
+        response = self.client.call(op, self.name, **kwargs)
+        if op in WRITE_OPS:
+            with self._lock:
+                # Our write is the only news only if it is exactly the next version; otherwise
+                # seen_version stays put so the next delta also covers the versions we missed
+                if response["epoch"] == self.epoch and response["version"] == self.seen_version + 1:
+                    self.seen_version = response["version"]
+                else:
+                    self.stale = True
+        return response
+
+    def observe_published(self, version: int, epoch: str) -> bool:
+        """ Called for every owner broadcast; True if our snapshot is now out of date """
+        with self._lock:
+            if epoch == self.epoch and version <= self.seen_version:
+                return False
+            self.stale = True
+            return True
+
+    def snapshot(self, include):
+        response = self._call("get", include=include)
+        with self._lock:
+            self.epoch, self.seen_version, self.stale = response["epoch"], response["version"], False
+        return response["result"]
+
+    def changes(self, include) -> Optional[dict]:
+        """ Rows changed since our snapshot ({"ids", ..., "deleted"}), or None if a snapshot is needed """
+        with self._lock:
+            since, epoch = self.seen_version, self.epoch
+        if epoch is None:
+            return None
+        response = self._call("changes", since=since, epoch=epoch, include=include)
+        if response["result"]["full"]:
+            return None
+        with self._lock:
+            self.seen_version, self.stale = response["version"], False
+        return response["result"]
+
+    def get(self, **kwargs):
+        return self._call("get", **kwargs)["result"]
+
+    def query(self, **kwargs):
+        return self._call("query", **kwargs)["result"]
+
+    def count(self):
+        return self._call("count")["result"]
+
+    def add(self, **kwargs):
+        self._call("add", **kwargs)
+
+    def update(self, **kwargs):
+        self._call("update", **kwargs)
+
+    def upsert(self, **kwargs):
+        self._call("upsert", **kwargs)
+
+    def delete(self, **kwargs):
+        self._call("delete", **kwargs)
+
+    def increment(self, ids, deltas):
+        return self._call("increment", ids=ids, deltas=deltas)["result"]
+
+
+class VersionWatcher:
+    """ Listens for owner broadcasts and invalidates this worker's snapshots """
+
+    def __init__(self, address: str, on_change: Callable[[str, int, str], None], token: str = MEMORY_SERVICE_TOKEN):
+        self.address = address
+        self.token = token
+        self.on_change = on_change
+        self._task: Optional[asyncio.Task] = None
+        self.events = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        kind, target = parse_address(self.address)
+        while True:
+            try:
+                if kind == "unix":
+                    reader, writer = await asyncio.open_unix_connection(target)
+                else:
+                    reader, writer = await asyncio.open_connection(*target)
+                if self.token:
+                    writer.write(_encode({"op": "hello", "token": self.token}))
+                    await writer.drain()
+                    header = await reader.readexactly(_HEADER.size)
+                    reply = json.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+                    if not reply.get("ok"):
+                        raise MemoryServiceError(f"memory service refused the token: {reply.get('error')}")
+                writer.write(_encode({"op": "subscribe"}))
+                await writer.drain()
+                while True:
+                    header = await reader.readexactly(_HEADER.size)
+                    event = json.loads(await reader.readexactly(_HEADER.unpack(header)[0]))
+                    self.events += 1
+                    self.on_change(event["collection"], event["version"], event["epoch"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Memory service subscription lost ({e}); reconnecting")
+                await asyncio.sleep(1.0)
+
+
+def open_memory_client(address: str = MEMORY_SERVICE_ADDRESS, path: str = MEMORY_PATH):
+    """ PersistentClient in single-process mode, a proxy to the owner otherwise """
+    if address:
+        return MemoryServiceClient(address)
+    import chromadb  # deferred: the import alone is ~1 s of worker startup
+    return chromadb.PersistentClient(path=path)
+
+
+if __name__ == "__main__":
+    asyncio.run(MemoryOwner().serve(MEMORY_SERVICE_ADDRESS or DEFAULT_SERVICE_ADDRESS))
@@ -0,0 +1,216 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# ==========================================
+# PORTABLE MEMORY SNAPSHOTS
+# ==========================================
+# A snapshot is a directory:
+#   manifest.json                  format, embedding model, per-collection rows/dim/sha256
+#   <collection>.npy               float32 (rows x dim) matrix, memory-mapped on load
+#   <collection>.columns.json      {"ids": [...], "documents": [...], "metadatas": [...]}
+#
+# New replicas boot their indexes straight from the mapped matrices (no
+# Chroma reads, no embedding calls) and then attach to Chroma for writes.
+#
+#     python memory_snapshot.py export ./snapshots/2026-10-17
+#     python memory_snapshot.py import ./snapshots/2026-10-17     # fill an empty store
+#     python memory_snapshot.py verify ./snapshots/2026-10-17
+
+SNAPSHOT_FORMAT = 1
+MEMORY_COLLECTION_NAMES = ("triage_pearls", "gold_standard_cases", "visual_corrections")
+DEFAULT_EMBEDDING_MODEL = "models/text-embedding-004"
+IMPORT_BATCH_SIZE = 500
+_HASH_CHUNK = 1024 * 1024
+
+
+class SnapshotError(Exception):
+    """ Snapshot missing, corrupt, or built for a different embedding model """
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SnapshotCollection:
+    """ One collection's rows; `embeddings` is a copy-on-write memory map """
+
+    def __init__(self, name: str, ids: List[str], embeddings: np.ndarray,
+                 documents: List[Optional[str]], metadatas: List[dict]):
+        self.name = name
+        self.ids = ids
+        self.embeddings = embeddings
+        self.documents = documents
+        self.metadatas = metadatas
+
+    def __len__(self):
+        return len(self.ids)
+
+    def columns(self) -> dict:
+        return {"ids": self.ids, "documents": self.documents, "metadatas": self.metadatas}
+
+
+class MemorySnapshot:
+    def __init__(self, path: str, manifest: dict, collections: Dict[str, SnapshotCollection]):
+        self.path = path
+        self.manifest = manifest
+        self.collections = collections
+
+    @property
+    def embedding_model(self) -> str:
+        return self.manifest["embedding_model"]
+
+    def collection(self, name: str) -> Optional[SnapshotCollection]:
+        return self.collections.get(name)
+
+    # ---------- write ----------
+    @staticmethod
+    def write(path: str, collections: Dict[str, dict], embedding_model: str) -> dict:
+        """ Writes Chroma-shaped get() results atomically (temp dir + rename) """
+        tmp = f"{path.rstrip(os.sep)}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "embedding_model": embedding_model,
+            "created_at": time.time(),
+            "collections": {},
+        }
+        for name, data in collections.items():
+            ids = list(data["ids"])
+            embeddings = data.get("embeddings")
+            matrix = (np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+                      if len(ids) else np.zeros((0, 0), dtype=np.float32))
+            matrix_file, columns_file = f"{name}.npy", f"{name}.columns.json"
+            np.save(os.path.join(tmp, matrix_file), np.ascontiguousarray(matrix))
+            with open(os.path.join(tmp, columns_file), "w") as f:
+                json.dump({
+                    "ids": ids,
+                    "documents": list(data.get("documents") or [None] * len(ids)),
+                    "metadatas": [m or {} for m in (data.get("metadatas") or [None] * len(ids))],
+                }, f, separators=(",", ":"))
+            manifest["collections"][name] = {
+                "rows": len(ids),
+                "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                "embeddings": matrix_file,
+                "columns": columns_file,
+                "sha256": {
+                    matrix_file: _sha256(os.path.join(tmp, matrix_file)),
+                    columns_file: _sha256(os.path.join(tmp, columns_file)),
+                },
+            }
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        return manifest
+
+    # ---------- read ----------
+    @classmethod
+    def open(cls, path: str, expected_model: Optional[str] = None, verify: bool = True) -> "MemorySnapshot":
+        manifest_path = os.path.join(path, "manifest.json")
+        if not os.path.exists(manifest_path):
+            raise SnapshotError(f"No snapshot manifest at {manifest_path}")
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise SnapshotError(f"Unsupported snapshot format {manifest.get('format')}")
+        if expected_model and manifest["embedding_model"] != expected_model:
+            # Vectors from another model live in a different space; never mix them
+            raise SnapshotError(
+                f"Snapshot embeds with {manifest['embedding_model']}, server uses {expected_model}"
+            )
+
+        collections = {}
+        for name, entry in manifest["collections"].items():
+            if verify:
+                for filename, expected in entry["sha256"].items():
+                    if _sha256(os.path.join(path, filename)) != expected:
+                        raise SnapshotError(f"Checksum mismatch for {filename}")
+            # mmap_mode="c": pages load lazily, in-place index updates stay private to this process
+            matrix = np.load(os.path.join(path, entry["embeddings"]), mmap_mode="c")
+            with open(os.path.join(path, entry["columns"])) as f:
+                columns = json.load(f)
+            if len(columns["ids"]) != entry["rows"] or matrix.shape[0] != entry["rows"]:
+                raise SnapshotError(f"Row count mismatch in {name}")
+            collections[name] = SnapshotCollection(
+                name, columns["ids"], matrix, columns["documents"], columns["metadatas"]
+            )
+        return cls(path, manifest, collections)
+
+
+# ---------- CLI ----------
+def export_snapshot(path: str, embedding_model: str, names=MEMORY_COLLECTION_NAMES) -> dict:
+    from memory_service import open_memory_client
+    client = open_memory_client()
+    data = {
+        name: client.get_or_create_collection(name=name).get(include=["embeddings", "documents", "metadatas"])
+        for name in names
+    }
+    return MemorySnapshot.write(path, data, embedding_model)
+
+
+def import_snapshot(path: str, embedding_model: str, force: bool = False) -> Dict[str, int]:
+    """ Upserts snapshot rows into the store (skips non-empty collections unless forced) """
+    from memory_service import open_memory_client
+    snapshot = MemorySnapshot.open(path, expected_model=embedding_model)
+    client = open_memory_client()
+    imported = {}
+    for name, rows in snapshot.collections.items():
+        collection = client.get_or_create_collection(name=name)
+        if collection.count() and not force:
+            print(f"⏭️ {name} already has rows; skipping (use --force to upsert anyway)")
+            continue
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            end = start + IMPORT_BATCH_SIZE
+            collection.upsert(
+                ids=rows.ids[start:end],
+                embeddings=np.asarray(rows.embeddings[start:end]).tolist(),
+                documents=rows.documents[start:end],
+                metadatas=[m or None for m in rows.metadatas[start:end]],
+            )
+        imported[name] = len(rows)
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / import / verify memory snapshots")
+    parser.add_argument("command", choices=["export", "import", "verify"])
+    parser.add_argument("path")
+    parser.add_argument("--embedding-model", default=DEFAULT_EMBEDDING_MODEL)
+    parser.add_argument("--force", action="store_true", help="import into non-empty collections too")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            manifest = export_snapshot(args.path, args.embedding_model)
+            for name, entry in manifest["collections"].items():
+                print(f"📦 {name}: {entry['rows']} rows x {entry['dim']} dims")
+            print(f"✅ Snapshot written to {args.path}")
+            return
+        if args.command == "import":
+            imported = import_snapshot(args.path, args.embedding_model, args.force)
+            print(f"✅ Imported {imported} with zero embedding calls")
+            return
+        snapshot = MemorySnapshot.open(args.path, expected_model=args.embedding_model)
+    except SnapshotError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(f"✅ {args.path} OK ({snapshot.embedding_model}): "
+          + ", ".join(f"{n}={len(c)}" for n, c in snapshot.collections.items()))
+
+
+if __name__ == "__main__":
+    main()
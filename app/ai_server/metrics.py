@@ -0,0 +1,183 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ==========================================
+# HOT-PATH INSTRUMENTATION
+# ==========================================
+# Dependency-free counters/histograms rendered in Prometheus text format.
+# A stage timing costs two perf_counter() calls, a bisect and a list append,
+# so this stays on in production.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+# Per-request stage log: [(stage, seconds), ...] for the Server-Timing header
+_request_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_stages", default=None
+)
+_request_endpoint: contextvars.ContextVar[str] = contextvars.ContextVar("request_endpoint", default="internal")
+# Per-request payload sizes ({"prompt_chars": n, ...}) kept with slow-request captures
+_request_sizes: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_sizes", default=None
+)
+
+
+def _labels_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels_text(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[slot] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _labels_text(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels_text(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], List[str]]):
+        """ Scrape-time callback for values owned elsewhere (cache/quota stats) """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name: str, help_text: str, samples: Dict[tuple, float], labels: Tuple[str, ...] = ()) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for key, value in samples.items():
+        lines.append(f"{name}{_labels_text(labels, key)} {value}")
+    return lines
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "ai_request_duration_seconds", "End-to-end request latency", ("endpoint", "status"))
+STAGE_SECONDS = registry.histogram(
+    "ai_stage_duration_seconds", "Latency of each pipeline stage", ("endpoint", "stage"))
+FALLBACKS = registry.counter(
+    "ai_fallback_responses_total", "Requests answered with a hard-coded fallback", ("endpoint",))
+UPSTREAM_RETRIES = registry.counter(
+    "ai_upstream_retries_total", "Gemini calls retried after 429/503", ("endpoint", "model"))
+UPLOAD_BYTES = registry.histogram(
+    "ai_upload_bytes", "Size of each uploaded image", ("endpoint",), buckets=BYTES_BUCKETS)
+
+
+# ---------- per-request helpers ----------
+def begin_request(endpoint: str):
+    """ Starts a stage log for the current request context """
+    _request_endpoint.set(endpoint)
+    stages: List[Tuple[str, float]] = []
+    _request_stages.set(stages)
+    _request_sizes.set({})
+    return stages
+
+
+def current_endpoint() -> str:
+    return _request_endpoint.get()
+
+
+def record_stage(name: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, endpoint=_request_endpoint.get(), stage=name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+def record_size(name: str, amount: float):
+    """ Adds to a per-request size tally (prompt chars, image bytes, ...) """
+    sizes = _request_sizes.get()
+    if sizes is not None:
+        sizes[name] = sizes.get(name, 0) + amount
+
+
+def request_sizes() -> Dict[str, float]:
+    return dict(_request_sizes.get() or {})
+
+
+@contextmanager
+def stage(name: str):
+    """ Times a block (works around awaits too) """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def server_timing_header(stages: List[Tuple[str, float]]) -> str:
+    """ Aggregates repeated stages into a W3C Server-Timing header value """
+    totals: Dict[str, float] = {}
+    for name, seconds in stages:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
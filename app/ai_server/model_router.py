@@ -0,0 +1,262 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import registry
+from quota_governor import PRIORITY_ROUTINE, estimate_tokens
+
+# ==========================================
+# TIERED MODEL ROUTING (FAST / DEEP)
+# ==========================================
+# Radix (triage), Voxel (vision) and rule synthesis all start on the fast
+# model unless the request itself says depth is needed:
+#   - red-flag history (bowelBladderIncontinence, limbWeakness)   -> deep
+#   - a film set of DEEP_IMAGE_COUNT images or more                -> deep
+#   - the previous attempt came back below the confidence bar      -> deep
+#   - the previous attempt failed schema validation                -> deep
+# The last two are escalation: a fast answer is re-asked of the deep model
+# only when it is unusable or unsure. An answer that parse() can use except
+# for a few fields (IncompleteOutput) first gets one re-ask on the same
+# tier for just those fields; escalation follows only if that fails too.
+# The bar is ESCALATION_CONFIDENCE, or OVERRIDE_ESCALATION_CONFIDENCE when
+# retrieved memory holds a CRITICAL override (the case has burned us
+# before). Outputs without a confidence field are never escalated for
+# confidence.
+#
+# Every attempt is timed and priced per tier; stats() compares the blended
+# per-request latency / cost with what the same traffic would cost on the
+# deep model alone. MODEL_ROUTING=0 pins everything to the fast model.
+
+FAST_MODEL_ID = os.getenv("FAST_MODEL_ID", "gemini-3-flash-preview")
+DEEP_MODEL_ID = os.getenv("DEEP_MODEL_ID", "gemini-3-pro-preview")
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "1") == "1"
+ESCALATION_CONFIDENCE = float(os.getenv("ESCALATION_CONFIDENCE", "0.6"))
+OVERRIDE_ESCALATION_CONFIDENCE = float(os.getenv("OVERRIDE_ESCALATION_CONFIDENCE", "0.8"))
+DEEP_IMAGE_COUNT = int(os.getenv("DEEP_IMAGE_COUNT", "6"))
+
+
+def _prices(name: str, default: str) -> Tuple[float, float]:
+    """ "input,output" USD per 1M tokens """
+    price_in, price_out = os.getenv(name, default).split(",")
+    return float(price_in), float(price_out)
+
+
+TIER_PRICES = {
+    "fast": _prices("FAST_MODEL_PRICE", "0.5,3.0"),
+    "deep": _prices("DEEP_MODEL_PRICE", "2.0,12.0"),
+}
+
+RED_FLAG_FIELDS = ("bowelBladderIncontinence", "limbWeakness")
+LATENCY_SAMPLES = 1024
+
+MODEL_CALL_SECONDS = registry.histogram(
+    "ai_model_call_seconds", "Generation latency per routed attempt", ("kind", "tier"))
+MODEL_ROUTES = registry.counter(
+    "ai_model_routes_total", "Routed generation attempts by tier and reason", ("kind", "tier", "reason"))
+MODEL_COST = registry.counter(
+    "ai_model_cost_usd_total", "Estimated generation spend", ("kind", "tier"))
+
+
+class SchemaError(ValueError):
+    """ A model answer that does not have the shape the endpoint promises """
+
+
+class IncompleteOutput(SchemaError):
+    """ An answer usable except for some fields: the router re-asks the same model for just those """
+
+    def __init__(self, message: str, missing: List[str], reask_prompt: str, complete: Callable[[str], Any]):
+        super().__init__(message)
+        self.missing = missing
+        self.reask_prompt = reask_prompt  # appended to the original contents
+        self.complete = complete  # (re-ask answer text) -> full result, or raises SchemaError
+
+
+def red_flags(history: Optional[dict]) -> Tuple[str, ...]:
+    return tuple(field for field in RED_FLAG_FIELDS if (history or {}).get(field))
+
+
+def count_overrides(rule_texts: Iterable[str]) -> int:
+    """ Retrieved rules / rendered memory lines that are CRITICAL overrides (text or visual) """
+    return sum(1 for text in rule_texts if (text or "").strip().lstrip("! ").upper().startswith("CRITICAL"))
+
+
+class RouteFeatures:
+    """ What the router knows about one call """
+
+    def __init__(self, red_flags: Tuple[str, ...] = (), critical_overrides: int = 0, image_count: int = 0,
+                 prior_confidence: Optional[float] = None, prior_schema_failed: bool = False):
+        self.red_flags = tuple(red_flags)
+        self.critical_overrides = critical_overrides
+        self.image_count = image_count
+        self.prior_confidence = prior_confidence
+        self.prior_schema_failed = prior_schema_failed
+
+    @property
+    def confidence_bar(self) -> float:
+        return OVERRIDE_ESCALATION_CONFIDENCE if self.critical_overrides else ESCALATION_CONFIDENCE
+
+
+class _TierStats:
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.cost = 0.0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+
+class ModelRouter:
+    """ Picks fast or deep per call, escalates unusable / unsure fast answers """
+
+    def __init__(self, generate: Callable[..., Awaitable[Any]], fast_model: str = FAST_MODEL_ID,
+                 deep_model: str = DEEP_MODEL_ID, enabled: bool = MODEL_ROUTING):
+        self.generate = generate  # async (contents, config=, priority=, model=[, on_text=, on_restart=]) -> .text
+        self.models = {"fast": fast_model, "deep": deep_model}
+        self.enabled = enabled
+        self._tiers = {tier: _TierStats() for tier in self.models}
+        self._reasons: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.escalations = 0
+        self.request_seconds = 0.0
+        self.request_cost = 0.0
+        self.deep_only_cost = 0.0  # the same prompts / answers priced at the deep tier
+
+    @property
+    def signature(self) -> tuple:
+        """ Part of result-cache keys: a routing change must not serve the other tier's answers """
+        return (self.models["fast"], self.models["deep"] if self.enabled else None,
+                ESCALATION_CONFIDENCE, OVERRIDE_ESCALATION_CONFIDENCE, DEEP_IMAGE_COUNT)
+
+    def route(self, features: RouteFeatures) -> Tuple[str, str]:
+        """ -> (tier, reason) for the next attempt """
+        if not self.enabled:
+            return "fast", "routing_off"
+        if features.prior_schema_failed:
+            return "deep", "schema_failure"
+        if features.prior_confidence is not None and features.prior_confidence < features.confidence_bar:
+            return "deep", "low_confidence"
+        if features.red_flags:
+            return "deep", "red_flag"
+        if features.image_count >= DEEP_IMAGE_COUNT:
+            return "deep", "image_count"
+        return "fast", "default"
+
+    async def run(self, kind: str, contents, features: RouteFeatures,
+                  parse: Callable[[str], Any], confidence: Callable[[Any], Optional[float]] = lambda result: None,
+                  config=None, priority: int = PRIORITY_ROUTINE,
+                  on_text: Optional[Callable[[str], None]] = None,
+                  on_attempt: Optional[Callable[[str, str], None]] = None) -> Any:
+        """ Routed generation: parse(text) must raise ValueError on a malformed answer.
+        on_text streams each attempt's output; on_attempt(tier, reason) marks where an attempt starts,
+        including a quota retry of the same call (reason "retry"). """
+        started = time.perf_counter()
+        spent, tokens_in, tokens_out = 0.0, estimate_tokens(contents), 0
+        tier, reason = self.route(features)
+        try:
+            while True:
+                if on_attempt is not None:
+                    on_attempt(tier, reason)
+                response, cost = await self._attempt(kind, tier, reason, contents, config, priority, on_text,
+                                                     on_attempt)
+                spent += cost
+                tokens_out = estimate_tokens(response.text or "")
+                try:
+                    try:
+                        result = parse(response.text)
+                    except IncompleteOutput as e:
+                        print(f"🩹 {kind}: {tier} answer incomplete ({e}); re-asking for {e.missing}")
+                        response, cost = await self._attempt(kind, tier, "reask", _with_prompt(contents, e.reask_prompt),
+                                                             config, priority)
+                        spent += cost
+                        result = e.complete(response.text)
+                except ValueError as e:
+                    if tier == "deep" or not self.enabled:
+                        raise
+                    print(f"⚠️ {kind}: fast answer failed validation ({e}); escalating")
+                    features.prior_schema_failed = True
+                else:
+                    if tier == "deep":
+                        return result
+                    features.prior_confidence = _as_confidence(confidence(result))
+                tier, reason = self.route(features)
+                if tier == "fast":
+                    return result
+                with self._lock:
+                    self.escalations += 1
+        finally:
+            price_in, price_out = TIER_PRICES["deep"]
+            with self._lock:
+                self.requests += 1
+                self.request_seconds += time.perf_counter() - started
+                self.request_cost += spent
+                self.deep_only_cost += (tokens_in * price_in + tokens_out * price_out) / 1e6
+
+    async def _attempt(self, kind: str, tier: str, reason: str, contents, config, priority, on_text=None,
+                       on_attempt=None):
+        model = self.models[tier]
+        MODEL_ROUTES.inc(kind=kind, tier=tier, reason=reason)
+        started = time.perf_counter()
+        streaming = {"on_text": on_text} if on_text is not None else {}
+        if on_text is not None and on_attempt is not None:
+            streaming["on_restart"] = lambda: on_attempt(tier, "retry")
+        response = await self.generate(contents, config=config, priority=priority, model=model, **streaming)
+        elapsed = time.perf_counter() - started
+        price_in, price_out = TIER_PRICES[tier]
+        cost = (estimate_tokens(contents) * price_in + estimate_tokens(response.text or "") * price_out) / 1e6
+        MODEL_CALL_SECONDS.observe(elapsed, kind=kind, tier=tier)
+        MODEL_COST.inc(cost, kind=kind, tier=tier)
+        with self._lock:
+            stats = self._tiers[tier]
+            stats.calls += 1
+            stats.seconds += elapsed
+            stats.cost += cost
+            stats.samples.append(elapsed)
+            key = f"{kind}:{tier}:{reason}"
+            self._reasons[key] = self._reasons.get(key, 0) + 1
+        return response, cost
+
+    # ---------- reporting ----------
+    def stats(self) -> dict:
+        with self._lock:
+            tiers = {}
+            for tier, s in self._tiers.items():
+                samples = sorted(s.samples)
+                tiers[tier] = {
+                    "model": self.models[tier],
+                    "calls": s.calls,
+                    "mean_ms": round(s.seconds / s.calls * 1000, 1) if s.calls else None,
+                    "p50_ms": round(samples[len(samples) // 2] * 1000, 1) if samples else None,
+                    "p95_ms": round(samples[int(len(samples) * 0.95)] * 1000, 1) if samples else None,
+                    "cost_usd": round(s.cost, 6),
+                }
+            deep = self._tiers["deep"]
+            blended_ms = self.request_seconds / self.requests * 1000 if self.requests else None
+            deep_ms = deep.seconds / deep.calls * 1000 if deep.calls else None
+            return {
+                "enabled": self.enabled,
+                "requests": self.requests,
+                "escalations": self.escalations,
+                "escalation_rate": round(self.escalations / self.requests, 4) if self.requests else 0.0,
+                "tiers": tiers,
+                "routes": dict(self._reasons),
+                "blended_request_ms": round(blended_ms, 1) if blended_ms is not None else None,
+                # Mean deep-call latency stands in for "every request on the deep model"
+                "speedup_vs_deep_only": round(deep_ms / blended_ms, 2) if deep_ms and blended_ms else None,
+                "cost_usd": round(self.request_cost, 6),
+                "deep_only_cost_usd": round(self.deep_only_cost, 6),
+                "cost_ratio_vs_deep_only": (round(self.request_cost / self.deep_only_cost, 3)
+                                            if self.deep_only_cost else None),
+            }
+
+
+def _with_prompt(contents, prompt: str) -> list:
+    return (list(contents) if isinstance(contents, list) else [contents]) + [prompt]
+
+
+def _as_confidence(value) -> Optional[float]:
+    try:
+        return None if value is None else float(value)
+    except (TypeError, ValueError):
+        return None
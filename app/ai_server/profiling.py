@@ -0,0 +1,375 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from metrics import current_endpoint
+
+# ==========================================
+# ON-DEMAND PROFILING + SLOW-REQUEST CAPTURE
+# ==========================================
+# Profiler: off until an admin starts a session (a time window, a share of
+# requests, optionally only some routes). A daemon thread then samples every
+# PROFILE_INTERVAL_MS and, for each profiled request, records its WALL-CLOCK
+# stack, i.e. where the request is right now whether or not it holds the CPU:
+#   - suspended: the chain of awaiting coroutines down to what it waits on
+#     (SDK call, quota queue, sleep), read from cr_await
+#   - running on the event loop: the loop thread's real frames below the task
+#   - waiting on run_blocking: the pool thread's frames for that work,
+#     stitched under the awaiting coroutine (run_blocking tags the thread)
+#   - waiting on asyncio.gather: one stack per unfinished branch
+# Requests are tracked by ProfiledRequests, an ASGI middleware inside the
+# instrumentation (so in the endpoint's task), and vision jobs by their worker.
+# Samples aggregate into (route, stack) counts and download as collapsed
+# stacks (flamegraph.pl / speedscope import) or speedscope JSON. Overhead is
+# the sampler thread's share of the GIL; stats() reports its busy time.
+#
+# SlowRequestLog: always on. Requests slower than SLOW_REQUEST_SECONDS keep
+# their full stage breakdown and payload sizes in a bounded ring buffer.
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))
+PROFILE_MAX_DEPTH = 128
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5.0"))
+SLOW_REQUEST_BUFFER = int(os.getenv("SLOW_REQUEST_BUFFER", "200"))
+
+# Set while the current request is being profiled: run_blocking then tags its pool thread
+_profile_owner: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("profile_owner", default=None)
+
+# Frames from these files are plumbing, not the work: dropped from pool-thread stacks
+_POOL_PLUMBING = (os.path.join("concurrent", "futures", "thread.py"), "threading.py", __file__)
+
+
+def owned(fn):
+    """ Wraps a run_blocking callable so the sampler can attribute its thread to the awaiting task """
+    if _profile_owner.get() is None:
+        return fn
+    owner = asyncio.current_task()
+
+    def run(*args, **kwargs):
+        ident = threading.get_ident()
+        _thread_owners[ident] = owner
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _thread_owners.pop(ident, None)
+
+    return run
+
+
+_thread_owners: Dict[int, asyncio.Task] = {}  # pool thread ident -> task awaiting its work
+
+
+_labels: Dict[object, str] = {}  # code object -> label (a sample only formats new code)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = _code_label(code)
+    return label
+
+
+def _code_label(code) -> str:
+    filename = code.co_filename
+    for marker in ("site-packages" + os.sep, "lib" + os.sep + "python"):
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+            break
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _thread_stack(frame) -> list:
+    """ Outermost-first frames of a thread, without the executor plumbing """
+    frames = []
+    while frame is not None and len(frames) < PROFILE_MAX_DEPTH:
+        if not frame.f_code.co_filename.endswith(_POOL_PLUMBING):
+            frames.append(frame)
+        frame = frame.f_back
+    return frames[::-1]
+
+
+def _await_chain(task: asyncio.Task) -> Tuple[list, object]:
+    """ Frames of the task's awaiting coroutines (outermost first) and what the innermost awaits """
+    frames, awaitable = [], task.get_coro()
+    while awaitable is not None and len(frames) < PROFILE_MAX_DEPTH:
+        frame = (getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+                 or getattr(awaitable, "ag_frame", None))
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = (getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+                     or getattr(awaitable, "ag_await", None))
+    if awaitable is not None:
+        # `await future` leaves an opaque iterator in cr_await; the task knows the future itself
+        awaitable = getattr(task, "_fut_waiter", None) or awaitable
+    return frames, awaitable
+
+
+class ProfileSession:
+    def __init__(self, seconds: float, routes: List[str], sample_rate: float, interval_ms: float):
+        self.routes = set(routes)
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000.0
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + seconds
+        self.seconds = seconds
+        self.stacks: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+        self.samples = 0
+        self.ticks = 0
+        self.requests = 0
+        self.sampler_seconds = 0.0
+        self.stopped_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.stopped_at is None and time.monotonic() < self.deadline
+
+    def report(self) -> dict:
+        elapsed = (self.stopped_at or time.time()) - self.started_at
+        return {
+            "active": self.active,
+            "routes": sorted(self.routes) or "all",
+            "sample_rate": self.sample_rate,
+            "interval_ms": self.interval * 1000,
+            "window_s": self.seconds,
+            "elapsed_s": round(elapsed, 2),
+            "remaining_s": round(max(0.0, self.deadline - time.monotonic()), 2) if self.active else 0.0,
+            "requests_profiled": self.requests,
+            "samples": self.samples,
+            "unique_stacks": len(self.stacks),
+            "sampler_busy_ms": round(self.sampler_seconds * 1000, 1),
+            "sampler_overhead": round(self.sampler_seconds / elapsed, 4) if elapsed > 0 else 0.0,
+        }
+
+
+class Profiler:
+    """ Wall-clock sampling of selected requests, for a bounded window """
+
+    def __init__(self):
+        self.session: Optional[ProfileSession] = None
+        self._tracked: Dict[int, Tuple[str, asyncio.Task]] = {}  # request id -> (route, task)
+        self._lock = threading.Lock()
+        self._ids = 0
+        self._loop_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> bool:
+        return self.session is not None and self.session.active
+
+    def start(self, seconds: float, routes: List[str] = (), sample_rate: float = 1.0,
+              interval_ms: float = PROFILE_INTERVAL_MS) -> dict:
+        """ Opens a session (replacing the last one's data); ValueError if one is running """
+        if self.active:
+            raise ValueError("A profiling session is already running")
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"seconds must be in (0, {PROFILE_MAX_SECONDS:.0f}]")
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1]")
+        if interval_ms < 1:
+            raise ValueError("interval_ms must be >= 1")
+        self._loop_thread = threading.get_ident()
+        self.session = ProfileSession(seconds, list(routes), sample_rate, interval_ms)
+        self._thread = threading.Thread(target=self._sample_loop, args=(self.session,),
+                                        name="profiler", daemon=True)
+        self._thread.start()
+        print(f"🔬 Profiling {self.session.report()['routes']} at {sample_rate:.0%} for {seconds:.0f}s")
+        return self.session.report()
+
+    def stop(self) -> Optional[dict]:
+        session = self.session
+        if session is None:
+            return None
+        if session.stopped_at is None:
+            session.stopped_at = time.time()
+        return session.report()
+
+    @contextmanager
+    def track(self, route: str):
+        """ Profiles the current task for the block if the session selects it (else a no-op) """
+        session = self.session
+        if (session is None or not session.active or (session.routes and route not in session.routes)
+                or random.random() >= session.sample_rate):
+            yield
+            return
+        with self._lock:
+            self._ids += 1
+            request_id = self._ids
+            self._tracked[request_id] = (route, asyncio.current_task())
+            session.requests += 1
+        token = _profile_owner.set(request_id)
+        try:
+            yield
+        finally:
+            _profile_owner.reset(token)
+            with self._lock:
+                self._tracked.pop(request_id, None)
+
+    # ---------- sampler thread ----------
+    def _sample_loop(self, session: ProfileSession):
+        while session.active:
+            started = time.perf_counter()
+            try:
+                self._sample(session)
+            except Exception as e:  # a racing frame must never kill the sampler
+                print(f"⚠️ Profiler sample skipped: {e}")
+            busy = time.perf_counter() - started
+            session.sampler_seconds += busy
+            session.ticks += 1
+            time.sleep(max(0.0, session.interval - busy))
+        if session.stopped_at is None:
+            session.stopped_at = time.time()
+        print(f"🔬 Profiling finished: {session.samples} samples from {session.requests} requests")
+
+    def _sample(self, session: ProfileSession):
+        with self._lock:
+            tracked = list(self._tracked.values())
+        if not tracked:
+            return
+        thread_frames = sys._current_frames()
+        loop_frame = thread_frames.get(self._loop_thread)
+        loop_stack = _thread_stack(loop_frame) if loop_frame is not None else []
+        pool_threads: Dict[asyncio.Task, List[int]] = {}
+        for ident, owner in list(_thread_owners.items()):
+            if ident in thread_frames:
+                pool_threads.setdefault(owner, []).append(ident)
+
+        for route, task in tracked:
+            if task is not None and not task.done():
+                for labels in self._task_stacks(task, [], loop_stack, thread_frames, pool_threads):
+                    self._count(session, route, labels)
+
+    def _task_stacks(self, task, prefix, loop_stack, thread_frames, pool_threads, depth: int = 0) -> List[List[str]]:
+        """ One stack per place the task is waiting (gather branches and pool threads each count) """
+        frames, awaiting = _await_chain(task)
+        if frames and awaiting is None:
+            # Running right now: the loop thread holds the real frames below the task's coroutine
+            for i, frame in enumerate(loop_stack):
+                if frame is frames[-1]:
+                    frames = frames[:-1] + loop_stack[i:]
+                    break
+        labels = prefix + [_frame_label(f) for f in frames]
+
+        children = getattr(awaiting, "_children", None)  # asyncio.gather over coroutines
+        if children and depth < 4:
+            stacks = []
+            for child in children:
+                if isinstance(child, asyncio.Task) and not child.done():
+                    stacks += self._task_stacks(child, labels, loop_stack, thread_frames, pool_threads, depth + 1)
+            if stacks:
+                return stacks
+        if task in pool_threads:
+            return [labels + ["[thread pool]"] + [_frame_label(f) for f in _thread_stack(thread_frames[ident])]
+                    for ident in pool_threads[task]]
+        if awaiting is not None:
+            labels.append(f"<await {type(awaiting).__name__}>")
+        return [labels]
+
+    @staticmethod
+    def _count(session: ProfileSession, route: str, labels: List[str]):
+        key = (route, tuple(labels))
+        session.stacks[key] = session.stacks.get(key, 0) + 1
+        session.samples += 1
+
+    # ---------- output ----------
+    def collapsed(self) -> str:
+        """ Brendan Gregg's folded format: route;frame;...;leaf count """
+        session = self.session
+        if session is None:
+            return ""
+        lines = [";".join((route,) + stack) + f" {count}" for (route, stack), count in sorted(session.stacks.items())]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def speedscope(self) -> dict:
+        """ speedscope file format: one sampled profile per route, weights in milliseconds """
+        session = self.session
+        frames: List[dict] = []
+        index: Dict[str, int] = {}
+        profiles: Dict[str, dict] = {}
+        if session is not None:
+            weight = session.interval * 1000
+            for (route, stack), count in sorted(session.stacks.items()):
+                ids = []
+                for label in stack:
+                    if label not in index:
+                        index[label] = len(frames)
+                        name, _, where = label.partition(" (")
+                        file, _, line = where.rstrip(")").rpartition(":")
+                        frame = {"name": name}
+                        if file:
+                            frame.update(file=file, line=int(line) if line.isdigit() else None)
+                        frames.append(frame)
+                    ids.append(index[label])
+                profile = profiles.setdefault(route, {
+                    "type": "sampled", "name": route, "unit": "milliseconds",
+                    "startValue": 0, "endValue": 0, "samples": [], "weights": [],
+                })
+                profile["samples"].append(ids)
+                profile["weights"].append(count * weight)
+                profile["endValue"] += count * weight
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+            "name": "ai_server wall-clock profile",
+            "activeProfileIndex": 0,
+            "exporter": "ai_server profiling.py",
+        }
+
+    def stats(self) -> dict:
+        return self.session.report() if self.session is not None else {"active": False}
+
+
+class ProfiledRequests:
+    """ ASGI middleware placed inside the request instrumentation: it runs in the task that
+    runs the endpoint, which is the one the sampler must walk """
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.active:
+            return await self.app(scope, receive, send)
+        with self.profiler.track(current_endpoint()):
+            return await self.app(scope, receive, send)
+
+
+class SlowRequestLog:
+    """ Bounded ring buffer of requests slower than the threshold """
+
+    def __init__(self, threshold_seconds: float = SLOW_REQUEST_SECONDS, size: int = SLOW_REQUEST_BUFFER):
+        self.threshold = threshold_seconds
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.captured = 0
+
+    def maybe_record(self, elapsed: float, endpoint: str, **details) -> bool:
+        if elapsed < self.threshold:
+            return False
+        entry = {"endpoint": endpoint, "at": time.time(), "total_ms": round(elapsed * 1000, 1), **details}
+        with self._lock:
+            self._entries.append(entry)
+            self.captured += 1
+        return True
+
+    def entries(self, limit: int = 50, endpoint: Optional[str] = None) -> List[dict]:
+        """ Newest first """
+        with self._lock:
+            chosen = [e for e in reversed(self._entries) if endpoint is None or e["endpoint"] == endpoint]
+        return chosen[:limit]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"threshold_s": self.threshold, "buffered": len(self._entries),
+                    "capacity": self._entries.maxlen, "captured": self.captured}
@@ -0,0 +1,214 @@
+import os
+import re
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+from metrics import UPSTREAM_RETRIES, current_endpoint, stage
+
+# ==========================================
+# UPSTREAM QUOTA GOVERNOR
+# ==========================================
+# Every Gemini generate/embed call goes through here:
+#   - per-model token buckets for requests/min and tokens/min
+#   - a priority queue in front of each model (urgent triage first)
+#   - jittered exponential backoff that honours retry-after hints
+#   - a shared pause on 429 so all callers back off together
+
+PRIORITY_URGENT = 0       # red-flag triage
+PRIORITY_INTERACTIVE = 1  # doctor waiting on the screen (vision, corrections)
+PRIORITY_ROUTINE = 2      # normal triage / batch triage
+PRIORITY_BACKGROUND = 3   # archiving, reinforcement, learned-rule embeddings
+
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1.0"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30.0"))
+
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258  # Gemini bills a standard image at ~258 tokens
+WAIT_SAMPLES = 1024
+
+
+def is_retryable_error(e: Exception) -> bool:
+    code = getattr(e, "code", None)
+    return code in (429, 503) or "503" in str(e) or "429" in str(e)
+
+
+def retry_after_hint(e: Exception) -> Optional[float]:
+    """ Extracts a server-suggested delay (Retry-After header or RetryInfo.retryDelay) """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    match = re.search(r"retry[_ ]?delay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(e), re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def estimate_tokens(contents) -> int:
+    """ Cheap token estimate for TPM accounting (text chars / 4, flat cost per image) """
+    if isinstance(contents, str):
+        return max(1, len(contents) // CHARS_PER_TOKEN)
+    if isinstance(contents, (list, tuple)):
+        return max(1, sum(estimate_tokens(c) for c in contents))
+    return IMAGE_TOKENS
+
+
+class TokenBucket:
+    """ Continuous-refill token bucket; capacity is one minute's allowance """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class _ModelLane:
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queue = []
+        self.pump_task = None
+        self.paused_until = 0.0
+        self.granted = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+
+class QuotaGovernor:
+    """ Central admission control for upstream model calls """
+
+    def __init__(self, default_rpm: float = 60, default_tpm: float = 1_000_000,
+                 max_attempts: int = GEMINI_MAX_ATTEMPTS):
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_attempts = max_attempts
+        self._limits: Dict[str, tuple] = {}
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._seq = itertools.count()
+
+    def configure(self, model: str, rpm: float, tpm: float):
+        self._limits[model] = (rpm, tpm)
+        self._lanes.pop(model, None)
+
+    def _lane(self, model: str) -> _ModelLane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            rpm, tpm = self._limits.get(model, (self.default_rpm, self.default_tpm))
+            lane = self._lanes[model] = _ModelLane(rpm, tpm)
+        return lane
+
+    # ---------- admission ----------
+    async def acquire(self, model: str, est_tokens: int = 1, priority: int = PRIORITY_ROUTINE):
+        """ Waits in the model's priority queue until both buckets allow the call """
+        lane = self._lane(model)
+        waiter = asyncio.get_running_loop().create_future()
+        enqueued = time.monotonic()
+        heapq.heappush(lane.queue, (priority, next(self._seq), est_tokens, waiter))
+        if lane.pump_task is None or lane.pump_task.done():
+            lane.pump_task = asyncio.create_task(self._pump(lane))
+        await waiter
+        lane.waits.append(time.monotonic() - enqueued)
+
+    async def _pump(self, lane: _ModelLane):
+        while lane.queue:
+            priority, seq, est_tokens, waiter = lane.queue[0]
+            if waiter.done():
+                heapq.heappop(lane.queue)
+                continue
+            delay = max(
+                lane.paused_until - time.monotonic(),
+                lane.requests.time_until(1),
+                lane.tokens.time_until(est_tokens),
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(lane.queue)
+            lane.requests.consume(1)
+            lane.tokens.consume(est_tokens)
+            lane.granted += 1
+            waiter.set_result(None)
+
+    # ---------- execution ----------
+    def backoff_delay(self, attempt: int, e: Exception) -> float:
+        hint = retry_after_hint(e)
+        if hint is not None:
+            return hint + random.uniform(0, GEMINI_BACKOFF_BASE)
+        ceiling = min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(ceiling / 2, ceiling)
+
+    async def call(self, model: str, fn: Callable[[], Awaitable], est_tokens: int = 1,
+                   priority: int = PRIORITY_ROUTINE):
+        """ Runs fn() under the model's quota, retrying 429/503 with backoff """
+        lane = self._lane(model)
+        for attempt in range(self.max_attempts):
+            with stage("quota_wait"):
+                await self.acquire(model, est_tokens, priority)
+            try:
+                return await fn()
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == self.max_attempts - 1:
+                    lane.failures += 1
+                    raise
+                delay = self.backoff_delay(attempt, e)
+                lane.retries += 1
+                UPSTREAM_RETRIES.inc(endpoint=current_endpoint(), model=model)
+                if getattr(e, "code", None) == 429 or "429" in str(e):
+                    # Adaptive: the whole lane waits, not just this caller
+                    lane.throttled += 1
+                    lane.paused_until = max(lane.paused_until, time.monotonic() + delay)
+                print(f"⚠️ {model} attempt {attempt + 1} failed ({e}). Backing off {delay:.1f}s")
+                with stage("backoff"):
+                    await asyncio.sleep(delay)
+
+    # ---------- reporting ----------
+    def stats(self) -> dict:
+        report = {}
+        for model, lane in self._lanes.items():
+            waits = sorted(lane.waits)
+            report[model] = {
+                "queue_depth": sum(1 for item in lane.queue if not item[3].done()),
+                "granted": lane.granted,
+                "retries": lane.retries,
+                "throttled_429": lane.throttled,
+                "failures": lane.failures,
+                "paused_for_s": round(max(0.0, lane.paused_until - time.monotonic()), 3),
+                "rpm_available": round(lane.requests.tokens, 1),
+                "tpm_available": round(lane.tokens.tokens, 1),
+                "wait_ms": {
+                    "p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                    "p95": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+                    "max": round(waits[-1] * 1000, 1) if waits else 0.0,
+                },
+            }
+        return report
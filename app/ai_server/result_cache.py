@@ -0,0 +1,123 @@
+import os
+import copy
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# ==========================================
+# SINGLE-FLIGHT + RESULT CACHE
+# ==========================================
+# Identical triage / vision requests share one in-flight generation, and
+# finished results are kept in an LRU keyed by a canonical hash of the prompt
+# inputs. Keys carry the memory version of the collections the prompt reads,
+# so any write to those collections makes old entries unreachable.
+# A leader cancelled mid-flight (client disconnect, timeout) does not cancel
+# its followers: the flight fails with LeaderCancelled and the first waiter
+# to wake up takes over the computation for the rest.
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))  # seconds, 0 = never expire
+
+
+def canonical_hash(*parts: Any) -> str:
+    """ Order-independent (for dict keys) sha256 over JSON-able request inputs """
+    blob = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LeaderCancelled(Exception):
+    """ The request computing a shared result was cancelled; a waiter takes over """
+
+
+class ResultCache:
+    """ LRU/TTL cache with single-flight coalescing of concurrent misses """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl_seconds: float = RESULT_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.stores = 0
+        self.leaders_cancelled = 0
+
+    def peek(self, key: str) -> Optional[Any]:
+        """ Returns a copy of a fresh cached result (counts as a hit) or None """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        if self.ttl_seconds > 0 and time.time() - stored_at > self.ttl_seconds:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(value)
+
+    def store(self, key: str, value: Any):
+        self._entries[key] = (copy.deepcopy(value), time.time())
+        self._entries.move_to_end(key)
+        self.stores += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """ Cache hit -> copy; identical request in flight -> wait for it; else compute once """
+        waited = False
+        while True:
+            cached = self.peek(key)
+            if cached is not None:
+                return cached
+
+            flight = self._inflight.get(key)
+            if flight is None:
+                break
+            if not waited:
+                self.coalesced += 1
+                waited = True
+            try:
+                return copy.deepcopy(await asyncio.shield(flight))
+            except LeaderCancelled:
+                continue  # the first waiter back finds no flight and leads; the others follow it
+
+        self.misses += 1
+        flight = asyncio.get_running_loop().create_future()
+        self._inflight[key] = flight
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            self.leaders_cancelled += 1
+            flight.set_exception(LeaderCancelled(key))
+            flight.exception()
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            flight.exception()  # mark retrieved so lone failures don't warn
+            raise
+        else:
+            self.store(key, value)
+            flight.set_result(value)
+            return copy.deepcopy(value)
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "leaders_cancelled": self.leaders_cancelled,
+            "in_flight": len(self._inflight),
+            "stores": self.stores,
+            "generations_saved": self.hits + self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,142 @@
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# ==========================================
+# RULE REGISTRY
+# ==========================================
+# Every rule is shown to the model with its Chroma ID ("[senior_rule_003] ..."),
+# and cited_rules carries those IDs back. Reinforcement then resolves a
+# citation with a dict lookup instead of an embed + ANN round trip. Free-text
+# citations (older stored triage responses) still resolve by normalized text.
+# Confidence bumps are atomic increments applied by the store in one write,
+# so concurrent agreements (or workers) can't overwrite each other's counts.
+# Rules folded into another by the compactor stay citable: the survivor's
+# "merged_from" metadata maps their old IDs onto it.
+
+CONFIDENCE_STEP = 0.1
+
+_ID_TAG = re.compile(r"\[([A-Za-z0-9_.:-]+)\]")
+_DECORATIONS = re.compile(
+    r"^\s*(?:[-*•]\s*|!!!\s*critical:?\s*)*|\s*\((?:conf:\s*[\d.]+|learned correction)\)\s*$",
+    re.IGNORECASE,
+)
+
+
+def normalize_rule_text(text: str) -> str:
+    """ Case/whitespace-insensitive key; strips the list bullets and tags the prompt adds """
+    text = _ID_TAG.sub(" ", str(text))
+    text = _DECORATIONS.sub("", text)
+    return " ".join(text.lower().split()).rstrip(" .;")
+
+
+class RuleRegistry:
+    """ id -> rule and normalized text -> id, kept in step with the rule collection """
+
+    def __init__(self):
+        self._rules: Dict[str, dict] = {}   # id -> {"document": str, "metadata": dict}
+        self._by_text: Dict[str, str] = {}
+        self._aliases: Dict[str, str] = {}  # merged-away id -> surviving id
+        self.ready = False
+        self.reinforced = 0
+
+    def __len__(self):
+        return len(self._rules)
+
+    # ---------- mirror hooks (same interface as LocalShadow) ----------
+    def rebuild(self, ids, documents, metadatas):
+        self._rules.clear()
+        self._by_text.clear()
+        self._aliases.clear()
+        self.ready = True
+        self.on_upsert(ids, documents, metadatas)
+
+    def on_upsert(self, ids, documents=None, metadatas=None):
+        for i, rule_id in enumerate(ids):
+            document = documents[i] if documents is not None else self._document(rule_id)
+            metadata = dict(metadatas[i] or {}) if metadatas is not None else {}
+            self._forget_text(rule_id)
+            self._rules[rule_id] = {"document": document, "metadata": metadata}
+            if document:
+                self._by_text[normalize_rule_text(document)] = rule_id
+            self._alias(rule_id, metadata)
+
+    def on_update(self, ids, documents=None, metadatas=None):
+        for i, rule_id in enumerate(ids):
+            rule = self._rules.get(rule_id)
+            if rule is None:
+                continue
+            if documents is not None:
+                self._forget_text(rule_id)
+                rule["document"] = documents[i]
+                self._by_text[normalize_rule_text(documents[i])] = rule_id
+            if metadatas is not None:
+                rule["metadata"].update(metadatas[i] or {})
+                self._alias(rule_id, rule["metadata"])
+
+    def on_delete(self, ids):
+        for rule_id in ids or []:
+            self._forget_text(rule_id)
+            self._rules.pop(rule_id, None)
+
+    def _alias(self, rule_id: str, metadata: dict):
+        for old_id in str(metadata.get("merged_from") or "").split(","):
+            if old_id:
+                self._aliases[old_id] = rule_id
+
+    def _document(self, rule_id: str) -> Optional[str]:
+        rule = self._rules.get(rule_id)
+        return rule["document"] if rule else None
+
+    def _forget_text(self, rule_id: str):
+        document = self._document(rule_id)
+        if document and self._by_text.get(normalize_rule_text(document)) == rule_id:
+            del self._by_text[normalize_rule_text(document)]
+
+    # ---------- lookup ----------
+    def get(self, rule_id: str) -> Optional[dict]:
+        return self._rules.get(rule_id)
+
+    def lookup(self, citation: str) -> Optional[str]:
+        """ Rule ID for a citation: an exact or merged-away ID, an embedded [ID] tag, or the rule's text """
+        citation = str(citation).strip()
+        for candidate in [citation] + _ID_TAG.findall(citation):
+            if candidate in self._rules:
+                return candidate
+            if self._aliases.get(candidate) in self._rules:
+                return self._aliases[candidate]
+        return self._by_text.get(normalize_rule_text(citation))
+
+    def resolve(self, citations: List[str]) -> Tuple[List[str], List[str]]:
+        """ Splits citations into (unique rule IDs, strings that matched nothing) """
+        rule_ids, unresolved = [], []
+        for citation in citations:
+            rule_id = self.lookup(citation)
+            if rule_id is None:
+                unresolved.append(citation)
+            elif rule_id not in rule_ids:
+                rule_ids.append(rule_id)
+        return rule_ids, unresolved
+
+    def canonicalize(self, citations: List[str]) -> List[str]:
+        """ Rewrites model citations to rule IDs where possible, keeping unknown ones verbatim """
+        seen, result = set(), []
+        for citation in citations:
+            value = self.lookup(citation) or citation
+            if value not in seen:
+                seen.add(value)
+                result.append(value)
+        return result
+
+    # ---------- reinforcement ----------
+    async def reinforce(self, collection, rule_ids: List[str], step: float = CONFIDENCE_STEP) -> List[str]:
+        """ Bumps confidence/usage_count once per occurrence of each ID, in a single collection write """
+        counts = Counter(rule_id for rule_id in rule_ids if rule_id in self._rules)
+        rule_ids = list(counts)
+        if not rule_ids:
+            return []
+        await collection.increment(
+            rule_ids, [{"confidence": step * counts[r], "usage_count": counts[r]} for r in rule_ids]
+        )
+        self.reinforced += len(rule_ids)
+        return rule_ids
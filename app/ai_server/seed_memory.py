@@ -1,15 +1,15 @@
-import chromadb
-from google import genai
-import os
-from dotenv import load_dotenv
-
-# 1. Setup
-load_dotenv()
-API_KEY = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=API_KEY)
-
-chroma_client = chromadb.PersistentClient(path="./ai_memory")
-collection = chroma_client.get_or_create_collection(name="triage_pearls")
+from seeding import corpus_sources, run_seed, seed_parser
+
+# 1. Setup (embedding + incremental upsert live in seeding.py; re-runs only pay for new/changed rules)
+SOURCE = "seed_memory.py"
+ID_PREFIX = "senior_rule_"
+RULE_METADATA = {
+    "type": "master_rule",
+    "confidence": 1.0,
+    "priority": "standard",
+    "usage_count": 0,
+    "author": "Senior_Neurosurgeon_Protocol"
+}
 
 # 2. "SENIOR NEUROSURGEON" LOGIC RULES
 doctor_rules = [
@@ -48,42 +48,10 @@ doctor_rules = [
     "Reporting: If pain > 6 weeks -> Label as 'Sub-acute', justifying MRI over X-ray."
 ]
 
-print(f"🧠 Seeding {len(doctor_rules)} Senior Neurosurgeon rules...")
-
-ids = []
-documents = []
-embeddings = []
-metadatas = []
-
-for i, rule in enumerate(doctor_rules):
-    # Create Embedding
-    result = client.models.embed_content(
-        model="models/text-embedding-004",  # <--- CHANGED TO MATCH MAIN.PY
-        contents=rule
-    )
-    vector = result.embeddings[0].values
-    
-    rule_id = f"senior_rule_{str(i+1).zfill(3)}"
-    
-    ids.append(rule_id)
-    documents.append(rule)
-    embeddings.append(vector)
-    
-    # Metadata for weighting
-    metadatas.append({
-        "type": "master_rule",
-        "confidence": 1.0, 
-        "priority": "standard",
-        "usage_count": 0,
-        "author": "Senior_Neurosurgeon_Protocol"
-    })
-
-# Add to DB
-collection.add(
-    ids=ids,
-    documents=documents,
-    embeddings=embeddings,
-    metadatas=metadatas
-)
-
-print("✅ Success! Your Institutional Memory is active.")
\ No newline at end of file
+if __name__ == "__main__":
+    args = seed_parser("Seed the Senior Neurosurgeon rules into triage_pearls").parse_args()
+    print(f"🧠 Seeding {len(doctor_rules)} Senior Neurosurgeon rules...")
+    run_seed("triage_pearls",
+             [(SOURCE, doctor_rules, ID_PREFIX, RULE_METADATA)] + corpus_sources(args.corpus, RULE_METADATA),
+             args)
+    print("✅ Success! Your Institutional Memory is active.")
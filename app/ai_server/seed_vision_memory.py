@@ -1,17 +1,13 @@
-import chromadb
-import os
-from google import genai
-from dotenv import load_dotenv
+from seeding import corpus_sources, run_seed, seed_parser
 
-# 1. SETUP
-load_dotenv()
-API_KEY = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=API_KEY)
-EMBEDDING_MODEL = "models/text-embedding-004"
-
-# Connect to DB (Same path as your text bot to keep memory unified)
-chroma_client = chromadb.PersistentClient(path="./ai_memory")
-correction_collection = chroma_client.get_or_create_collection(name="visual_corrections")
+# 1. SETUP (same store as the text bot to keep memory unified; seeding.py skips unchanged rules)
+SOURCE = "seed_vision_memory.py"
+ID_PREFIX = "gold_vision_rule_"
+RULE_METADATA = {
+    "type": "gold_standard",
+    "category": "radiology_pearls",
+    "author": "Expert_Curated_Dataset"
+}
 
 # 2. THE GOLD STANDARD RULES (50 Expert Radiology Pearls)
 rules = [
@@ -72,39 +68,10 @@ rules = [
     "CLINICAL CORRELATION: Bilateral wasting of Extensor Digitorum Brevis (EDB) muscle is a strong sign of underlying L5 radiculopathy/stenosis."
 ]
 
-print(f"🧠 Seeding {len(rules)} Gold Standard Radiology Rules...")
-
-# 3. EMBED & STORE
-ids = []
-documents = []
-embeddings = []
-metadatas = []
-
-for i, rule in enumerate(rules):
-    # Create Embedding
-    result = client.models.embed_content(
-        model=EMBEDDING_MODEL,
-        contents=rule
-    )
-    vector = result.embeddings[0].values
-    
-    rule_id = f"gold_vision_rule_{str(i+1).zfill(3)}"
-    
-    ids.append(rule_id)
-    documents.append(rule)
-    embeddings.append(vector)
-    metadatas.append({
-        "type": "gold_standard", 
-        "category": "radiology_pearls",
-        "author": "Expert_Curated_Dataset"
-    })
-
-# Add to DB (Batch add is more efficient)
-correction_collection.add(
-    ids=ids,
-    documents=documents,
-    embeddings=embeddings,
-    metadatas=metadatas
-)
-
-print(f"✅ Success! {len(rules)} rules injected into Visual Memory.")
\ No newline at end of file
+if __name__ == "__main__":
+    args = seed_parser("Seed the Gold Standard radiology rules into visual_corrections").parse_args()
+    print(f"🧠 Seeding {len(rules)} Gold Standard Radiology Rules...")
+    run_seed("visual_corrections",
+             [(SOURCE, rules, ID_PREFIX, RULE_METADATA)] + corpus_sources(args.corpus, RULE_METADATA),
+             args)
+    print(f"✅ Success! {len(rules)} rules injected into Visual Memory.")
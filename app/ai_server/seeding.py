@@ -0,0 +1,304 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from concurrency import run_blocking
+from quota_governor import PRIORITY_BACKGROUND, QuotaGovernor, estimate_tokens
+
+# ==========================================
+# INCREMENTAL RULE SEEDING
+# ==========================================
+# Shared pipeline behind seed_memory.py, seed_vision_memory.py and external
+# rule corpora. Every seeded row carries the sha256 of its text, the model
+# that embedded it and the source it came from, so a re-run:
+#   - skips rules whose text and embedding model are unchanged (zero calls)
+#   - embeds only new/changed rules, in batched requests, N batches at a time
+#   - upserts finished vectors in chunks while later batches are still in flight
+#   - deletes rows of that source whose rule is no longer in the list
+# Reinforced fields (confidence / usage_count) are never reset by a re-seed.
+# New rules get content-derived IDs ("senior_rule_<hash>"); rows written by the
+# old numbered scripts ("senior_rule_001") are adopted in place by prefix + text, so
+# existing citations and counters keep pointing at them.
+#
+#     python seed_memory.py                             # bundled Senior Neurosurgeon rules
+#     python seed_memory.py --corpus pearls.csv         # + an external corpus, same collection
+#     python seeding.py pearls.jsonl --collection triage_pearls --type master_rule
+
+SEED_EMBED_BATCH_SIZE = int(os.getenv("SEED_EMBED_BATCH_SIZE", "100"))   # texts per embed request
+SEED_EMBED_CONCURRENCY = int(os.getenv("SEED_EMBED_CONCURRENCY", "4"))   # embed requests in flight
+SEED_UPSERT_CHUNK = int(os.getenv("SEED_UPSERT_CHUNK", "500"))           # rows per Chroma upsert
+EMBEDDING_MODEL = "models/text-embedding-004"
+LEGACY_EMBEDDING_MODEL = EMBEDDING_MODEL  # what rows seeded before the model was recorded used
+
+LIVE_FIELDS = ("confidence", "usage_count")  # reinforced at runtime, kept across re-seeds
+TEXT_COLUMNS = ("text", "rule", "document")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+def seed_rule_id(prefix: str, digest: str) -> str:
+    return f"{prefix}{digest[:16]}"
+
+
+# ---------- corpora ----------
+def load_corpus(path: str) -> List[dict]:
+    """ Reads [{"text", "metadata"}] from .txt (one rule per line), .json, .jsonl or .csv """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, encoding="utf-8", newline="" if ext == ".csv" else None) as f:
+        if ext == ".txt":
+            items = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        elif ext == ".jsonl":
+            items = [json.loads(line) for line in f if line.strip()]
+        elif ext == ".json":
+            items = json.load(f)
+        elif ext == ".csv":
+            items = list(csv.DictReader(f))
+        else:
+            raise ValueError(f"Unsupported corpus format: {path} (use .txt, .json, .jsonl or .csv)")
+    return [_corpus_rule(item, path) for item in items]
+
+
+def _corpus_rule(item, path: str) -> dict:
+    if isinstance(item, str):
+        return {"text": item, "metadata": {}}
+    item = dict(item)
+    text_key = next((k for k in TEXT_COLUMNS if item.get(k)), None)
+    if text_key is None:
+        raise ValueError(f"{path}: rule without a text/rule/document field: {item}")
+    text = item.pop(text_key)
+    metadata = item.pop("metadata", None) or item  # nested object, or the remaining columns
+    return {"text": text, "metadata": {k: v for k, v in metadata.items() if v not in (None, "")}}
+
+
+# ---------- planning ----------
+class SeedPlan:
+    """ What a seed run has to do to make the store match a rule list """
+
+    def __init__(self):
+        self.embed: List[dict] = []     # {"id", "text", "metadata"} needing a (new) vector
+        self.touch: List[dict] = []     # {"id", "metadata"} with unchanged vectors, new seed metadata
+        self.delete: List[str] = []
+        self.unchanged = 0
+
+    def summary(self) -> dict:
+        return {"embed": len(self.embed), "touch": len(self.touch),
+                "delete": len(self.delete), "unchanged": self.unchanged}
+
+
+def plan_seed(existing: dict, source: str, rules: List[dict], prefix: str,
+              base_metadata: dict, embedding_model: str = EMBEDDING_MODEL) -> SeedPlan:
+    """ Diffs a rule list against collection.get(include=["documents", "metadatas"]) """
+    rows = {
+        row_id: {"document": document, "metadata": metadata or {}}
+        for row_id, document, metadata in zip(existing["ids"], existing["documents"], existing["metadatas"])
+    }
+    # Rows this source wrote before, by content hash. Rows from the numbered scripts
+    # carry no seed metadata yet; they are recognised by ID prefix and hashed here.
+    owned = {
+        row_id: row for row_id, row in rows.items()
+        if row["metadata"].get("seed_source", source if row_id.startswith(prefix) else None) == source
+    }
+    by_hash = {}
+    for row_id, row in owned.items():
+        digest = row["metadata"].get("content_hash") or content_hash(row["document"] or "")
+        by_hash.setdefault(digest, row_id)
+
+    plan, wanted = SeedPlan(), set()
+    for rule in rules:
+        text = rule["text"].strip()
+        digest = content_hash(text)
+        rule_id = by_hash.get(digest) or seed_rule_id(prefix, digest)
+        if rule_id in wanted:
+            continue  # duplicate entry in the source list
+        wanted.add(rule_id)
+        metadata = {**base_metadata, **rule.get("metadata", {}),
+                    "content_hash": digest, "embedding_model": embedding_model, "seed_source": source}
+        row = rows.get(rule_id)
+        if row is None:
+            plan.embed.append({"id": rule_id, "text": text, "metadata": metadata})
+            continue
+        stored = row["metadata"]
+        for field in LIVE_FIELDS:
+            if field in stored:
+                metadata[field] = stored[field]
+        stored_model = stored.get("embedding_model", LEGACY_EMBEDDING_MODEL)
+        if stored_model != embedding_model or (row["document"] or "").strip() != text:
+            plan.embed.append({"id": rule_id, "text": text, "metadata": metadata})
+        elif any(stored.get(k) != v for k, v in metadata.items()):
+            plan.touch.append({"id": rule_id, "metadata": metadata})
+        else:
+            plan.unchanged += 1
+
+    plan.delete = [row_id for row_id in owned if row_id not in wanted]
+    return plan
+
+
+# ---------- execution ----------
+async def embed_in_batches(texts: List[str], embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+                           on_batch: Callable[[int, List[List[float]]], Awaitable[None]],
+                           batch_size: int = SEED_EMBED_BATCH_SIZE, concurrency: int = SEED_EMBED_CONCURRENCY):
+    """ Embeds texts batch_size at a time with at most `concurrency` requests in flight """
+    gate = asyncio.Semaphore(concurrency)
+
+    async def run(start: int):
+        async with gate:
+            vectors = await embed_many(texts[start:start + batch_size])
+        await on_batch(start, vectors)
+
+    tasks = [asyncio.ensure_future(run(start)) for start in range(0, len(texts), batch_size)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # One batch failed: stop the rest, so no on_batch runs after we return
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def apply_plan(collection, plan: SeedPlan, embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+                     batch_size: int = SEED_EMBED_BATCH_SIZE, concurrency: int = SEED_EMBED_CONCURRENCY,
+                     chunk_size: int = SEED_UPSERT_CHUNK):
+    """ Embeds + upserts plan.embed, rewrites plan.touch metadata, deletes plan.delete """
+    pending: List[tuple] = []
+    write_lock = asyncio.Lock()
+
+    async def write(rows: List[tuple]):
+        await run_blocking(
+            collection.upsert,
+            ids=[r["id"] for r, _ in rows],
+            documents=[r["text"] for r, _ in rows],
+            embeddings=[list(v) for _, v in rows],
+            metadatas=[r["metadata"] for r, _ in rows],
+        )
+
+    async def on_batch(start: int, vectors: List[List[float]]):
+        # Upsert as soon as a chunk is ready: an interrupted run keeps what it paid for
+        pending.extend(zip(plan.embed[start:start + len(vectors)], vectors))
+        async with write_lock:
+            while len(pending) >= chunk_size:
+                await write(pending[:chunk_size])
+                del pending[:chunk_size]
+
+    try:
+        await embed_in_batches([r["text"] for r in plan.embed], embed_many, on_batch, batch_size, concurrency)
+    finally:
+        if pending:  # the partial last chunk, or whatever was embedded before a batch failed
+            await write(pending)
+    for start in range(0, len(plan.touch), chunk_size):
+        chunk = plan.touch[start:start + chunk_size]
+        await run_blocking(collection.update, ids=[r["id"] for r in chunk], metadatas=[r["metadata"] for r in chunk])
+    for start in range(0, len(plan.delete), chunk_size):
+        await run_blocking(collection.delete, ids=plan.delete[start:start + chunk_size])
+
+
+async def seed_collection(collection, source: str, rules: List, prefix: str, base_metadata: dict,
+                          embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+                          embedding_model: str = EMBEDDING_MODEL, prune: bool = True, dry_run: bool = False,
+                          batch_size: int = SEED_EMBED_BATCH_SIZE, concurrency: int = SEED_EMBED_CONCURRENCY,
+                          chunk_size: int = SEED_UPSERT_CHUNK) -> dict:
+    """ Brings one source's rules in a (blocking, Chroma-shaped) collection up to date """
+    rules = [r if isinstance(r, dict) else {"text": r, "metadata": {}} for r in rules]
+    rules = [r for r in rules if r["text"] and r["text"].strip()]
+    existing = await run_blocking(collection.get, include=["documents", "metadatas"])
+    plan = plan_seed(existing, source, rules, prefix, base_metadata, embedding_model)
+    if not prune:
+        plan.delete = []
+    if not dry_run:
+        await apply_plan(collection, plan, embed_many, batch_size, concurrency, chunk_size)
+    return plan.summary()
+
+
+def gemini_embedder(client, model: str = EMBEDDING_MODEL) -> Callable[[List[str]], Awaitable[List[List[float]]]]:
+    """ Batched embed calls through the quota governor (429/503 backoff, RPM/TPM ceilings) """
+    governor = QuotaGovernor()
+    governor.configure(
+        model,
+        rpm=float(os.getenv("GEMINI_EMBED_RPM", "1500")),
+        tpm=float(os.getenv("GEMINI_EMBED_TPM", "1000000")),
+    )
+
+    async def embed_many(texts: List[str]) -> List[List[float]]:
+        result = await governor.call(
+            model, lambda: client.aio.models.embed_content(model=model, contents=texts),
+            est_tokens=estimate_tokens(texts), priority=PRIORITY_BACKGROUND,
+        )
+        return [embedding.values for embedding in result.embeddings]
+
+    return embed_many
+
+
+# ---------- CLI ----------
+def corpus_prefix(path: str) -> str:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return "pearl_" + "".join(c if c.isalnum() else "_" for c in stem.lower()) + "_"
+
+
+def seed_parser(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--corpus", action="append", default=[],
+                        help="extra rule file (.txt/.json/.jsonl/.csv); repeatable")
+    parser.add_argument("--dry-run", action="store_true", help="report the plan without embedding or writing")
+    parser.add_argument("--no-prune", action="store_true", help="keep rows whose rule left the source")
+    parser.add_argument("--batch-size", type=int, default=SEED_EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=SEED_EMBED_CONCURRENCY)
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL)
+    return parser
+
+
+def run_seed(collection_name: str, sources: List[tuple], args: argparse.Namespace):
+    """ sources: [(source, rules, prefix, base_metadata)], all seeded into one collection """
+    from dotenv import load_dotenv
+    from google import genai
+    from memory_service import open_memory_client
+
+    load_dotenv()
+    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    collection = open_memory_client().get_or_create_collection(name=collection_name)
+    embed_many = gemini_embedder(client, args.embedding_model)
+
+    async def seed_all():
+        for source, rules, prefix, base_metadata in sources:
+            start = time.perf_counter()
+            summary = await seed_collection(
+                collection, source, rules, prefix, base_metadata, embed_many,
+                embedding_model=args.embedding_model, prune=not args.no_prune, dry_run=args.dry_run,
+                batch_size=args.batch_size, concurrency=args.concurrency,
+            )
+            print(f"{'📝 Plan' if args.dry_run else '✅ Seeded'} {source} -> {collection_name}: "
+                  f"{summary['embed']} embedded, {summary['touch']} metadata-only, "
+                  f"{summary['delete']} removed, {summary['unchanged']} unchanged "
+                  f"({time.perf_counter() - start:.1f}s)")
+
+    asyncio.run(seed_all())
+
+
+def corpus_sources(paths: List[str], base_metadata: dict, prefix: Optional[str] = None) -> List[tuple]:
+    return [(f"corpus:{os.path.basename(p)}", load_corpus(p), prefix or corpus_prefix(p), base_metadata)
+            for p in paths]
+
+
+def main():
+    parser = seed_parser("Seed an external rule corpus into a memory collection")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--collection", default="triage_pearls")
+    parser.add_argument("--prefix", help="ID prefix (default: pearl_<file stem>_)")
+    parser.add_argument("--type", default="master_rule", help="metadata 'type' for every rule")
+    parser.add_argument("--author", default="Institutional_Corpus")
+    args = parser.parse_args()
+
+    base_metadata: Dict[str, object] = {"type": args.type, "author": args.author}
+    if args.collection == "triage_pearls":
+        base_metadata.update({"confidence": 1.0, "priority": "standard", "usage_count": 0})
+    run_seed(args.collection, corpus_sources(args.files + args.corpus, base_metadata, args.prefix), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from metrics import registry
+from model_router import IncompleteOutput, SchemaError
+
+# ==========================================
+# STRUCTURED MODEL OUTPUT (PARSE, REPAIR, RE-ASK)
+# ==========================================
+# A model answer that is not exactly valid JSON used to cost the whole
+# generation (escalation / regeneration, else the hard-coded fallback).
+# Now, when the strict json.loads + Pydantic check fails:
+#   1. StreamingJSONParser reads the text field by field, the way it reads a
+#      streamed answer, and repairs what it can locally:
+#        leading_text / trailing_text   prose or ``` fences around the object
+#        unterminated_object            the closing brace never came
+#        unterminated_array / _value    a cut-off list (object) keeps its complete items
+#        missing_optional               absent optional keys get model defaults
+#      A top-level string or number cut off mid-value is dropped (half a
+#      diagnosis is worse than none) and counts as missing.
+#   2. Required fields still missing / invalid (and fields in reask_if_truncated
+#      when the answer was cut off or they are invalid) raise IncompleteOutput:
+#      the router asks the same model for just those keys and merges them in.
+#   3. Anything else, or more missing than received, is a SchemaError and
+#      escalates as before.
+# Steps 1 and 2 each count as a generation saved (ai_generations_saved_total).
+#
+# Streamed answers (vision jobs) are also fed through the parser chunk by
+# chunk, so each field is validated and reported as soon as it is complete.
+
+CLEAN, REPAIRED, REASKED, FAILED = "clean", "repaired", "reasked", "failed"
+
+STRUCTURED_OUTPUTS = registry.counter(
+    "ai_structured_outputs_total", "Model answers by how they became valid", ("kind", "outcome"))
+OUTPUT_REPAIRS = registry.counter(
+    "ai_output_repairs_total", "Local repairs applied to model answers", ("kind", "repair"))
+GENERATIONS_SAVED = registry.counter(
+    "ai_generations_saved_total", "Malformed answers used after local repair or a partial re-ask", ("kind", "via"))
+
+REASK_PROMPT = """
+[YOUR PREVIOUS ANSWER WAS INCOMPLETE]
+These fields were received and are kept as they are:
+{partial}
+[INSTRUCTION]
+Return ONLY a JSON object with the fields {missing}, as described in [OUTPUT JSON] above.
+Do not repeat the other fields.
+"""
+
+_CLOSERS = {"[": "]", "{": "}"}
+_WHITESPACE = " \t\r\n"
+
+
+class StreamingJSONParser:
+    """ Incremental reader of one top-level JSON object: each field is decoded as soon as it is complete """
+
+    def __init__(self, on_field: Optional[Callable[[str, Any], None]] = None):
+        self.on_field = on_field
+        self.fields: Dict[str, Any] = {}
+        self.repairs: List[str] = []
+        self.truncated = False
+        self._text = ""
+        self._pos = 0
+        self._state = "start"  # start -> key -> colon -> value -> (key | done)
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._key_start = 0
+        self._value_start: Optional[int] = None
+        self._open: List[list] = []  # containers open in the current value: [opener, safe cut index]
+
+    def feed(self, chunk: str):
+        self._text += chunk
+        text = self._text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._state == "done":
+                if c not in _WHITESPACE:
+                    self._note("trailing_text")
+                    break
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._state == "key":
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._state = "colon"
+                    elif self._open and self._open[-1][0] == "[":
+                        self._open[-1][1] = i + 1  # a complete string item
+                continue
+            if self._state == "start":
+                if c == "{":
+                    self._state = "key"
+                elif c not in _WHITESPACE:
+                    self._note("leading_text")
+            elif self._state == "key":
+                if c == '"':
+                    self._in_string, self._key_start = True, i
+                elif c == "}":
+                    self._state = "done"
+            elif self._state == "colon":
+                if c == ":":
+                    self._state, self._value_start = "value", None
+            elif self._state == "value":
+                self._scan_value(text, i, c)
+        self._pos = len(text)
+
+    def _scan_value(self, text: str, i: int, c: str):
+        if self._value_start is None:
+            if c in _WHITESPACE:
+                return
+            self._value_start = i
+        if c == '"':
+            self._in_string = True
+        elif c in _CLOSERS:
+            self._open.append([c, i + 1])
+        elif c in "]}":
+            if not self._open:
+                if c == "}":  # end of the object, after a scalar value
+                    self._emit(text[self._value_start:i])
+                    self._state = "done"
+                return
+            self._open.pop()
+            if self._open and self._open[-1][0] == "[":
+                self._open[-1][1] = i + 1  # a complete nested item
+        elif c == ",":
+            if not self._open:
+                self._emit(text[self._value_start:i])
+                self._state = "key"
+            else:
+                self._open[-1][1] = i
+
+    def _emit(self, raw: str):
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            return  # unparseable value: left out, so it reads as missing
+        self.fields[self._key] = value
+        if self.on_field is not None:
+            self.on_field(self._key, value)
+
+    def _note(self, repair: str):
+        if repair not in self.repairs:
+            self.repairs.append(repair)
+
+    def finish(self) -> "StreamingJSONParser":
+        """ End of the answer: closes what a truncated stream left open """
+        if self._state not in ("done", "start"):
+            self.truncated = True
+            self._note("unterminated_object")
+            if self._state == "value" and self._value_start is not None and not (self._in_string and not self._open):
+                raw = self._text[self._value_start:]
+                if self._open:
+                    # Cut back to the last complete item of the innermost list (a half item is dropped whole)
+                    lists = [depth for depth, (opener, _) in enumerate(self._open) if opener == "["]
+                    keep = self._open[:lists[-1] + 1] if lists else self._open
+                    raw = self._text[self._value_start:keep[-1][1]] + "".join(_CLOSERS[o] for o, _ in reversed(keep))
+                    if json.loads(raw) not in ([], {}):  # nothing complete survived: missing, not empty
+                        self._note("unterminated_array" if lists else "unterminated_value")
+                        self._emit(raw)
+                elif raw != raw.rstrip() or raw.strip() in ("true", "false", "null"):
+                    self._emit(raw)  # a scalar followed by whitespace is complete; "0.9" at the very end may not be
+        return self
+
+
+def read_json_object(text: str) -> StreamingJSONParser:
+    parser = StreamingJSONParser()
+    parser.feed(text or "")
+    return parser.finish()
+
+
+class StructuredOutput:
+    """ Pydantic-validated model answers, repaired locally or completed by a partial re-ask """
+
+    def __init__(self, kind: str, model: Type[BaseModel], reask_if_truncated: Tuple[str, ...] = ()):
+        self.kind = kind
+        self.model = model
+        self.required = tuple(name for name, field in model.model_fields.items() if field.is_required())
+        self.reask_if_truncated = reask_if_truncated  # optional fields still worth a re-ask if cut off
+        self._adapters = {name: TypeAdapter(field.annotation) for name, field in model.model_fields.items()}
+        self._lock = threading.Lock()
+        self.counts = {CLEAN: 0, REPAIRED: 0, REASKED: 0, FAILED: 0}
+        self.repairs: Dict[str, int] = {}
+
+    def field_error(self, name: str, value) -> Optional[str]:
+        """ Why one field's value does not validate (None if it does, or the field is unknown) """
+        adapter = self._adapters.get(name)
+        if adapter is None:
+            return None
+        try:
+            adapter.validate_python(value)
+        except ValidationError as e:
+            return e.errors()[0]["msg"]
+        return None
+
+    def stream(self, on_field: Callable[[str, Any, Optional[str]], None]) -> StreamingJSONParser:
+        """ A parser for one streamed answer, reporting (field, value, error) as each completes """
+        return StreamingJSONParser(lambda name, value: on_field(name, value, self.field_error(name, value)))
+
+    def parse(self, text: str) -> dict:
+        """ Valid dict, else IncompleteOutput (re-askable) or SchemaError """
+        try:
+            raw = json.loads(text)
+            if isinstance(raw, dict):
+                result = self._validate(raw)
+                self._count(CLEAN)
+                return result
+        except ValueError:  # JSON or Pydantic error: try the lenient reader
+            pass
+
+        parsed = read_json_object(text)
+        fields, repairs = dict(parsed.fields), list(parsed.repairs)
+        invalid = [name for name, value in fields.items() if self.field_error(name, value)]
+        for name in invalid:
+            del fields[name]
+        if not fields:
+            self._count(FAILED)
+            raise SchemaError("no usable JSON object in the answer")
+        missing = [name for name in self.required if name not in fields]
+        missing += [name for name in self.reask_if_truncated
+                    if name not in fields and (parsed.truncated or name in invalid)]
+        if len(missing) > len(fields):
+            self._count(FAILED)
+            raise SchemaError(f"missing {missing}: too little to re-ask for")
+        if missing:
+            raise IncompleteOutput(
+                f"missing {missing}" + (f", invalid {invalid}" if invalid else ""), missing,
+                REASK_PROMPT.format(partial=json.dumps(fields, indent=1), missing=missing),
+                lambda answer: self._complete(fields, missing, repairs, answer),
+            )
+        if invalid:
+            repairs.append("invalid_optional")
+        return self._accept(fields, repairs, REPAIRED)
+
+    def _complete(self, fields: dict, missing: List[str], repairs: List[str], answer: str) -> dict:
+        """ Merges the re-asked fields into the partial answer """
+        extra = read_json_object(answer).fields
+        merged = {**fields, **{name: extra[name] for name in missing if name in extra}}
+        return self._accept(merged, repairs, REASKED)
+
+    def _accept(self, fields: dict, repairs: List[str], outcome: str) -> dict:
+        if any(name not in fields for name in self.model.model_fields):
+            repairs = repairs + ["missing_optional"]
+        try:
+            result = self._validate(fields)
+        except ValidationError as e:
+            self._count(FAILED)
+            raise SchemaError(f"still invalid after {outcome}: {e.errors()[0]['msg']}")
+        self._count(outcome, repairs)
+        GENERATIONS_SAVED.inc(kind=self.kind, via="repair" if outcome == REPAIRED else "reask")
+        return result
+
+    def _validate(self, raw: dict) -> dict:
+        """ Model-validated fields (with defaults) over the raw dict, so unknown keys survive """
+        return {**raw, **self.model.model_validate(raw).model_dump()}
+
+    def _count(self, outcome: str, repairs: List[str] = ()):
+        STRUCTURED_OUTPUTS.inc(kind=self.kind, outcome=outcome)
+        with self._lock:
+            self.counts[outcome] += 1
+            for repair in repairs:
+                OUTPUT_REPAIRS.inc(kind=self.kind, repair=repair)
+                self.repairs[repair] = self.repairs.get(repair, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self.counts.values())
+            saved = self.counts[REPAIRED] + self.counts[REASKED]
+            return {
+                "answers": dict(self.counts),
+                "repairs": dict(self.repairs),
+                "generations_saved": saved,
+                "saved_rate": round(saved / total, 4) if total else 0.0,
+            }
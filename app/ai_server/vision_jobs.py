@@ -0,0 +1,461 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from concurrency import run_blocking
+from image_ingest import INGEST_CHUNK_BYTES, INGEST_MAX_FILE_BYTES, INGEST_MAX_FILES, INGEST_MAX_TOTAL_BYTES, IngestError
+from write_behind import _pid_alive
+
+# ==========================================
+# ASYNC VISION JOBS
+# ==========================================
+# POST /analyze_images/jobs spools the uploads to disk, records the job in a
+# local SQLite store and returns its ID at once; the caller's HTTP timeout no
+# longer has to cover the generation. A fixed pool of VISION_JOB_WORKERS tasks
+# runs ingest -> memory -> prompt -> model for queued jobs.
+#
+#   GET /jobs/{id}          status, current stage, result / error
+#   GET /jobs/{id}/events   Server-Sent Events: every stage transition, the
+#                           model's partial output as it streams, and each
+#                           answer field once it is complete and validated
+#
+# Stage transitions and results are persisted; streamed partial text is kept
+# in memory only, in the worker running the job. An SSE subscriber on any
+# other worker gets the persisted stages and the result by polling the store
+# every VISION_JOB_POLL_INTERVAL seconds while no live event arrives.
+#
+# Each job records the pid that owns it. On startup and every
+# VISION_JOB_ORPHAN_SWEEP seconds, unfinished jobs are re-queued from their
+# spooled files (same idea as the write-behind journal) when their owner is
+# no longer alive, or when the owner is this pid but the job is not in this
+# process's queue: a restarted container gets the same pid (uvicorn as pid
+# 1) as the process that left the jobs behind. So a restart loses no
+# submitted work. Finished jobs and their spool are pruned after
+# VISION_JOB_RETENTION seconds.
+
+VISION_JOB_STORE_PATH = os.getenv("VISION_JOB_STORE_PATH", "./vision_jobs.sqlite3")
+VISION_JOB_SPOOL_DIR = os.getenv("VISION_JOB_SPOOL_DIR", "./vision_jobs")
+VISION_JOB_WORKERS = int(os.getenv("VISION_JOB_WORKERS", "2"))
+VISION_JOB_QUEUE_MAX = int(os.getenv("VISION_JOB_QUEUE_MAX", "64"))
+VISION_JOB_RETENTION = float(os.getenv("VISION_JOB_RETENTION", str(24 * 3600)))  # seconds
+VISION_JOB_POLL_INTERVAL = float(os.getenv("VISION_JOB_POLL_INTERVAL", "1.0"))  # seconds, SSE store polling
+VISION_JOB_ORPHAN_SWEEP = float(os.getenv("VISION_JOB_ORPHAN_SWEEP", "30"))  # seconds between orphan checks
+PRUNE_INTERVAL = 600  # seconds between retention sweeps
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+TERMINAL = (SUCCEEDED, FAILED)
+PARTIAL_EVERY = 256  # chars of new model output between "partial" events
+DURATION_SAMPLES = 1024
+
+
+class JobQueueFull(Exception):
+    """ Too many jobs waiting; the caller should retry later (503) """
+
+
+class SpooledUpload:
+    """ A spooled file behind the slice of UploadFile that ingest_images uses (open it on the pool) """
+
+    def __init__(self, path: str, filename: str, content_type: Optional[str]):
+        self.file = open(path, "rb")
+        self.filename = filename
+        self.content_type = content_type
+
+    async def read(self, size: int = -1) -> bytes:
+        return await run_blocking(self.file.read, size)
+
+    async def seek(self, offset: int):
+        self.file.seek(offset)
+
+    def close(self):
+        self.file.close()
+
+
+class JobStore:
+    """ Durable job table (SQLite, WAL) shared by every worker on the host """
+
+    def __init__(self, path: str = VISION_JOB_STORE_PATH):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT, stage TEXT, stages TEXT, request TEXT, result TEXT, error TEXT,"
+            " created_at REAL, updated_at REAL, owner INTEGER)"
+        )
+        self._db.commit()
+        self.pid = os.getpid()
+
+    def create(self, job_id: str, request: dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, stage, stages, request, created_at, updated_at, owner)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, QUEUED, json.dumps([[QUEUED, now]]), json.dumps(request), now, now, self.pid),
+            )
+            self._db.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, status, stage, stages, request, result, error, created_at, updated_at FROM jobs"
+                " WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        id_, status, stage, stages, request, result, error, created_at, updated_at = row
+        return {
+            "id": id_, "status": status, "stage": stage, "stages": json.loads(stages),
+            "request": json.loads(request), "result": json.loads(result) if result else None, "error": error,
+            "created_at": created_at, "updated_at": updated_at,
+        }
+
+    def set_stage(self, job_id: str, stage: str, status: Optional[str] = None, at: Optional[float] = None):
+        now = at or time.time()
+        with self._lock:
+            (stages,) = self._db.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = json.loads(stages) + [[stage, now]]
+            self._db.execute(
+                "UPDATE jobs SET stage = ?, stages = ?, status = COALESCE(?, status), updated_at = ? WHERE id = ?",
+                (stage, json.dumps(stages), status, now, job_id),
+            )
+            self._db.commit()
+
+    def finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            (stages,) = self._db.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = json.loads(stages) + [[status, now]]
+            self._db.execute(
+                "UPDATE jobs SET status = ?, stage = ?, stages = ?, result = ?, error = ?, updated_at = ?"
+                " WHERE id = ?",
+                (status, status, json.dumps(stages), json.dumps(result) if result is not None else None,
+                 error, now, job_id),
+            )
+            self._db.commit()
+
+    def adopt_orphans(self, active: Callable[[str], bool] = lambda job_id: False) -> List[str]:
+        """ Re-queues unfinished jobs whose owner has exited, or that carry our pid but are not
+        active here (left by an earlier process with the same pid); returns their IDs (oldest first) """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, owner FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+            adopted = []
+            for id_, owner in rows:
+                if active(id_) or (owner != self.pid and _pid_alive(owner)):
+                    continue
+                # Only if still owned by the dead pid: another worker's sweep may have taken it meanwhile
+                taken = self._db.execute(
+                    "UPDATE jobs SET status = ?, stage = ?, owner = ? WHERE id = ? AND owner = ?",
+                    (QUEUED, QUEUED, self.pid, id_, owner),
+                ).rowcount
+                if taken:
+                    adopted.append(id_)
+            self._db.commit()
+            return adopted
+
+    def prune(self, older_than: float) -> List[str]:
+        """ Deletes finished jobs last touched before `older_than`; returns their IDs """
+        with self._lock:
+            doomed = [id_ for (id_,) in self._db.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (*TERMINAL, older_than)
+            ).fetchall()]
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(id_,) for id_ in doomed])
+            self._db.commit()
+            return doomed
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class JobProgress:
+    """ Handed to the job handler: reports stages and streamed model output """
+
+    def __init__(self, queue: "VisionJobQueue", job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+        self.partial = ""
+        self._published = 0
+
+    async def stage(self, name: str, **detail):
+        at = time.time()
+        await run_blocking(self.queue.store.set_stage, self.job_id, name, None, at)
+        self.queue._publish(self.job_id, "stage", {"stage": name, "at": at, **detail})
+
+    def text(self, chunk: str):
+        """ Model output chunk (sync: called from inside the generation loop) """
+        self.partial += chunk
+        if len(self.partial) - self._published >= PARTIAL_EVERY:
+            self.flush()
+
+    def flush(self):
+        if len(self.partial) > self._published:
+            self._published = len(self.partial)
+            self.queue._publish(self.job_id, "partial", {"text": self.partial})
+
+    def field(self, name: str, value, error: Optional[str] = None):
+        """ One top-level answer field, complete (error: why it fails validation) """
+        self.queue._publish(self.job_id, "field", {"field": name, "value": value, "valid": error is None,
+                                                   **({"error": error} if error else {})})
+
+    def restart(self, tier: str, reason: str):
+        """ A new model attempt (first call / escalation / quota retry): partial text starts over """
+        self.flush()
+        self.partial, self._published = "", 0
+        self.queue._partials.pop(self.job_id, None)  # a late subscriber must not get the abandoned text
+        self.queue._publish(self.job_id, "stage", {"stage": "model", "tier": tier, "reason": reason})
+
+
+class VisionJobQueue:
+    """ Persists vision jobs and runs them on a bounded pool of worker tasks """
+
+    def __init__(self, store: JobStore, handler: Callable[[dict, List[SpooledUpload], JobProgress], Awaitable[dict]],
+                 workers: int = VISION_JOB_WORKERS, spool_dir: str = VISION_JOB_SPOOL_DIR,
+                 max_queued: int = VISION_JOB_QUEUE_MAX):
+        self.store = store
+        self.handler = handler  # (patient_context, uploads, progress) -> result
+        self.workers = workers
+        self.spool_dir = spool_dir
+        self.max_queued = max_queued
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._sweeper: Optional[asyncio.Task] = None
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._partials: Dict[str, str] = {}  # latest streamed text of running jobs (late SSE subscribers)
+        self._active: set = set()  # job IDs queued or running in this process
+        self._durations = deque(maxlen=DURATION_SAMPLES)
+        self._last_prune = 0.0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._queue = asyncio.Queue()
+        await self._prune()
+        await self._adopt_orphans()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        tasks = self._tasks + ([self._sweeper] if self._sweeper is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks, self._sweeper = [], None
+
+    async def _adopt_orphans(self):
+        adopted = await run_blocking(self.store.adopt_orphans, self._active.__contains__)
+        for job_id in adopted:
+            self._active.add(job_id)
+            self._queue.put_nowait(job_id)
+        self.recovered += len(adopted)
+        if adopted:
+            print(f"🔁 Re-queued {len(adopted)} vision jobs left by an exited process")
+
+    async def _sweep(self):
+        """ Picks up jobs of workers that died after our start, and prunes finished ones """
+        while True:
+            await asyncio.sleep(VISION_JOB_ORPHAN_SWEEP)
+            try:
+                await self._adopt_orphans()
+                await self._prune()
+            except Exception as e:
+                print(f"⚠️ Vision job sweep failed: {e}")
+
+    # ---------- submission ----------
+    async def submit(self, patient_context: str, uploads) -> str:
+        """ Spools the uploads, persists the job and queues it; returns the job ID """
+        if self._queue is None:
+            raise RuntimeError("Vision job queue is not running")
+        if len(uploads) > INGEST_MAX_FILES:
+            raise IngestError(f"Too many files ({len(uploads)} > {INGEST_MAX_FILES})")
+        if self._queue.qsize() >= self.max_queued:
+            raise JobQueueFull(f"{self._queue.qsize()} vision jobs already waiting")
+        job_id = f"vjob_{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+        job_dir = os.path.join(self.spool_dir, job_id)
+        await run_blocking(os.makedirs, job_dir)
+        self._active.add(job_id)  # before the row exists, so a concurrent sweep never adopts it
+        try:
+            files = await self._spool(job_dir, uploads)
+            await run_blocking(self.store.create, job_id, {"patient_context": patient_context, "files": files})
+        except BaseException:  # rejected (caps), failed or cancelled: nothing may stay spooled
+            self._active.discard(job_id)
+            await run_blocking(shutil.rmtree, job_dir, True)
+            raise
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def _spool(self, job_dir: str, uploads) -> List[dict]:
+        """ Copies the uploads to disk chunk by chunk (writes on the pool), enforcing the ingest caps """
+        files, total = [], 0
+        for i, upload in enumerate(uploads):
+            path = os.path.join(job_dir, f"{i:03d}")
+            await upload.seek(0)
+            out = await run_blocking(open, path, "wb")
+            try:
+                size = 0
+                while True:
+                    chunk = await upload.read(INGEST_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    total += len(chunk)
+                    if size > INGEST_MAX_FILE_BYTES:
+                        raise IngestError(f"{upload.filename} exceeds {INGEST_MAX_FILE_BYTES / (1024 * 1024):.1f} MB")
+                    if total > INGEST_MAX_TOTAL_BYTES:
+                        raise IngestError(f"Upload exceeds {INGEST_MAX_TOTAL_BYTES / (1024 * 1024):.1f} MB in total")
+                    await run_blocking(out.write, chunk)
+            finally:
+                await run_blocking(out.close)
+            files.append({"path": path, "filename": upload.filename, "content_type": upload.content_type})
+        return files
+
+    # ---------- execution ----------
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # the store itself failed; the job stays queued for the next sweep
+                print(f"🔥 Vision job {job_id} could not be run: {e}")
+            finally:
+                self._active.discard(job_id)
+
+    async def _run(self, job_id: str):
+        job = await run_blocking(self.store.get, job_id)
+        if job is None or job["status"] in TERMINAL:
+            return
+        progress = JobProgress(self, job_id)
+        uploads = await run_blocking(lambda: [
+            SpooledUpload(f["path"], f["filename"], f["content_type"]) for f in job["request"]["files"]
+            if os.path.exists(f["path"])
+        ])
+        started = time.perf_counter()
+        self.running += 1
+        try:
+            at = time.time()
+            await run_blocking(self.store.set_stage, job_id, RUNNING, RUNNING, at)
+            self._publish(job_id, "stage", {"stage": RUNNING, "at": at})
+            result = await self.handler(json.loads(job["request"]["patient_context"]), uploads, progress)
+            progress.flush()
+            await run_blocking(self.store.finish, job_id, SUCCEEDED, result)
+            self.completed += 1
+            self._publish(job_id, "result", {"status": SUCCEEDED, "result": result}, final=True)
+        except asyncio.CancelledError:
+            raise  # shutdown: stays "running" under our pid, re-queued by the next process
+        except Exception as e:
+            await run_blocking(self.store.finish, job_id, FAILED, None, str(e))
+            self.failed += 1
+            self._publish(job_id, "result", {"status": FAILED, "error": str(e)}, final=True)
+        finally:
+            self.running -= 1
+            self._durations.append(time.perf_counter() - started)
+            for upload in uploads:
+                upload.close()
+        await self._prune()
+
+    async def _prune(self):
+        if time.time() - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = time.time()
+        doomed = await run_blocking(self.store.prune, time.time() - VISION_JOB_RETENTION)
+        for job_id in doomed:
+            await run_blocking(shutil.rmtree, os.path.join(self.spool_dir, job_id), True)
+
+    # ---------- reads ----------
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await run_blocking(self.store.get, job_id)
+        if job is None:
+            return None
+        job.pop("request")
+        if job["status"] == RUNNING and job_id in self._partials:
+            job["partial"] = self._partials[job_id]
+        return job
+
+    def _publish(self, job_id: str, event: str, data: dict, final: bool = False):
+        if event == "partial":
+            self._partials[job_id] = data["text"]
+        if final:
+            self._partials.pop(job_id, None)
+        for subscriber in self._subscribers.get(job_id, []):
+            subscriber.put_nowait((event, data, final))
+
+    async def events(self, job_id: str) -> AsyncIterator[tuple]:
+        """ (event, data) pairs: the job's history so far, then live events until it finishes """
+        live: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(live)  # before the read: no gap
+        try:
+            job = await run_blocking(self.store.get, job_id)
+            if job is None:
+                return
+            replayed = set()
+            for stage, at in job["stages"]:
+                replayed.add((stage, at))
+                yield "stage", {"stage": stage, "at": at}
+            if job["status"] in TERMINAL:
+                yield "result", {"status": job["status"], "result": job["result"], "error": job["error"]}
+                return
+            if job_id in self._partials:
+                yield "partial", {"text": self._partials[job_id]}
+            while True:
+                try:
+                    event, data, final = await asyncio.wait_for(live.get(), VISION_JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Nothing live: the job may be running in another worker, whose progress is only in the store
+                    job = await run_blocking(self.store.get, job_id)
+                    if job is None:
+                        return
+                    for stage, at in job["stages"]:
+                        if (stage, at) not in replayed:
+                            replayed.add((stage, at))
+                            yield "stage", {"stage": stage, "at": at}
+                    if job["status"] in TERMINAL:
+                        yield "result", {"status": job["status"], "result": job["result"], "error": job["error"]}
+                        return
+                    continue
+                if event == "stage" and "at" in data:
+                    if (data["stage"], data["at"]) in replayed:
+                        continue  # published while the history was being read, or already polled
+                    replayed.add((data["stage"], data["at"]))
+                yield event, data
+                if final:
+                    return
+        finally:
+            self._subscribers[job_id].remove(live)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    def stats(self) -> dict:
+        durations = sorted(self._durations)
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered_after_restart": self.recovered,
+            "stored": self.store.counts(),
+            "duration_ms": {
+                "p50": round(durations[len(durations) // 2] * 1000, 1) if durations else 0.0,
+                "p95": round(durations[int(len(durations) * 0.95)] * 1000, 1) if durations else 0.0,
+            },
+        }
+
+
+def sse_event(event: str, data: Any) -> str:
+    """ One Server-Sent Events frame """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
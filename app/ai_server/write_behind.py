@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+import contextlib
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from concurrency import run_blocking
+
+# ==========================================
+# WRITE-BEHIND MEMORY WRITES
+# ==========================================
+# Feedback endpoints (agree / correct / archive) append one row to a local
+# SQLite journal and return. A background flusher drains the journal in
+# batches of WRITE_BEHIND_BATCH_SIZE rows, oldest first: one embed call per
+# batch, one upsert per collection, one reinforcement update. Rows are
+# deleted only after Chroma accepted them, and anything left over is
+# replayed on startup.
+#
+# A failed batch is split in halves. When one half goes in and the other
+# does not, the failing half is split again until the rows that fail on
+# their own are isolated; those are parked (kept in the journal, skipped
+# until the next start) so they cannot block the rest. When both halves fail
+# the cause is not a row (embedder down, ...): the flusher backs off
+# (doubling up to WRITE_BEHIND_MAX_BACKOFF) and reads stop waiting on it.
+# Adds are upserts keyed by a pre-assigned ID, so a replay is idempotent.
+# Several workers may share one journal file: each row records its writer's
+# pid, and a starting worker only adopts rows whose writer is no longer alive.
+#
+# New rows pass through an optional `consolidate` hook before the upsert; rows
+# it reports as merged into an existing entry are not stored (consolidation.py).
+# Their counts went into that entry with the hook's increment, so they leave
+# the journal right then, before the upsert of the rows that are kept: a
+# failed upsert, a split batch or a replay cannot merge them a second time.
+#
+# Read-your-writes: a request that reads a collection calls settle(), which
+# flushes that collection's pending rows first, unless flushes are currently
+# failing (then the read goes ahead without them). Collection versions are
+# bumped on append, so cached results never hide a queued write.
+
+WRITE_BEHIND_JOURNAL_PATH = os.getenv("WRITE_BEHIND_JOURNAL_PATH", "./memory_journal.sqlite3")
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "32"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "2.0"))  # seconds
+WRITE_BEHIND_MAX_BACKOFF = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF", "60"))  # seconds between failing flushes
+
+OP_ADD = "add"              # {"id", "document", "metadata", "embed_text"}
+OP_REINFORCE = "reinforce"  # {"rule_ids": [...], "citations": [...unresolved free text]}
+
+
+def new_memory_id(prefix: str) -> str:
+    """ Collision-free ID (ns timestamp keeps rough insertion order, uuid breaks ties) """
+    return f"{prefix}_{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+
+
+def _pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MemoryJournal:
+    """ Durable append-only log of pending memory writes (SQLite, fsync on commit) """
+
+    def __init__(self, path: str = WRITE_BEHIND_JOURNAL_PATH):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT, op TEXT, payload TEXT, created_at REAL,"
+            " writer INTEGER)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(journal)")}
+        if "writer" not in columns:  # journals written before rows were tagged
+            self._db.execute("ALTER TABLE journal ADD COLUMN writer INTEGER")
+        self._db.commit()
+        self.pid = os.getpid()
+
+    def append(self, collection: str, op: str, payload: dict) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO journal (collection, op, payload, created_at, writer) VALUES (?, ?, ?, ?, ?)",
+                (collection, op, json.dumps(payload), time.time(), self.pid),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def adopt_orphans(self) -> int:
+        """ Takes over rows left by writers that have exited (crash / restart) """
+        with self._lock:
+            writers = [w for (w,) in self._db.execute("SELECT DISTINCT writer FROM journal").fetchall()]
+            dead = [w for w in writers if w != self.pid and not _pid_alive(w)]
+            for writer in dead:
+                self._db.execute("UPDATE journal SET writer = ? WHERE writer IS ?", (self.pid, writer))
+            self._db.commit()
+            return len(dead)
+
+    def pending(self) -> List[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, collection, op, payload FROM journal WHERE writer = ? ORDER BY seq", (self.pid,)
+            ).fetchall()
+        return [{"seq": s, "collection": c, "op": o, "payload": json.loads(p)} for s, c, o, p in rows]
+
+    def remove(self, seqs: List[int]):
+        with self._lock:
+            self._db.executemany("DELETE FROM journal WHERE seq = ?", [(s,) for s in seqs])
+            self._db.commit()
+
+
+class WriteBehindQueue:
+    """ Journals memory writes and applies them to Chroma in batches """
+
+    def __init__(self, journal: MemoryJournal, collections: Dict[str, object],
+                 embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 batch_size: int = WRITE_BEHIND_BATCH_SIZE, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL,
+                 consolidate: Optional[Callable[..., Awaitable[List[Optional[str]]]]] = None):
+        self.journal = journal
+        self.collections = collections   # name -> AsyncCollection
+        self.embed_many = embed_many
+        self.consolidate = consolidate   # (collection, ids, documents, metadatas, vectors) -> merged-into IDs
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[dict] = []
+        self._parked: List[dict] = []  # rows that failed on their own (still journaled)
+        self._retry_at = 0.0  # monotonic time before which a failing flusher does not retry
+        self._backoff = 0.0
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.flushes = 0
+        self.applied = 0
+        self.failures = 0
+        self.replayed = 0
+        self.merged = 0
+
+    # ---------- lifecycle ----------
+    async def start(self):
+        """ Replays anything the previous process journaled but never applied """
+        await run_blocking(self.journal.adopt_orphans)
+        leftovers = await run_blocking(self.journal.pending)
+        known = {entry["seq"] for entry in self._pending}
+        self._pending.extend(e for e in leftovers if e["seq"] not in known)
+        self._pending.sort(key=lambda e: e["seq"])
+        self.replayed += len(leftovers)
+        if leftovers:
+            print(f"📒 Replaying {len(leftovers)} journaled memory writes")
+        self._ensure_running()
+        if leftovers:
+            self._wake.set()
+
+    async def stop(self):
+        """ Final flush on shutdown (whatever fails stays in the journal) """
+        self._closing = True
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+        await self.flush(force=True)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._wake = asyncio.Event()  # bound to the current loop
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._pending and not self.failing:
+                await self.flush()
+
+    # ---------- producers ----------
+    async def submit(self, collection: str, op: str, payload: dict) -> int:
+        """ Returns once the write is durable in the journal """
+        seq = await run_blocking(self.journal.append, collection, op, payload)
+        self._pending.append({"seq": seq, "collection": collection, "op": op, "payload": payload})
+        self.collections[collection].version += 1  # invalidates results derived from the old contents
+        self._ensure_running()
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        return seq
+
+    async def add(self, collection: str, id_: str, document: str, metadata: dict,
+                  embed_text: Optional[str] = None) -> int:
+        return await self.submit(collection, OP_ADD, {
+            "id": id_, "document": document, "metadata": metadata, "embed_text": embed_text or document,
+        })
+
+    async def reinforce(self, collection: str, rule_ids: List[str], citations: List[str] = ()) -> int:
+        return await self.submit(collection, OP_REINFORCE, {"rule_ids": list(rule_ids), "citations": list(citations)})
+
+    # ---------- consumer ----------
+    def pending_for(self, collection: str) -> int:
+        return sum(1 for entry in self._pending if entry["collection"] == collection)
+
+    @property
+    def failing(self) -> bool:
+        """ The last flush could not apply its rows and the backoff has not run out """
+        return time.monotonic() < self._retry_at
+
+    async def settle(self, *collections: str):
+        """ Read-your-writes: flushes before a read if any of these collections has queued rows """
+        if any(self.pending_for(name) for name in collections) and not self.failing:
+            await self.flush()
+
+    @contextlib.asynccontextmanager
+    async def exclusive(self, *collections: str):
+        """ Settles these collections, then holds off flushes (e.g. while the compactor rewrites one) """
+        await self.settle(*collections)
+        async with self._flush_lock:
+            yield
+
+    async def flush(self, force: bool = False):
+        """ Applies pending rows batch by batch; stops at a batch that has to be retried later """
+        async with self._flush_lock:
+            while self._pending and (force or not self.failing):
+                batch = self._pending[:self.batch_size]
+                done, poison, retry = await self._apply_isolating(batch)
+                if done:
+                    await run_blocking(self.journal.remove, [entry["seq"] for entry in done])
+                finished = {entry["seq"] for entry in done + poison}
+                self._pending = [e for e in self._pending if e["seq"] not in finished]
+                for entry in poison:
+                    print(f"⚠️ Write-behind row {entry['seq']} ({entry['collection']}) fails on its own; parked")
+                self._parked.extend(poison)
+                self.flushes += 1
+                self.applied += len(done)
+                if retry:
+                    self._backoff = min(max(self._backoff * 2, self.flush_interval), WRITE_BEHIND_MAX_BACKOFF)
+                    self._retry_at = time.monotonic() + self._backoff
+                    print(f"⚠️ Write-behind flush failing; {len(self._pending)} writes retry in {self._backoff:.0f}s")
+                    return
+                self._backoff, self._retry_at = 0.0, 0.0
+
+    async def _apply_isolating(self, rows: List[dict], proven: bool = False, top: bool = True):
+        """ -> (applied, poison, retry). proven: some row of this flush went in, so a row
+        failing alone here is the row's fault, not the embedder's or the store's """
+        done = await self._apply(rows)
+        applied_seqs = {entry["seq"] for entry in done}
+        failed = [entry for entry in rows if entry["seq"] not in applied_seqs]
+        proven = proven or bool(done)
+        if not failed:
+            return done, [], []
+        if len(failed) == 1:
+            return (done, failed, []) if proven else (done, [], failed)
+        if not proven and not top:
+            return done, [], failed  # nothing has gone in yet: no point splitting an outage further
+        applied, poison, retry = list(done), [], []
+        half = len(failed) // 2
+        for part in (failed[:half], failed[half:]):
+            part_done, part_poison, part_retry = await self._apply_isolating(part, proven, top=False)
+            applied += part_done
+            poison += part_poison
+            retry += part_retry
+            proven = proven or bool(part_done)
+        if retry and proven:
+            # The first half gave up before the second proved the store works: isolate it now
+            again_done, again_poison, retry = await self._apply_isolating(retry, True, top=False)
+            applied += again_done
+            poison += again_poison
+        return applied, poison, retry
+
+    async def _apply(self, batch: List[dict]) -> List[dict]:
+        """ Applies a batch; returns the entries that made it into Chroma """
+        adds = [e for e in batch if e["op"] == OP_ADD]
+        reinforcements = [e for e in batch if e["op"] == OP_REINFORCE]
+
+        # Collect every text that needs a vector (documents + unresolved citations): one embed call
+        texts = [e["payload"]["embed_text"] for e in adds]
+        texts += [c for e in reinforcements for c in e["payload"]["citations"]]
+        try:
+            vectors = await self.embed_many(texts) if texts else []
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ Write-behind embed failed ({e}); {len(batch)} writes stay journaled")
+            return []
+        add_vectors = vectors[:len(adds)]
+        citation_vectors, offset = {}, len(adds)
+        for entry in reinforcements:
+            count = len(entry["payload"]["citations"])
+            citation_vectors[entry["seq"]] = vectors[offset:offset + count]
+            offset += count
+
+        done = []
+        by_collection: Dict[str, List[int]] = {}
+        for i, entry in enumerate(adds):
+            by_collection.setdefault(entry["collection"], []).append(i)
+        for name, positions in by_collection.items():
+            entries = [adds[i] for i in positions]
+            collection = self.collections[name]
+            ids = [e["payload"]["id"] for e in entries]
+            documents = [e["payload"]["document"] for e in entries]
+            metadatas = [dict(e["payload"]["metadata"]) for e in entries]
+            embeddings = [add_vectors[i] for i in positions]
+            try:
+                keep = list(range(len(entries)))
+                if self.consolidate is not None:
+                    targets = await self.consolidate(collection, ids, documents, metadatas, embeddings)
+                    keep = [k for k, target in enumerate(targets) if target is None]
+                    self.merged += len(entries) - len(keep)
+                    position = {id_: k for k, id_ in enumerate(ids)}
+                    into_existing = [  # directly, or via a row of this batch that was merged itself
+                        k for k, target in enumerate(targets)
+                        if target is not None and (target not in position or targets[position[target]] is not None)
+                    ]
+                    if into_existing:
+                        await run_blocking(self.journal.remove, [entries[k]["seq"] for k in into_existing])
+                        done.extend(entries[k] for k in into_existing)
+                        finished = set(into_existing)
+                        entries = [e for k, e in enumerate(entries) if k not in finished]
+                if keep:
+                    await collection.upsert(
+                        ids=[ids[k] for k in keep],
+                        documents=[documents[k] for k in keep],
+                        embeddings=[embeddings[k] for k in keep],
+                        metadatas=[metadatas[k] for k in keep],
+                    )
+                done.extend(entries)
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Write-behind upsert into {name} failed: {e}")
+
+        for name in dict.fromkeys(e["collection"] for e in reinforcements):
+            entries = [e for e in reinforcements if e["collection"] == name]
+            collection = self.collections[name]
+            rule_ids = Counter()
+            try:
+                for entry in entries:
+                    rule_ids.update(entry["payload"]["rule_ids"])
+                    if entry["payload"]["citations"]:
+                        results = await collection.query(query_embeddings=citation_vectors[entry["seq"]], n_results=1)
+                        rule_ids.update(row[0] for row in results["ids"] if row)
+                await collection.registry.reinforce(collection, list(rule_ids.elements()))
+                done.extend(entries)
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️ Write-behind reinforcement of {name} failed: {e}")
+        return done
+
+    def stats(self) -> dict:
+        oldest = min((e["seq"] for e in self._pending), default=None)
+        return {
+            "pending": len(self._pending),
+            "pending_by_collection": dict(Counter(e["collection"] for e in self._pending)),
+            "parked": len(self._parked),
+            "parked_seqs": [e["seq"] for e in self._parked][:50],
+            "failing": self.failing,
+            "backoff_s": self._backoff,
+            "oldest_pending_seq": oldest,
+            "batch_size": self.batch_size,
+            "flush_interval_s": self.flush_interval,
+            "flushes": self.flushes,
+            "applied": self.applied,
+            "failures": self.failures,
+            "replayed": self.replayed,
+            "merged_on_write": self.merged,
+        }